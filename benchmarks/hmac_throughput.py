@@ -0,0 +1,68 @@
+"""HMAC sign/verify throughput benchmark (CPython, host side)
+
+"before" rebuilds the key schedule for every packet the way the Zombiegram code used to (hmac.new per call and a second
+digest() for verification). "after" uses the cached keyed context from hmac.context().
+
+Usage: python benchmarks/hmac_throughput.py [iterations]
+"""
+
+import hashlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "network_core"))
+
+import hmac as hmaclib  # network_core/hmac.py shadows the standard library module
+
+TRUST_KEY = b"benchmark-key"
+MESSAGE = bytes(range(54))  # Largest hmacless Zombiegram body
+MAC = hmaclib.context(TRUST_KEY, hashlib.sha256).sign(MESSAGE)[:4]
+
+
+def _digest_before(digester, inner_digest):
+    outer = digester.digest_cons(digester.outer_key_translated)
+    outer.update(inner_digest)
+    return outer.digest()
+
+
+def sign_before():
+    digester = hmaclib.HMACContext(TRUST_KEY, hashlib.sha256)
+    inner = digester.digest_cons(digester.inner_key_translated)
+    inner.update(MESSAGE)
+    return _digest_before(digester, inner.digest())[:4]
+
+
+def verify_before():
+    digester = hmaclib.HMACContext(TRUST_KEY, hashlib.sha256)
+    inner = digester.digest_cons(digester.inner_key_translated)
+    inner.update(MESSAGE)
+    _digest_before(digester, inner.digest())
+    return _digest_before(digester, inner.digest())[:4] == MAC
+
+
+def sign_after():
+    return hmaclib.context(TRUST_KEY, hashlib.sha256).sign(MESSAGE)[:4]
+
+
+def verify_after():
+    return hmaclib.context(TRUST_KEY, hashlib.sha256).verify(MESSAGE, MAC)
+
+
+def throughput(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return iterations / (time.perf_counter() - start)
+
+
+def main(iterations):
+    print("{:<10}{:>16}{:>16}{:>10}".format("operation", "before (op/s)", "after (op/s)", "speedup"))
+    for name, before, after in (("sign", sign_before, sign_after), ("verify", verify_before, verify_after)):
+        before_ops = throughput(before, iterations)
+        after_ops = throughput(after, iterations)
+        print("{:<10}{:>16.0f}{:>16.0f}{:>9.1f}x".format(name, before_ops, after_ops, after_ops / before_ops))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,575 @@
+"""LoRa mesh simulator for ZombieRouter (CPython, host side)
+
+Runs many unmodified ZombieRouter instances on a virtual topology in virtual time. The Pycom specific modules are
+replaced by stand-ins: network.LoRa and LoRa.Mesh (a static neighbor table per node), socket.AF_LORA sockets (frames
+are delivered to the neighbors after their time on air plus link latency, or lost with the configured probability),
+machine.unique_id (one id per node), _thread (threads are not started, the simulator calls ZombieRouter._tick()
+whenever the processor would have woken up) and Config (one configuration per node).
+
+Every node generates detection payloads at the given rate; gateways record what reaches them. Reported are the
+delivery ratio at the gateways, end-to-end latency percentiles (first transmission to first gateway arrival),
+duplicate transmissions, acknowledgements per data frame (ack storms), the retransmission cache size per node and how
+cache entries ended (threshold reached or attempts used up). --policy compares the adaptive and static retransmission
+thresholds, --loss-spread gives every link its own loss probability.
+
+Usage: python benchmarks/meshsim.py [--nodes 100] [--topology grid|line|random] [--loss 0.1] [--duration 600] ...
+       python benchmarks/meshsim.py --help
+"""
+
+import argparse
+import binascii
+import builtins
+import heapq
+import json
+import logging
+import os
+import random
+import socket
+import sys
+import time
+import types
+import _thread
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+# Appended, the repository's enum.py and logging.py must not shadow the standard library ones
+for directory in ("network_core", "servers", "utilities"):
+    sys.path.append(os.path.join(ROOT, directory))
+
+MESH_STATE_ROUTER = 3
+
+
+##############################
+# Stand-ins of Pycom modules #
+##############################
+
+class Simulator:
+    """Discrete event loop in virtual milliseconds"""
+
+    def __init__(self):
+        self.now_ms = 0
+        self._events = []
+        self._counter = 0
+
+    def monotonic_ms(self):
+        return self.now_ms
+
+    def schedule(self, at_ms, callback, *args):
+        self._counter += 1
+        heapq.heappush(self._events, (at_ms, self._counter, callback, args))
+
+    def run(self, until_ms):
+        while self._events and self._events[0][0] <= until_ms:
+            at_ms, _, callback, args = heapq.heappop(self._events)
+            self.now_ms = max(self.now_ms, at_ms)
+            callback(*args)
+        self.now_ms = until_ms
+
+
+class NeighborRecord(tuple):
+    """Mimics the namedtuple (mac, role, rloc16, rssi, age) returned by Pycom's Mesh.neighbors()"""
+
+    mac = property(lambda self: self[0])
+    role = property(lambda self: self[1])
+    rloc16 = property(lambda self: self[2])
+    rssi = property(lambda self: self[3])
+    age = property(lambda self: self[4])
+
+
+class SimMesh:
+    """Stand-in for LoRa.Mesh: always attached as router, neighbors come from the topology"""
+
+    def __init__(self, node):
+        self._node = node
+        self._rx_callback = None
+
+    def state(self):
+        return MESH_STATE_ROUTER
+
+    def single(self):
+        return not self._node.links
+
+    def rloc(self):
+        return self._node.rloc16
+
+    def ipaddr(self):
+        return [self._node.ip_eid, self._node.ip_rloc, self._node.ip_link]
+
+    def neighbors(self):
+        return [NeighborRecord((node.mac, MESH_STATE_ROUTER, node.rloc16, link.rssi, 0)) for node, link in self._node.links]
+
+    def rx_cb(self, callback, *args):
+        self._rx_callback = callback
+
+    def deinit(self):
+        self._rx_callback = None
+
+    def cli(self, command):
+        return ""
+
+
+class SimLoRa:
+    """Stand-in for network.LoRa"""
+
+    LORA = 0
+    EU868 = 5
+    BW_125KHZ = 0
+    BW_250KHZ = 1
+    BW_500KHZ = 2
+
+    def __init__(self, node=None, sf=7, **kwargs):
+        self._node = node
+        self._sf = sf
+
+    def Mesh(self):
+        self._node.mesh = SimMesh(self._node)
+        return self._node.mesh
+
+    def sf(self, sf=None):
+        return self._sf
+
+    def bandwidth(self, bandwidth=None):
+        return SimLoRa.BW_125KHZ
+
+
+class SimSocket:
+    """Stand-in for an AF_LORA raw socket of a single node"""
+
+    def __init__(self, node):
+        self._node = node
+        self._inbox = []
+
+    def bind(self, port):
+        pass
+
+    def close(self):
+        pass
+
+    def sendto(self, data, address):
+        self._node.network.transmit(self._node, bytes(data), address[0])
+
+    def recvfrom(self, size):
+        if not self._inbox:
+            return b"", ("", 0)
+        data, address = self._inbox.pop(0)
+        return data[:size], (address, 0)
+
+
+def socket_module_for(node):
+    module = types.ModuleType("socket")
+    module.AF_LORA = 160
+    module.SOCK_RAW = 3
+    module.socket = lambda family, kind: SimSocket(node) if family == module.AF_LORA else None
+    return module
+
+
+def install_stand_ins(sim):
+    """Register the stand-in modules that the repository modules import"""
+    network = types.ModuleType("network")
+    network.LoRa = SimLoRa
+    network.WLAN = object
+    sys.modules["network"] = network
+
+    machine = types.ModuleType("machine")
+    machine.unique_id = lambda: b"\x00\x00\x00\x00\x00\x00"
+    machine.SD = object
+    sys.modules["machine"] = machine
+
+    ubinascii = types.ModuleType("ubinascii")
+    ubinascii.hexlify = lambda data, sep="": binascii.hexlify(data, sep) if sep else binascii.hexlify(data)
+    sys.modules["ubinascii"] = ubinascii
+
+    thread = types.ModuleType("_thread")
+    thread.allocate_lock = _thread.allocate_lock
+    thread.start_new_thread = lambda function, args: None # Processor loops are driven by the simulator instead
+    sys.modules["_thread"] = thread
+
+    sys.modules["pycom"] = types.ModuleType("pycom")
+    sys.modules["usocket"] = socket # Only imported, gateway webhooks are not simulated
+    wifi = types.ModuleType("wifi")
+    wifi.WifiManager = type("WifiManager", (), {"is_uplink_available": staticmethod(lambda: False)})
+    sys.modules["wifi"] = wifi
+    sys.modules["utime"] = time
+    builtins.const = lambda value: value
+
+    # The repository's hmac.py and enum.py can not be imported by name next to the standard library ones
+    sys.modules["hmac"] = load_module("hmac", os.path.join(ROOT, "network_core", "hmac.py"))
+    repository_enum = load_module("zombie_enum", os.path.join(ROOT, "utilities", "enum.py"))
+    standard_enum = sys.modules["enum"]
+    sys.modules["enum"] = repository_enum
+    try:
+        loramesh = load_module("loramesh", os.path.join(ROOT, "network_core", "loramesh.py"))
+    finally:
+        sys.modules["enum"] = standard_enum
+    for name in ("DISABLED", "DETACHED", "CHILD", "ROUTER", "LEADER", "LEADER_SINGLE"):
+        setattr(loramesh, "STATE_" + name, getattr(loramesh.Loramesh, "STATE_" + name)) # µpython const() inlines these
+    sys.modules["loramesh"] = loramesh
+
+    import clock
+    clock.monotonic_ms = sim.monotonic_ms
+
+
+_code_cache = {}
+
+
+def load_module(name, path):
+    """Execute a source file into a new module object, every call yields an independent copy"""
+    if path not in _code_cache:
+        with open(path) as f:
+            _code_cache[path] = compile(f.read(), path, "exec")
+    module = types.ModuleType(name)
+    module.__file__ = path
+    exec(_code_cache[path], module.__dict__)
+    return module
+
+
+#####################
+# Topology and radio #
+#####################
+
+class Link:
+    def __init__(self, loss, rssi):
+        self.loss = loss
+        self.rssi = rssi
+
+
+class Node:
+    def __init__(self, network, index, gateway):
+        self.network = network
+        self.index = index
+        self.gateway = gateway
+        self.forger = False # Signs with a key the rest of the mesh does not know
+        self.mac = 0x70B3D50000000000 | (index + 1)
+        self.wifi_mac = 0x240AC4000000 | ((index + 1) * 0x9E3779 & 0xFFFFFF) # machine.unique_id() of a LoPy
+        self.source_id = self.wifi_mac & 0xFFFFFFFF # Unrelated to the mesh MAC, as on the hardware
+        self.rloc16 = 0x0400 + index
+        self.ip_eid = "fdde:ad00:beef:0:{:x}:{:x}:{:x}:{:x}".format(0x1000, index >> 8, index & 0xFF, 1)
+        self.ip_rloc = "fdde:ad00:beef:0:0:ff:fe00:{:x}".format(self.rloc16)
+        interface_id = self.mac ^ (1 << 57) # EUI-64 with the universal/local bit flipped
+        self.ip_link = "fe80::{:x}:{:x}:{:x}:{:x}".format(interface_id >> 48, (interface_id >> 32) & 0xFFFF, (interface_id >> 16) & 0xFFFF, interface_id & 0xFFFF)
+        self.links = [] # [(Node, Link)]
+        self.mesh = None
+        self.socket = None
+        self.router = None
+        self.radio_free_at = 0
+        self.tick_at = None
+        self.tick_pending = False
+        self.cache_samples = []
+
+
+class WakeupEvent:
+    """Stand-in for event.Event: set() schedules an immediate processor tick"""
+
+    def __init__(self, network, node):
+        self._network = network
+        self._node = node
+
+    def set(self):
+        self._network.schedule_tick(self._node, self._network.sim.now_ms)
+
+    def is_set(self):
+        return self._node.tick_pending
+
+    def wait(self, timeout):
+        return False
+
+
+class GatewaySink:
+    """Stand-in for the GatewayUplink of a gateway node: frames the router hands over for the webhooks are recorded as
+    gateway arrivals instead of being delivered over HTTP"""
+
+    def __init__(self, network, node):
+        self._network = network
+        self._node = node
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def enqueue(self, frame, trusted=False):
+        self._network.metrics.gateway_arrival(self._node, self._network.zombiegram.ZombiegramView(frame))
+        return 1
+
+
+class Network:
+    def __init__(self, args):
+        self.args = args
+        self.sim = Simulator()
+        self.rng = random.Random(args.seed)
+        install_stand_ins(self.sim)
+        import zombiegram
+        import airtime
+        self.zombiegram = zombiegram
+        self.airtime = airtime
+        self._router_path = os.path.join(ROOT, "servers", "zombieRouter.py")
+        self.nodes = []
+        self.by_ip = {}
+        self.metrics = Metrics(self)
+
+    def build(self):
+        args = self.args
+        gateways = set(self.rng.sample(range(args.nodes), min(args.gateways, args.nodes)))
+        for index in range(args.nodes):
+            self.nodes.append(Node(self, index, index in gateways))
+        sensors = [node for node in self.nodes if not node.gateway]
+        for node in self.rng.sample(sensors, min(args.forgers, len(sensors))):
+            node.forger = True
+        for a, b in self._topology_pairs():
+            rssi = self.rng.randint(-120, -70)
+            loss = self.args.loss
+            if self.args.loss_spread:
+                loss = min(0.99, max(0.0, loss + self.rng.uniform(-self.args.loss_spread, self.args.loss_spread)))
+            self.nodes[a].links.append((self.nodes[b], Link(loss, rssi)))
+            self.nodes[b].links.append((self.nodes[a], Link(loss, rssi)))
+        for node in self.nodes:
+            for ip in (node.ip_eid, node.ip_rloc, node.ip_link):
+                self.by_ip[ip] = node
+            self._boot(node)
+
+    def _topology_pairs(self):
+        count = self.args.nodes
+        if self.args.topology == "line":
+            return [(i, i + 1) for i in range(count - 1)]
+        if self.args.topology == "grid":
+            width = max(1, int(count ** 0.5))
+            pairs = []
+            for i in range(count):
+                if (i + 1) % width and i + 1 < count:
+                    pairs.append((i, i + 1))
+                if i + width < count:
+                    pairs.append((i, i + width))
+            return pairs
+        # Random geometric graph in a unit square, radius chosen for the requested mean degree
+        positions = [(self.rng.random(), self.rng.random()) for _ in range(count)]
+        radius = (self.args.degree / (3.14159 * max(count - 1, 1))) ** 0.5
+        return [(i, j) for i in range(count) for j in range(i + 1, count)
+                if (positions[i][0] - positions[j][0]) ** 2 + (positions[i][1] - positions[j][1]) ** 2 <= radius ** 2]
+
+    def _boot(self, node):
+        from volatileconfiguration import VolatileConfiguration
+        config = type("Config", (VolatileConfiguration,), {"_configuration": {}})
+        config.set("device_trust_key", self.args.trust_key + ("-forged" if node.forger else ""), False)
+        config.set("lora_verify_before_forward", self.args.verify, False)
+        config.set("device_is_gateway", node.gateway, False)
+        config.set("lora_batch_linger_ms", self.args.linger_ms, False)
+        config.set("lora_retransmission_policy", self.args.policy, False)
+
+        sys.modules["machine"].unique_id = lambda: node.wifi_mac.to_bytes(6, "big")
+        router_module = load_module("zombieRouter", self._router_path)
+        router_module.Config = config
+        router_module.monotonic_ms = self.sim.monotonic_ms
+        router_module.socket = socket_module_for(node)
+
+        router = router_module.ZombieRouter(SimLoRa(node, sf=self.args.sf))
+        router._airtime_budget = self.airtime.AirtimeBudget(self.args.duty_cycle, now=self.sim.now_ms)
+        router._wakeup = WakeupEvent(self, node)
+        if node.gateway:
+            router._gateway_uplink = GatewaySink(self, node)
+        node.router = router
+        router.start()
+        node.socket = router._socket
+        self.schedule_tick(node, self.rng.randint(0, 1000))
+
+    def schedule_tick(self, node, at_ms):
+        if node.tick_at is not None and node.tick_at <= at_ms:
+            return
+        node.tick_at = at_ms
+        node.tick_pending = True
+        self.sim.schedule(at_ms, self._tick, node, at_ms)
+
+    def _tick(self, node, at_ms):
+        if node.tick_at != at_ms: # Superseded by an earlier tick
+            return
+        node.tick_at = None
+        node.tick_pending = False
+        seconds = node.router._tick()
+        self.schedule_tick(node, self.sim.now_ms + int(seconds * 1000))
+
+    def transmit(self, sender, data, address):
+        """Put a frame on the air: serialized per sender, delivered to every (or one) neighbor after its time on air"""
+        start = max(self.sim.now_ms, sender.radio_free_at)
+        airtime = self.airtime.time_on_air_ms(len(data) + 25, self.args.sf)
+        sender.radio_free_at = start + airtime
+        self.metrics.transmitted(sender, data)
+
+        target = None if address.startswith("ff0") else self.by_ip.get(address)
+        for node, link in sender.links:
+            if target is not None and node is not target:
+                continue
+            if self.rng.random() < link.loss:
+                self.metrics.lost += 1
+                continue
+            latency = self.args.latency_ms + self.rng.uniform(0, self.args.jitter_ms)
+            self.sim.schedule(int(start + airtime + latency), self._deliver, node, data, sender.ip_link)
+
+    def _deliver(self, node, data, source_ip):
+        if node.mesh is None or node.mesh._rx_callback is None:
+            return
+        node.socket._inbox.append((data, source_ip))
+        node.mesh._rx_callback()
+
+    def generate_traffic(self):
+        interval_ms = 60000.0 / self.args.rate
+        for node in self.nodes:
+            self.sim.schedule(int(self.rng.expovariate(1 / interval_ms)), self._originate, node, interval_ms)
+
+    def _originate(self, node, interval_ms):
+        if self.sim.now_ms < self.args.duration * 1000:
+            payload = self.zombiegram.DetectionPayload(self.rng.randint(0, 100), self.rng.randint(0, 255))
+            node.router.queue_zombiegram(self.args.priority, payload)
+            self.metrics.queued += 1
+            self.sim.schedule(self.sim.now_ms + int(self.rng.expovariate(1 / interval_ms)) + 1, self._originate, node, interval_ms)
+
+    def sample(self):
+        for node in self.nodes:
+            node.cache_samples.append(node.router.retransmission_count())
+        self.sim.schedule(self.sim.now_ms + 1000, self.sample)
+
+
+###########
+# Metrics #
+###########
+
+class Metrics:
+    def __init__(self, network):
+        self.network = network
+        self.queued = 0
+        self.lost = 0
+        self.data_transmissions = 0
+        self.ack_transmissions = 0
+        self.originals = [] # [ms of the first transmission by its source, ms of the first gateway arrival or None]
+        self.current = {} # (source_id, seq_num) => (index in originals, frame); sequence numbers wrap around at 256
+        self.transmitted_by = set() # (node index, index in originals)
+        self.ack_seconds = {} # Second => acks sent network wide
+
+    def transmitted(self, sender, data):
+        view = self.network.zombiegram.ZombiegramView(data)
+        acknowledgements = (self.network.zombiegram.AcknowledgePayload, self.network.zombiegram.MultiAcknowledgePayload)
+        if all(isinstance(p, acknowledgements) for p in view.get_payloads()):
+            self.ack_transmissions += 1
+            second = self.network.sim.now_ms // 1000
+            self.ack_seconds[second] = self.ack_seconds.get(second, 0) + 1
+            return
+        self.data_transmissions += 1
+        key = (view.source_id, view.seq_num)
+        current = self.current.get(key)
+        if sender.source_id == view.source_id and (current is None or current[1] != data): # A new original
+            if sender.gateway or sender.forger:
+                return # Trivially delivered or not meant to be, left out of the statistics
+            current = (len(self.originals), data)
+            self.current[key] = current
+            self.originals.append([self.network.sim.now_ms, None])
+        if current is not None:
+            self.transmitted_by.add((sender.index, current[0]))
+
+    def gateway_arrival(self, node, zombiegram):
+        current = self.current.get((zombiegram.source_id, zombiegram.seq_num))
+        if current is not None and self.originals[current[0]][1] is None:
+            self.originals[current[0]][1] = self.network.sim.now_ms
+
+    @staticmethod
+    def percentile(values, fraction):
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(fraction * len(values)))]
+
+    def report(self):
+        originals = self.originals
+        latencies = sorted(arrived - sent for sent, arrived in originals if arrived is not None)
+        nodes = self.network.nodes
+        cache_peaks = [max(node.cache_samples) if node.cache_samples else 0 for node in nodes]
+        cache_means = [sum(node.cache_samples) / len(node.cache_samples) if node.cache_samples else 0 for node in nodes]
+        return {
+            "nodes": len(nodes),
+            "gateways": sum(1 for node in nodes if node.gateway),
+            "links": sum(len(node.links) for node in nodes) // 2,
+            "payloads_queued": self.queued,
+            "zombiegrams_originated": len(originals),
+            "delivery_ratio": len(latencies) / len(originals) if originals else None,
+            "latency_ms": {"p50": self.percentile(latencies, 0.5), "p90": self.percentile(latencies, 0.9),
+                           "p99": self.percentile(latencies, 0.99), "max": latencies[-1] if latencies else None},
+            "data_transmissions": self.data_transmissions,
+            "duplicate_transmissions": self.data_transmissions - len(self.transmitted_by),
+            "ack_transmissions": self.ack_transmissions,
+            "acks_per_data_transmission": self.ack_transmissions / self.data_transmissions if self.data_transmissions else None,
+            "peak_acks_per_second": max(self.ack_seconds.values()) if self.ack_seconds else 0,
+            "frames_lost": self.lost,
+            "retransmission_cache": {"mean": sum(cache_means) / len(nodes), "peak": max(cache_peaks),
+                                     "delivered": sum(node.router._retransmission_cache.delivered for node in nodes),
+                                     "exhausted": sum(node.router._retransmission_cache.exhausted for node in nodes),
+                                     "per_node_peak": cache_peaks},
+        }
+
+
+def print_report(report, per_node):
+    print("{} nodes, {} gateways, {} links".format(report["nodes"], report["gateways"], report["links"]))
+    print("payloads queued            {}".format(report["payloads_queued"]))
+    print("zombiegrams originated     {}".format(report["zombiegrams_originated"]))
+    ratio = report["delivery_ratio"]
+    print("delivery ratio             {}".format("n/a" if ratio is None else "{:.3f}".format(ratio)))
+    print("latency ms p50/p90/p99/max {p50}/{p90}/{p99}/{max}".format(**report["latency_ms"]))
+    print("data transmissions         {}".format(report["data_transmissions"]))
+    print("duplicate transmissions    {}".format(report["duplicate_transmissions"]))
+    print("ack transmissions          {}".format(report["ack_transmissions"]))
+    acks = report["acks_per_data_transmission"]
+    print("acks per data transmission {}".format("n/a" if acks is None else "{:.2f}".format(acks)))
+    print("peak acks per second       {}".format(report["peak_acks_per_second"]))
+    print("frames lost on links       {}".format(report["frames_lost"]))
+    cache = report["retransmission_cache"]
+    print("retransmission cache       mean {:.2f} | peak {}".format(cache["mean"], cache["peak"]))
+    print("cache entries delivered    {} | gave up {}".format(cache["delivered"], cache["exhausted"]))
+    if per_node:
+        for index, peak in enumerate(cache["per_node_peak"]):
+            print("  node {:>4} peak cache {}".format(index, peak))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate a LoRa mesh of ZombieRouter instances")
+    parser.add_argument("--nodes", type=int, default=50)
+    parser.add_argument("--gateways", type=int, default=1)
+    parser.add_argument("--topology", choices=("grid", "line", "random"), default="grid")
+    parser.add_argument("--degree", type=float, default=4, help="Mean neighbor count of the random topology")
+    parser.add_argument("--loss", type=float, default=0.1, help="Frame loss probability per link")
+    parser.add_argument("--loss-spread", type=float, default=0, help="Per link loss drawn uniformly from loss +- spread")
+    parser.add_argument("--latency-ms", type=float, default=5, help="Fixed per hop latency on top of the time on air")
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--duty-cycle", type=float, default=0.01)
+    parser.add_argument("--sf", type=int, default=7)
+    parser.add_argument("--rate", type=float, default=1, help="Detections per node per minute")
+    parser.add_argument("--priority", type=int, default=2)
+    parser.add_argument("--linger-ms", type=int, default=500)
+    parser.add_argument("--policy", choices=("adaptive", "static"), default="adaptive", help="Retransmission policy")
+    parser.add_argument("--duration", type=float, default=300, help="Seconds of traffic generation")
+    parser.add_argument("--drain", type=float, default=120, help="Seconds simulated after the traffic stops")
+    parser.add_argument("--trust-key", default="meshsim")
+    parser.add_argument("--verify", action="store_true", help="Verify frames before acknowledging or forwarding them")
+    parser.add_argument("--forgers", type=int, default=0, help="Nodes signing with a wrong trust key")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--per-node", action="store_true", help="Print the retransmission cache peak of every node")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--log-level", default="ERROR")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=getattr(logging, args.log_level.upper()))
+
+    started = time.time()
+    network = Network(args)
+    network.build()
+    network.generate_traffic()
+    network.sample()
+    network.sim.run(int((args.duration + args.drain) * 1000))
+    report = network.metrics.report()
+    report["wall_clock_s"] = round(time.time() - started, 2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report, args.per_node)
+        print("simulated {:.0f} s in {} s wall clock".format(args.duration + args.drain, report["wall_clock_s"]))
+
+
+if __name__ == "__main__":
+    main()
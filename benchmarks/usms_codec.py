@@ -0,0 +1,101 @@
+"""USMS codec equivalence check and benchmark (CPython, host side)
+
+First checks, on randomly generated messages, that the table driven codec in network_core/usms.py produces
+byte-identical output to the original per-character implementation (kept below as reference). Afterwards µs per
+encode/decode are reported for both.
+
+Usage: python benchmarks/usms_codec.py [random cases] [iterations]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "network_core"))
+
+import usms
+
+ALPHABET = [chr(i) for i in range(ord("a"), ord("z") + 1)]
+ALPHABET += [chr(i) for i in range(ord("0"), ord("9") + 1)]
+ALPHABET += list(",?;.:/\\()[]!&|@#\'\"%*-_+=<> ")
+REFERENCE_CHARS = [None] + ALPHABET
+
+
+def reference_bytes_to_ascii(bytestring):
+    pattern = [(2, 3), (4, 15), (6, 63)]
+    pattern_index = 0
+    ascii_output = []
+    rest_bits = 0
+    for byte in bytestring:
+        six_bit_int_rep = (byte >> pattern[pattern_index][0]) | (rest_bits << (8 - pattern[pattern_index][0]))
+        rest_bits = byte & pattern[pattern_index][1]
+        if six_bit_int_rep not in range(0, len(REFERENCE_CHARS)):
+            raise ValueError(six_bit_int_rep)
+        if REFERENCE_CHARS[six_bit_int_rep] is not None:
+            ascii_output.append(REFERENCE_CHARS[six_bit_int_rep])
+        if pattern_index == 2 and REFERENCE_CHARS[rest_bits] is not None:
+            ascii_output.append(REFERENCE_CHARS[rest_bits])
+        pattern_index = (pattern_index + 1) % 3
+    return "".join(ascii_output)
+
+
+def reference_ascii_to_bytes(asciistring):
+    byte_output = []
+    pattern = [(2, 3, 4), (4, 15, 2), (6, 0, 0)]
+    pattern_index = 0
+    for i in range(0, len(asciistring)):
+        int_rep = REFERENCE_CHARS.index(asciistring[i]) << pattern[pattern_index][0] & 255
+        if pattern_index < 2:
+            next_int_rest = ((REFERENCE_CHARS.index(asciistring[i + 1]) >> pattern[pattern_index][2]) if (i + 1) < len(asciistring) else 0) & pattern[pattern_index][1]
+            int_rep |= next_int_rest
+        byte_output.append(int_rep)
+        pattern_index = (pattern_index + 1) % 3
+    return bytes(byte_output)
+
+
+def check_equivalence(cases, rng):
+    for _ in range(cases):
+        text = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 70)))
+        encoded = usms.ascii_to_bytes(text)
+        assert encoded == reference_ascii_to_bytes(text), text
+        assert usms.bytes_to_ascii(encoded) == reference_bytes_to_ascii(encoded), text
+
+        buffer = bytearray(len(text) + 2)
+        assert usms.encode_into(text, buffer, 2) == len(encoded) and bytes(buffer[2:]) == encoded, text
+
+        # Arbitrary bytes have to be rejected or accepted alike
+        garbage = bytes(rng.getrandbits(8) for _ in range(rng.randint(0, 20)))
+        try:
+            expected = reference_bytes_to_ascii(garbage)
+        except (ValueError, IndexError):
+            expected = None
+        try:
+            result = usms.bytes_to_ascii(garbage)
+        except usms.UsmsCharacterOutOfRange:
+            result = None
+        assert result == expected, garbage
+
+
+def timed(func, argument, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(argument)
+    return (time.perf_counter() - start) * 1e6 / iterations
+
+
+def main(cases, iterations):
+    check_equivalence(cases, random.Random(1337))
+    print("{} random messages: table codec output identical to the reference codec".format(cases))
+
+    text = "zombies spotted near the north gate, send help!"[:54]
+    encoded = usms.ascii_to_bytes(text)
+    print("{:<8}{:>18}{:>18}".format("", "reference (µs)", "table (µs)"))
+    print("{:<8}{:>18.2f}{:>18.2f}".format("encode", timed(reference_ascii_to_bytes, text, iterations),
+                                          timed(usms.ascii_to_bytes, text, iterations)))
+    print("{:<8}{:>18.2f}{:>18.2f}".format("decode", timed(reference_bytes_to_ascii, encoded, iterations),
+                                          timed(usms.bytes_to_ascii, encoded, iterations)))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000, int(sys.argv[2]) if len(sys.argv) > 2 else 10000)
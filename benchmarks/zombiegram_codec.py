@@ -0,0 +1,77 @@
+"""Zombiegram codec microbenchmark (CPython, host side)
+
+Compares the object API (Zombiegram objects, from_package) against the buffer codec (pack_into, ZombiegramRecord)
+and the lazy header-only ZombiegramView per payload type. Reported are µs per operation and the peak amount of
+transient heap bytes a single operation needs.
+
+Usage: python benchmarks/zombiegram_codec.py [iterations]
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "network_core"))
+
+from zombiegram import *
+
+TRUST_KEY = b"benchmark-key"
+
+PAYLOAD_FACTORIES = [
+    ("ack", lambda: [AcknowledgePayload(0x0A0B0C0D, 12)]),
+    ("network change", lambda: [NetworkChange(trust_key=TRUST_KEY)]),
+    ("detection", lambda: [DetectionPayload(80, 3)]),
+    ("usms", lambda: [UsmsPayload("zombies spotted near the north gate, send help")]),
+    ("diagnostic", lambda: [DiagnosticPayload((50.93, 5.33), [0x11111111, 0x22222222], 87, 1, True, True, False, 4)]),
+]
+
+
+def build_zombiegram(factory):
+    zg = Zombiegram(source_id=0x01020304, seq_num=42, priority_flag=2)
+    for payload in factory():
+        zg.add_payload(payload)
+    zg.sign_package(TRUST_KEY)
+    return zg
+
+
+def measure(func, iterations):
+    func()  # Warm up caches
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed_us = (time.perf_counter() - start) * 1e6 / iterations
+
+    tracemalloc.start()
+    func()  # Populate lazily created internals before measuring
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    func()
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    return elapsed_us, peak
+
+
+def main(iterations):
+    print("{:<16}{:<22}{:>10}{:>14}".format("payload", "operation", "µs/op", "peak bytes"))
+    for name, factory in PAYLOAD_FACTORIES:
+        zg = build_zombiegram(factory)
+        frame = zg.get_bytestring_representation()
+        buffer = bytearray(Zombiegram.get_max_package_size())
+        record = ZombiegramRecord()
+
+        results = [
+            ("encode objects", lambda: build_zombiegram(factory).get_bytestring_representation()),
+            ("encode pack_into", lambda: zg.pack_into(buffer)),
+            ("decode from_package", lambda: Zombiegram.from_package(frame)),
+            ("decode view header", lambda: ZombiegramView(frame)),
+            ("decode record", lambda: record.decode(frame)),
+            ("decode record+fields", lambda: [record.decode(frame).payload_fields(i) for i in range(record.payload_count)]),
+        ]
+        for operation, func in results:
+            elapsed_us, peak = measure(func, iterations)
+            print("{:<16}{:<22}{:>10.2f}{:>14}".format(name, operation, elapsed_us, peak))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
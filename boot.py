@@ -52,6 +52,7 @@ Config.set("device_is_sensor", False, True, True) # TODO MANNU CODE
 Config.set("device_is_router", True, True, True) # Is this device a router
 Config.set("device_is_gateway", False, True, False) # Is this device a gateway
 Config.set("device_position", None, True, False) # Device location
+Config.set("diagnostics_interval", 300, True, False) # Seconds between two diagnostic samples on flash, 0 disables them
 
 # WiFi Configuration
 Config.set("wifi_mode", WIFIMODI.OFF, True, False) # Wifi Mode
@@ -71,6 +72,13 @@ Config.set("lora_mode", LORAMESHMODI.OFF, True, False) # Lora mesh Mode
 Config.set("lora_seq_num", int.from_bytes(uos.urandom(1), "big"), True, False) # Lora zombiegram packet sequence numbers
 Config.set("lora_tampered_flag", False, True, False) # Lora zombiegram tampered flag
 Config.set("lora_maintenance_flag", False, True, False) # Lora zombiegram maintance flag
+Config.set("lora_batch_linger_ms", 500, True, False) # Time combinable payloads wait for others to piggyback on
+Config.set("lora_verify_before_forward", False, True, False) # Drop zombiegrams failing trust key verification on arrival, skipped while no trust key is set
+Config.set("lora_retransmission_policy", "adaptive", True, False) # Adaptive or static retransmission thresholds
+Config.set("lora_delivery_target_low", 0.7, True, False) # Target delivery probability of low priority zombiegrams
+Config.set("lora_delivery_target_normal", 0.8, True, False) # Target delivery probability of normal priority zombiegrams
+Config.set("lora_delivery_target_high", 0.9, True, False) # Target delivery probability of high priority zombiegrams
+Config.set("lora_delivery_target_urgent", 0.99, True, False) # Target delivery probability of urgent zombiegrams
 
 # LoRa gateway configuration
 Config.set("gateway_webhook_1", "", True, False) # Gateway hook 1
@@ -81,8 +89,15 @@ Config.set("gateway_webhook_3", "", True, False) # Gateway hook 3
 InputManager.add_input("device_trust_key", str, "", "Device Options", "Device trust key", True)
 InputManager.add_options("lora_tampered_flag", {"On":True, "Off":False}, False, "Device Options", "Device tampered flag (included in all Zombiegrams)")
 InputManager.add_options("lora_maintenance_flag", {"Required":True, "Not Required":False}, False, "Device Options", "Does this device need maintenance?")
+InputManager.add_options("lora_verify_before_forward", {"On":True, "Off":False}, False, "Device Options", "Drop incoming zombiegrams that are not signed with the trust key before acknowledging or forwarding them. Without a trust key every zombiegram is accepted")
+InputManager.add_options("lora_retransmission_policy", {"Adaptive":"adaptive", "Static":"static"}, "adaptive", "Retransmissions", "Learn retransmission thresholds from the observed neighbor ack probabilities or use fixed fractions of the neighbor count")
+InputManager.add_input("lora_delivery_target_low", float, 0.7, "Retransmissions", "Target delivery probability of low priority zombiegrams (adaptive policy)")
+InputManager.add_input("lora_delivery_target_normal", float, 0.8, "Retransmissions", "Target delivery probability of normal priority zombiegrams (adaptive policy)")
+InputManager.add_input("lora_delivery_target_high", float, 0.9, "Retransmissions", "Target delivery probability of high priority zombiegrams (adaptive policy)")
+InputManager.add_input("lora_delivery_target_urgent", float, 0.99, "Retransmissions", "Target delivery probability of urgent zombiegrams (adaptive policy)")
 InputManager.add_options("device_is_router", {"Yes":True, "No":False}, False, "Device Options", "Is this device supposed to act as a router?")
 InputManager.add_options("device_is_sensor", {"Yes":True, "No":False}, False, "Device Options", "Is this device a sensor?")
+InputManager.add_input("diagnostics_interval", int, 300, "Device Options", "Seconds between two diagnostic samples (battery, position, neighbors) kept on flash, 0 disables them")
 InputManager.add_input("gateway_webhook_1", str, "", "Gateway", "Webhook URL (http including) the device should forward messages to. Leave empty for none.")
 InputManager.add_input("gateway_webhook_2", str, "", "Gateway", "Webhook URL (http including) the device should forward messages to. Leave empty for none.")
 InputManager.add_input("gateway_webhook_3", str, "", "Gateway", "Webhook URL (http including) the device should forward messages to. Leave empty for none.")
@@ -97,6 +112,7 @@ InputManager.add_input("ap_static_gateway", str, "", "Wifi", "Access point gatew
 
 InputManager.set_category_priority("Device Options", 50)
 InputManager.set_category_priority("Gateway", 55)
+InputManager.set_category_priority("Retransmissions", 57)
 InputManager.set_category_priority("Wifi", 60)
 
 def p(): pass
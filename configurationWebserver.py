@@ -2,6 +2,9 @@ from microWebServer import MicroWebSrv
 from volatileconfiguration import VolatileConfiguration as Config
 from wifi import WIFIMODI, WifiManager
 import logging
+import metrics
+import struct
+from diagnosticslog import DiagnosticsLog
 from zombiegram import UsmsPayload, UsmsSizeTooLarge, NetworkChange, DetectionPayload, DiagnosticPayload
 
 class InputManager:
@@ -47,35 +50,59 @@ class InputManager:
                     input_parsed = float(raw_input)
                 Config.set(self.config_key, input_parsed, True, True)
 
-        def to_html(self):
+        def to_html(self, value=None):
+            """Render the input field
+            
+            :param value: configured value to show, looked up in the configuration when None
+            :rtype: str
+            """
+            if value is None:
+                value = Config.get(self.config_key, self.default)
             if self.options:
-                html = '<h5>{} ({})</h5><select name="{}">'.format(self.config_key, self.help_line, self.config_key)
+                parts = ['<h5>{} ({})</h5><select name="{}">'.format(self.config_key, self.help_line, self.config_key)]
                 for key, val in self.options.items():
-                    default_value = Config.get(self.config_key, self.default) # None will be set to default is this value is not in the options list
-                    html += '<option value="{}"{}>{}</option>'.format(key, (" selected" if val == default_value else ""), key)
-                html += '</select>'
-                return html
+                    parts.append('<option value="{}"{}>{}</option>'.format(key, (" selected" if val == value else ""), key)) # Nothing is selected when the value is not in the options list
+                parts.append('</select>')
+                return "".join(parts)
             else:
-                value = InputManager.InputOption._hidden_text if self.hide_configured_value else Config.get(self.config_key, self.default)
+                if self.hide_configured_value:
+                    value = InputManager.InputOption._hidden_text
                 return '<h5>{} ({})</h5><input id="{}" name="{}" value="{}" placeholder="{}" /></p>'.format(self.config_key, self.help_line, self.config_key, self.config_key, value, self.default)
 
 
     inputs = {}
     categories = {} # name => priority
 
+    # Render cache of the configuration form. A category fragment is kept together with the configured values it was
+    # rendered with and re-rendered once one of them changed; adding or removing inputs drops the fragments concerned.
+    _fragments = {} # category => (rendered values, encoded html)
+    _layout = None # Categories in priority order as list of (category, input options), None when it has to be rebuilt
+
     _hardware = None
     _webserver = None
 
+    @staticmethod
+    def _invalidate(config_key, category=None):
+        previous = InputManager.inputs.get(config_key)
+        if previous:
+            InputManager._fragments.pop(previous[1], None)
+        if category:
+            InputManager._fragments.pop(category, None)
+        InputManager._layout = None
+
     @staticmethod
     def add_input(config_key, key_type, default, category, help="", hide_configured_value=False):
+        InputManager._invalidate(config_key, category.lower())
         InputManager.inputs[config_key] = (InputManager.InputOption(config_key=config_key, default_value=default, key_type=key_type, help_line=help, hide_configured_value=hide_configured_value), category.lower())
 
     @staticmethod
     def add_options(config_key, options, default, category, help=""):
+        InputManager._invalidate(config_key, category.lower())
         InputManager.inputs[config_key] = (InputManager.InputOption(config_key=config_key, default_value=default, options=options, help_line=help), category.lower())        
 
     @staticmethod
     def remove(config_key):
+        InputManager._invalidate(config_key)
         InputManager.inputs.pop(config_key, None)
 
     @staticmethod
@@ -87,23 +114,50 @@ class InputManager:
     @staticmethod
     def set_category_priority(category, priority):
         InputManager.categories[category.lower()] = priority
+        InputManager._layout = None
 
     @staticmethod
-    def generate_html_input_tags():
-        tags = {}
-        for config_key in InputManager.inputs:
-            data = InputManager.inputs[config_key]
-            if data[1] not in tags:
-                tags[data[1]] = ""
-            tags[data[1]] += data[0].to_html()
-        categories = sorted(tags.keys(), key=lambda x: InputManager.categories.get(x, 99))
-        html = '<form method="POST" method="/">'
-        for category in categories:
-            html += "<h1>{}</h1>".format(category)
-            html += tags[category]
-        html += '<input type="submit" value="Update Device" /></form>'
+    def _get_layout():
+        if InputManager._layout is None:
+            grouped = {}
+            for config_key in InputManager.inputs:
+                data = InputManager.inputs[config_key]
+                if data[1] not in grouped:
+                    grouped[data[1]] = []
+                grouped[data[1]].append(data[0])
+            categories = sorted(grouped.keys(), key=lambda x: InputManager.categories.get(x, 99))
+            InputManager._layout = [(category, grouped[category]) for category in categories]
+        return InputManager._layout
+
+    @staticmethod
+    def _render_category(category, options):
+        values = [Config.get(option.config_key, option.default) for option in options]
+        cached = InputManager._fragments.get(category)
+        if cached and cached[0] == values:
+            return cached[1]
+        parts = ["<h1>{}</h1>".format(category)]
+        for index, option in enumerate(options):
+            parts.append(option.to_html(values[index]))
+        html = "".join(parts).encode()
+        InputManager._fragments[category] = (values, html)
         return html
 
+    @staticmethod
+    def generate_html_input_fragments():
+        """Render the configuration form one category at a time, categories whose inputs and configured values did not
+        change since the previous render are served from the render cache
+
+        :return: Generator of encoded html fragments, to be written as a response stream
+        """
+        yield b'<form method="POST" method="/">'
+        for category, options in InputManager._get_layout():
+            yield InputManager._render_category(category, options)
+        yield b'<input type="submit" value="Update Device" /></form>'
+
+    @staticmethod
+    def generate_html_input_tags():
+        return b"".join(InputManager.generate_html_input_fragments()).decode()
+
     @staticmethod
     def set_hardware_controller(hw):
         InputManager._hardware = hw
@@ -131,12 +185,40 @@ class InputManager:
 # InputManager.add_input("test3", int, "Hoi3", "other", "This is a default text")
 # InputManager.add_options("test4", {"off":WIFIMODI.OFF, "Station":WIFIMODI.STA, "Access Point":WIFIMODI.AP, "Station - Access Point":WIFIMODI.STA_AP}, WIFIMODI.AP, "other", "help line")
 
+def generate_html_retransmission_state(zombie_router):
+    """Render the state of the retransmission policy as a read-only section of the configuration page"""
+    if not zombie_router:
+        return ""
+    try:
+        state = zombie_router.get_retransmission_state()
+    except Exception as e:
+        logging.getLogger("configuration-webserver").debug("Retransmission state unavailable | Reason [{}]".format(str(e)))
+        return ""
+    html = "<h1>retransmission state</h1><p>Policy: {} | Cached: {} | Delivered: {} | Gave up: {}</p>".format(state["policy"], state["cached"], state["delivered"], state["exhausted"])
+    html += "<table><tr><th>Priority</th><th>Target</th><th>Attempts</th></tr>"
+    for priority, name in enumerate(("low", "normal", "high", "urgent")):
+        html += "<tr><td>{}</td><td>{:.3f}</td><td>{}</td></tr>".format(name, state["targets"][priority], state["attempts"][priority])
+    html += "</table><table><tr><th>Neighbor</th><th>Ack probability</th></tr>"
+    for neighbor_id, probability in state["neighbors"]:
+        html += "<tr><td>{}</td><td>{:.2f}</td></tr>".format(neighbor_id, probability)
+    html += "</table>"
+    return html
+
+_html_page_head = b'<!DOCTYPE html><html><head><title>Device Config</title><style>h5{padding: 0px; margin: 0px;}</style><meta name="viewport" content="width=device-width"></head><body>'
+_html_page_tail = b'</body></html>'
+
+def generate_html_config_page(errors, zombie_router):
+    """Render the configuration page in fragments, the server pulls them as the client is ready for more"""
+    yield _html_page_head
+    yield errors
+    for fragment in InputManager.generate_html_input_fragments():
+        yield fragment
+    yield generate_html_retransmission_state(zombie_router)
+    yield _html_page_tail
+
 @MicroWebSrv.route('/', 'GET')
 def userConfigGetHandler(httpClient, httpResponse):
-    html = '<!DOCTYPE html><html><head><title>Device Config</title><style>h5{padding: 0px; margin: 0px;}</style><meta name="viewport" content="width=device-width"></head><body>'
-    html += InputManager.generate_html_input_tags()
-    html += '</body></html>'
-    httpResponse.WriteResponseOk(headers=None, contentType="text/html", contentCharset="UTF-8", content=html)
+    httpResponse.WriteResponseStream(generate_html_config_page("", httpClient.zombie_router), "text/html", "UTF-8")
 
 @MicroWebSrv.route('/', 'POST')
 def userConfigSubmitHandler(httpClient, httpResponse):
@@ -151,12 +233,8 @@ def userConfigSubmitHandler(httpClient, httpResponse):
         if errors:
             errors = "<h1>Errors during saving</h1>" + errors
 
-        # Default page (with not updated values)
-        html = '<!DOCTYPE html><html><head><title>Device Config</title><style>h5{padding: 0px; margin: 0px;}</style><meta name="viewport" content="width=device-width"></head><body>'
-        html += errors
-        html += InputManager.generate_html_input_tags()
-        html += '</body></html>'
-        httpResponse.WriteResponseOk(headers=None, contentType="text/html", contentCharset="UTF-8", content=html)
+        # Default page
+        httpResponse.WriteResponseStream(generate_html_config_page(errors, httpClient.zombie_router), "text/html", "UTF-8")
 
         # Save whatever got set and notify hardware about possible changes
         InputManager.save_and_notify_config_changes()
@@ -164,6 +242,55 @@ def userConfigSubmitHandler(httpClient, httpResponse):
     except Exception as e:
         print(str(e))
 
+@MicroWebSrv.route('/retransmission', 'GET')
+def retransmissionStateApi(httpClient, httpResponse):
+    try:
+        httpResponse.WriteResponseJSONOk(httpClient.zombie_router.get_retransmission_state())
+    except Exception as e:
+        httpResponse.WriteResponseJSONError(500, {"error": "Unknown"})
+        logging.getLogger("configuration-webserver").warning("Could not retrieve retransmission state | Reason [{}]".format(str(e)))
+
+@MicroWebSrv.route('/metrics', 'GET')
+def metricsApi(httpClient, httpResponse):
+    try:
+        httpResponse.WriteResponseOk(headers=None, contentType="text/plain; version=0.0.4", contentCharset="UTF-8", content=metrics.render())
+    except Exception as e:
+        httpResponse.WriteResponseInternalServerError()
+        logging.getLogger("configuration-webserver").warning("Could not render metrics | Reason [{}]".format(str(e)))
+
+def generate_diagnostics_csv(samples):
+    yield ",".join(DiagnosticsLog.sample_fields) + "\n"
+    for sample in samples:
+        yield ",".join([str(value) for value in sample]) + "\n"
+
+def generate_diagnostics_binary(samples):
+    for sample in samples:
+        yield struct.pack(DiagnosticsLog.sample_format, *sample)
+
+@MicroWebSrv.route('/diagnostics', 'GET')
+def diagnosticsApi(httpClient, httpResponse):
+    """Stream the recorded diagnostic samples, oldest first
+
+    Query parameters (all optional): from and to (RTC seconds), step (downsample interval in seconds), limit and
+    format (csv, or binary for the packed samples as stored, layout in the X-Sample-Format header).
+    """
+    try:
+        diagnostics = httpClient.zombie_router.get_diagnostics()
+        if diagnostics is None:
+            httpResponse.WriteResponseJSONError(404, {"error": "No diagnostics recorded"})
+            return
+        params = httpClient.GetRequestQueryParams()
+        arguments = [int(params[name]) if params.get(name) else None for name in ("from", "to", "step", "limit")]
+        samples = diagnostics.query(*arguments)
+    except Exception as e:
+        httpResponse.WriteResponseJSONError(400, {"error": "Invalid query"})
+        logging.getLogger("configuration-webserver").debug("Diagnostics query failed | Reason [{}]".format(str(e)))
+        return
+    if params.get("format") == "binary":
+        httpResponse.WriteResponseStream(generate_diagnostics_binary(samples), "application/octet-stream", headers={"X-Sample-Format": DiagnosticsLog.sample_format})
+    else:
+        httpResponse.WriteResponseStream(generate_diagnostics_csv(samples), "text/csv", "UTF-8")
+
 @MicroWebSrv.route('/usms', 'POST')
 def usmsApi(httpClient, httpResponse):
     data = httpClient.ReadRequestContentAsJSON()
@@ -223,7 +350,7 @@ def fix(httpClient, httpResponse):
         if diag_needed:
             coordinates = Config.get("device_position", (0.0,0.0)) if Config.get("device_position") else (0.0, 0.0)
             coordinates = (float(coordinates[0]), float(coordinates[1]))
-            neighbors = httpClient.zombie_router.get_neighbors()
+            neighbors = httpClient.zombie_router.get_best_neighbors(3)
             diag = DiagnosticPayload(coordinates, neighbors, 100, 1, is_sensor=Config.get("device_is_sensor", False), is_router=Config.get("device_is_router", False), is_gateway=Config.get("device_is_gateway", False), sensor_id=0)
             #httpClient.zombie_router.queue_zombiegram(1, diag)
     except Exception as e:
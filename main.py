@@ -6,6 +6,7 @@ from zombieRouter import ZombieRouter
 from zombiegram import *
 import configurationWebserver
 from configurationWebserver import InputManager
+import metrics
 
 # TODO REMOVE
 diag = DiagnosticPayload((1.1, 2.2), [b"\x11\x11\x11\x11"], 97, 1)
@@ -15,7 +16,10 @@ zr = ZombieRouter(lora)
 zr.start()
 
 # Zombie callback
+_detections = metrics.counter("sensor_detections_total", "Zombie detections reported by the sensor")
+
 def zombie_detected_callback(confidence):
+    _detections.inc()
     payload  = DetectionPayload(confidence, 1)
     zr.queue_zombiegram(3, payload)
 
@@ -24,6 +28,19 @@ try:
 except Exception as e:
     logging.getLogger("main").error("Could not set zombie detection callback! | Reason [{}]".format(str(e)))
 
+# Sequence numbers, replay windows and pending retransmissions survive deep sleep
+try:
+    system.addBeforeSleepCallback(zr.save_state)
+except Exception as e:
+    logging.getLogger("main").error("Could not set router state persistence before sleep! | Reason [{}]".format(str(e)))
+
+# Diagnostic samples on flash (see /diagnostics), one is taken right before deep sleep as well
+try:
+    system.addBeforeSleepCallback(zr.record_diagnostics)
+    zr.battery_level = lambda: system.batteryLevel
+except Exception as e:
+    logging.getLogger("main").error("Could not set diagnostics recording before sleep! | Reason [{}]".format(str(e)))
+
 # Webserver
 mws = MicroWebSrv(bindIP="0.0.0.0", zombie_router=zr)
 InputManager.set_webserver_controller(mws)
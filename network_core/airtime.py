@@ -0,0 +1,89 @@
+"""LoRa airtime calculation and duty cycle budgeting
+
+Time on air follows the Semtech SX127x formula (AN1200.13). The budget is a token bucket measured in milliseconds of
+airtime; EU868 sub-bands g/g1 allow a 1% duty cycle (36 seconds per hour).
+"""
+
+EU868_DUTY_CYCLE = 0.01
+EU868_DUTY_CYCLE_WINDOW_MS = 3600000
+
+
+class AirtimeBudgetExceeded(Exception):
+    pass
+
+
+def time_on_air_ms(payload_length, sf=7, bandwidth_hz=125000, coding_rate=1, preamble_length=8,
+                   explicit_header=True, crc=True):
+    """Calculate the time on air of a single LoRa frame
+
+    :param int payload_length: PHY payload length in bytes
+    :param int sf: Spreading factor in range [6,12]
+    :param int bandwidth_hz: Bandwidth in Hz
+    :param int coding_rate: Coding rate denominator offset in range [1,4], respectively 4/5 up to 4/8
+    :param int preamble_length: Amount of programmed preamble symbols
+    :param bool explicit_header: Explicit (default) or implicit header mode
+    :param bool crc: Payload CRC enabled
+    :return: Time on air in milliseconds
+    :rtype: float
+    """
+    symbol_time_ms = (1 << sf) * 1000 / bandwidth_hz
+    low_data_rate_optimize = 1 if symbol_time_ms > 16 else 0
+    numerator = 8 * payload_length - 4 * sf + 28 + (16 if crc else 0) - (0 if explicit_header else 20)
+    denominator = 4 * (sf - 2 * low_data_rate_optimize)
+    payload_symbols = 8 + max(-(-numerator // denominator) * (coding_rate + 4), 0)
+    return (preamble_length + 4.25 + payload_symbols) * symbol_time_ms
+
+
+class AirtimeBudget:
+    def __init__(self, duty_cycle=EU868_DUTY_CYCLE, window_ms=EU868_DUTY_CYCLE_WINDOW_MS, now=0):
+        """Token bucket of transmission airtime
+
+        The bucket holds at most duty_cycle * window_ms milliseconds of airtime and refills at duty_cycle milliseconds
+        per elapsed millisecond. Transmissions that can not be postponed (e.g. urgent alerts) may be forced through,
+        which can put the bucket in debt; the debt is paid back by the refill before anything else is allowed.
+
+        :param float duty_cycle: Allowed fraction of airtime, e.g. 0.01 for 1%
+        :param int window_ms: Window over which the duty cycle is averaged, sets the bucket capacity
+        :param int now: Current monotonic time in milliseconds
+        """
+        if duty_cycle <= 0 or duty_cycle > 1:
+            raise ValueError("Duty cycle has to be in range ]0,1]")
+        self.duty_cycle = duty_cycle
+        self.capacity_ms = duty_cycle * window_ms
+        self._tokens_ms = self.capacity_ms
+        self._last_refill = now
+        self.consumed_ms = 0
+
+    def _refill(self, now):
+        elapsed = now - self._last_refill
+        if elapsed > 0:
+            self._tokens_ms = min(self.capacity_ms, self._tokens_ms + elapsed * self.duty_cycle)
+            self._last_refill = now
+
+    def available_ms(self, now):
+        """Retrieve the airtime that can currently be spent (negative when in debt)"""
+        self._refill(now)
+        return self._tokens_ms
+
+    def can_send(self, airtime_ms, now):
+        return self.available_ms(now) >= airtime_ms
+
+    def ms_until_available(self, airtime_ms, now):
+        """Retrieve how long until the given airtime can be spent"""
+        missing = airtime_ms - self.available_ms(now)
+        return 0 if missing <= 0 else int(missing / self.duty_cycle) + 1
+
+    def consume(self, airtime_ms, now, force=False):
+        """Spend airtime
+
+        :param float airtime_ms: Airtime of the transmission
+        :param int now: Current monotonic time in milliseconds
+        :param bool force: Spend even if the budget does not allow it
+        :raises AirtimeBudgetExceeded: When the budget does not allow the transmission and force is not set
+        """
+        self._refill(now)
+        if not force and self._tokens_ms < airtime_ms:
+            raise AirtimeBudgetExceeded("Airtime budget exceeded | Requested [{} ms] | Available [{} ms]".format(
+                airtime_ms, self._tokens_ms))
+        self._tokens_ms -= airtime_ms
+        self.consumed_ms += airtime_ms
@@ -19,6 +19,94 @@ def translate(d, t):
 # hashing module used.  Use digest_size from the instance of HMAC instead.
 digest_size = None
 
+# Keyed contexts, see context()
+_context_cache = {}
+_context_cache_size = 2  # Current trust key and the one it replaced
+
+
+def _digest_constructor(digestmod):
+    if digestmod is None:
+        raise Exception("HMAC() without an explicit digestmod argument "
+                       "is deprecated.")
+    if callable(digestmod):
+        return digestmod
+    elif isinstance(digestmod, str):
+        return lambda d=b'': _hashlib.new(digestmod, d)
+    return lambda d=b'': digestmod.new(d)
+
+
+class HMACContext:
+    """Precomputed HMAC key schedule for a single key.
+    The padded inner and outer keys are derived once; where the hash objects support copy() (CPython) the
+    hash states after absorbing the pads are kept as well. Signing a message then only costs a copy of
+    both states and one update each.
+    """
+    block_size = 64
+
+    def __init__(self, key, digestmod=None):
+        """Create a keyed context.
+        key:       key for the keyed hash object (bytes or bytearray).
+        digestmod: see HMAC.
+        """
+        if not isinstance(key, (bytes, bytearray)):
+            raise TypeError("key: expected bytes or bytearray, but got %r" % type(key).__name__)
+        if len(key) > self.block_size:
+            raise Exception('key too long')
+
+        self.digest_cons = _digest_constructor(digestmod)
+        key = key + bytes(self.block_size - len(key))
+        self.inner_key_translated = translate(key, trans_36)
+        self.outer_key_translated = translate(key, trans_5C)
+
+        self._inner = self.digest_cons(self.inner_key_translated)
+        self._outer = self.digest_cons(self.outer_key_translated)
+        if not hasattr(self._inner, "copy"):  # µpython hash objects can not be copied, only the padded keys are cached
+            self._inner = None
+            self._outer = None
+
+    def inner(self):
+        """Fresh inner hash state with the inner key pad already absorbed"""
+        if self._inner is not None:
+            return self._inner.copy()
+        return self.digest_cons(self.inner_key_translated)
+
+    def outer(self):
+        """Fresh outer hash state with the outer key pad already absorbed"""
+        if self._outer is not None:
+            return self._outer.copy()
+        return self.digest_cons(self.outer_key_translated)
+
+    def sign(self, msg):
+        """Return the HMAC of msg."""
+        inner = self.inner()
+        inner.update(msg)
+        outer = self.outer()
+        outer.update(inner.digest())
+        return outer.digest()
+
+    def verify(self, msg, mac):
+        """Check whether mac is (a truncation of) the HMAC of msg."""
+        return self.sign(msg)[:len(mac)] == mac
+
+
+def context(key, digestmod=None):
+    """Retrieve the keyed HMAC context for key, creating it if needed.
+    Contexts are cached; when a new key comes in (e.g. the trust key changed) the oldest context is evicted.
+    """
+    cache_key = (bytes(key), digestmod)
+    ctx = _context_cache.get(cache_key)
+    if ctx is None:
+        ctx = HMACContext(key, digestmod)
+        while len(_context_cache) >= _context_cache_size:
+            _context_cache.pop(next(iter(_context_cache)))
+        _context_cache[cache_key] = ctx
+    return ctx
+
+
+def clear_cache():
+    """Drop all cached keyed contexts."""
+    _context_cache.clear()
+
 
 class HMAC:
     """RFC 2104 HMAC class.  Also complies with RFC 4231.
@@ -42,27 +130,12 @@ class HMAC:
         if not isinstance(key, (bytes, bytearray)):
             raise TypeError("key: expected bytes or bytearray, but got %r" % type(key).__name__)
 
-        if digestmod is None:
-            raise Exception("HMAC() without an explicit digestmod argument "
-                           "is deprecated.")
-
-        if callable(digestmod):
-            self.digest_cons = digestmod
-        elif isinstance(digestmod, str):
-            self.digest_cons = lambda d=b'': _hashlib.new(digestmod, d)
-        else:
-            self.digest_cons = lambda d=b'': digestmod.new(d)
-
-        self.inner = self.digest_cons()
+        self._context = context(key, digestmod)
+        self.digest_cons = self._context.digest_cons
+        self.inner = self._context.inner()
         self.digest_size = 32
         self.block_size = 64
-
-        if len(key) > self.block_size:
-            raise Exception('key too long')
-
-        key = key + bytes(self.block_size - len(key))
-        self.inner.update(translate(key, trans_36))
-        self.outer_key_translated = translate(key, trans_5C)
+        self.outer_key_translated = self._context.outer_key_translated
         if msg is not None:
             self.update(msg)
 
@@ -84,8 +157,7 @@ class HMAC:
         updating the object after calling this function.
         """
         inner_digest = self.inner.digest()
-        self.outer = self.digest_cons()
-        self.outer.update(self.outer_key_translated)
+        self.outer = self._context.outer()
         self.outer.update(inner_digest)
         return self.outer.digest()
 
@@ -26,55 +26,133 @@ def print_usms_table():
     print("+-----+------+")
 
 
-def bytes_to_ascii(bytestring):
-    """Decode a 6-bit USMS bytestring to ASCII string representation
+# Lookup tables, built once at import
+# Encoding: ASCII byte => 6bit index (0xFF for characters outside the alphabet)
+# Decoding: 6bit index => ASCII byte (0 for padding, 0xFF for indices outside the alphabet)
+__invalid = 0xFF
+__encode_table = bytearray([__invalid] * 256)
+__decode_table = bytearray([__invalid] * 64)
+for __index, __char in enumerate(__usms_chars):
+    if __char is None:
+        __decode_table[__index] = 0
+    else:
+        __encode_table[ord(__char)] = __index
+        __decode_table[__index] = ord(__char)
+del __index, __char
+__decode_high_table = bytearray(__decode_table[__byte >> 2] for __byte in range(256))  # First character of a group
+__decode_low_table = bytearray(__decode_table[__byte & 63] for __byte in range(256))  # Fourth character of a group
+
+
+def encoded_size(asciistring):
+    """Amount of bytes :func:`encode_into` writes for the given string"""
+    return len(asciistring)
+
+
+def decoded_size(bytestring):
+    """Upper bound of the amount of characters :func:`decode_into` writes for the given bytestring"""
+    return (len(bytestring) // 3) * 4 + len(bytestring) % 3
+
+
+def encode_into(asciistring, buffer, offset=0):
+    """Encode an ASCII string into a caller-supplied buffer
+
+    Characters are handled in groups of three, each group fills three bytes (see the wire layout in :func:`ascii_to_bytes`).
+
+    :param asciistring: ASCII string or bytes
+    :param bytearray buffer: Writable buffer with at least :func:`encoded_size` bytes available from offset
+    :param int offset: Position in the buffer to start writing at
+    :return: Amount of bytes written
+    :raises UsmsCharacterOutOfRange: When a character is not part of the USMS alphabet
+    """
+    data = asciistring.encode() if isinstance(asciistring, str) else asciistring  # Non ASCII encodes to bytes >127, which are invalid
+    length = len(data)
+    table = __encode_table
+    for i in range(0, length, 3):
+        c0 = table[data[i]]
+        c1 = table[data[i + 1]] if i + 1 < length else 0
+        c2 = table[data[i + 2]] if i + 2 < length else 0
+        if c0 == __invalid or c1 == __invalid or c2 == __invalid:
+            raise UsmsCharacterOutOfRange("Character not part of the USMS alphabet | Given [{}]".format(data[i:i + 3]))
+        buffer[offset + i] = ((c0 << 2) | (c1 >> 4)) & 255
+        if i + 1 < length:
+            buffer[offset + i + 1] = ((c1 << 4) | (c2 >> 2)) & 255
+        if i + 2 < length:
+            buffer[offset + i + 2] = (c2 << 6) & 255
+    return length
+
+
+def decode_into(bytestring, buffer, offset=0):
+    """Decode a 6-bit USMS bytestring into a caller-supplied buffer as ASCII bytes
 
     :param bytestring: 6bit encoded USMS bytestring (with end-padding)
-    :return: ASCII string
+    :param bytearray buffer: Writable buffer with at least :func:`decoded_size` bytes available from offset
+    :param int offset: Position in the buffer to start writing at
+    :return: Amount of characters written
+    :raises UsmsCharacterOutOfRange: When the bytestring contains an unknown character index
     """
-    pattern = [(2, 3), (4, 15), (6, 63)]  # (bits to shift, rest bit pattern)
-    pattern_index = 0
-    ascii_output = []
-    rest_bits = 0
-    for byte in bytestring:
-        six_bit_int_rep = (byte >> pattern[pattern_index][0]) | (rest_bits << (8 - pattern[pattern_index][0]))
-        rest_bits = byte & pattern[pattern_index][1]
-
-        if six_bit_int_rep not in range(0, len(__usms_chars)):
-            raise UsmsCharacterOutOfRange("Unknown character index [{}]".format(str(six_bit_int_rep)))
+    length = len(bytestring)
+    position = offset
+    high = __decode_high_table
+    middle = __decode_table
+    low = __decode_low_table
+    for i in range(0, length, 3):
+        b0 = bytestring[i]
+        if i + 2 < length:
+            b1 = bytestring[i + 1]
+            b2 = bytestring[i + 2]
+            c0 = high[b0]
+            c1 = middle[((b0 & 3) << 4) | (b1 >> 4)]
+            c2 = middle[((b1 & 15) << 2) | (b2 >> 6)]
+            c3 = low[b2]
+            if b2 & 63 and i + 3 < length:  # A fourth character can only end the message
+                raise UsmsCharacterOutOfRange(
+                    "Unknown character index [{}]".format(((b2 & 63) << 6) | (bytestring[i + 3] >> 2)))
+        else:  # Trailing group of one or two bytes
+            b1 = bytestring[i + 1] if i + 1 < length else 0
+            c0 = high[b0]
+            c1 = middle[((b0 & 3) << 4) | (b1 >> 4)] if i + 1 < length else 0
+            c2 = 0
+            c3 = 0
+        if c0 == __invalid or c1 == __invalid or c2 == __invalid or c3 == __invalid:
+            raise UsmsCharacterOutOfRange("Unknown character index in group [{}]".format(bytes(bytestring[i:i + 3])))
+        if c0:
+            buffer[position] = c0
+            position += 1
+        if c1:
+            buffer[position] = c1
+            position += 1
+        if c2:
+            buffer[position] = c2
+            position += 1
+        if c3:
+            buffer[position] = c3
+            position += 1
+    return position - offset
 
-        if __usms_chars[six_bit_int_rep] is not None:
-            ascii_output.append(__usms_chars[six_bit_int_rep])
 
-        if pattern_index == 2 and __usms_chars[rest_bits] is not None:
-            if rest_bits not in range(0, len(__usms_chars)):
-                raise UsmsCharacterOutOfRange("Unknown character index [{}]".format(str(rest_bits)))
-            ascii_output.append(__usms_chars[rest_bits])
+def bytes_to_ascii(bytestring):
+    """Decode a 6-bit USMS bytestring to ASCII string representation
 
-        pattern_index = (pattern_index + 1) % 3
-    return "".join(ascii_output)
+    :param bytestring: 6bit encoded USMS bytestring (with end-padding)
+    :return: ASCII string
+    """
+    buffer = bytearray(decoded_size(bytestring))
+    length = decode_into(bytestring, buffer)
+    return bytes(memoryview(buffer)[:length]).decode()
 
 
 def ascii_to_bytes(asciistring):
     """Encode an ASCII string to a 6bit encoded USMS bytestring with padding
 
+    Wire layout per group of three characters c0, c1 and c2 (6 bits each):
+    [c0 (6) | c1 high (2)] [c1 low (4) | c2 high (4)] [c2 low (2) | padding (6)]
+
     :param asciistring: ASCII string
     :return: 6bit encoded USMS bytestring
     """
-    byte_output = []
-    pattern = [(2, 3, 4), (4, 15, 2), (6, 0, 0)]  # (bits to shift, rest bit pattern)
-    pattern_index = 0
-    for i in range(0, len(asciistring)):
-        int_rep = __usms_chars.index(asciistring[i]) << pattern[pattern_index][0] & 255
-        if pattern_index < 2:
-            next_int_rest = ((__usms_chars.index(asciistring[i + 1]) >> pattern[pattern_index][2]) if (i + 1) < len(asciistring) else 0) & pattern[pattern_index][1]
-            int_rep |= next_int_rest
-        else:
-            i += 1
-        byte_output.append(int_rep)
-
-        pattern_index = (pattern_index + 1) % 3
-    return bytes(byte_output)
+    buffer = bytearray(encoded_size(asciistring))
+    encode_into(asciistring, buffer)
+    return bytes(buffer)
 
 
 if __name__ == "__main__":
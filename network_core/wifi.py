@@ -98,6 +98,19 @@ class WifiManager:
             if cm.get("sta_ssid", None) and (current_mode == WIFIMODI.STA or current_mode == WIFIMODI.STA_AP):
                 WifiManager._connect_to_station(cm)
                             
+    @staticmethod
+    def is_uplink_available():
+        """Whether external hosts can be reached: the station interface is connected, or the device only runs an access
+        point (hosts on the access point network are left to their own timeouts)
+
+        :rtype: bool
+        """
+        if not WifiManager._wlan:
+            return False
+        if WifiManager._wlan.mode() == WIFIMODI.AP:
+            return True
+        return WifiManager._wlan.isconnected()
+
     @staticmethod
     def deinit():
         """Disable the WiFi radio completely
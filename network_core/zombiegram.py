@@ -34,6 +34,54 @@ def bytes_to_int(data):
         return data
 
 
+class _Layout:
+    def __init__(self, struct_format):
+        """Precompiled struct layout
+
+        Uses struct.Struct where the platform offers it (CPython), µpython falls back to the format string versions of
+        pack_into and unpack_from which are equally allocation free on the buffer side.
+
+        :param str struct_format: struct format string
+        """
+        self.format = struct_format
+        self.size = struct.calcsize(struct_format)
+        try:
+            compiled = struct.Struct(struct_format)
+            self.pack_into = compiled.pack_into
+            self.unpack_from = compiled.unpack_from
+        except AttributeError:
+            self.pack_into = lambda buffer, offset, *values: struct.pack_into(struct_format, buffer, offset, *values)
+            self.unpack_from = lambda buffer, offset=0: struct.unpack_from(struct_format, buffer, offset)
+
+
+def _encode_flags(priority, tampered, maintenance):
+    """Flag encoder
+    :returns: int flags byte (priority | tampered << 2 | maintenance << 3)
+    """
+    return priority | (tampered << 2) | (maintenance << 3)
+
+
+def _decode_flags(flags):
+    """Flag decoder
+    :returns: tuple (priority, tampered, maintenance)
+    """
+    return flags & 3, bool(flags & 4), bool(flags & 8)
+
+
+def _trust_context(trust_key):
+    """Retrieve the cached keyed HMAC context for a trust key
+
+    :param trust_key: bytestring or string
+    :rtype: hmac.HMACContext
+    """
+    if isinstance(trust_key, str):
+        trust_key = trust_key.encode()
+    return hmaclib.context(trust_key, digestmod=hashlib.sha256)
+
+
+_header_layout = _Layout("!IIBB")
+
+
 ##############
 # EXCEPTIONS #
 ##############
@@ -123,6 +171,7 @@ class Zombiegram:
         self.__bytestring_representation = raw_payload
         self.__is_immutable = False
         self.__current_zombiegram_size = self.__header_size_bytes
+        self.__trust = None  # (trust_key, result) of the last verification, the contents are immutable by then
 
         # Set properties
         if hmac:
@@ -259,6 +308,10 @@ class Zombiegram:
     def get_max_package_size():
         return Zombiegram.__zombiegram_max_size
 
+    @staticmethod
+    def get_header_size():
+        return Zombiegram.__header_size_bytes
+
     def add_payload(self, payload):
         """Add a payload to the Zombiegram.
 
@@ -281,12 +334,13 @@ class Zombiegram:
                 "Zombiegram contains a payload that does not allow other piggybacking payloads. | Previous payload [{}]".format(
                     type(self.payloads[0])))
 
-        if self.__current_zombiegram_size + payload.get_size() > self.__zombiegram_max_size:
+        size = 1 + payload.get_size()  # Every payload is preceded by its opcode
+        if self.__current_zombiegram_size + size > self.__zombiegram_max_size:
             raise ZombiegramPayloadOverflow(
                 "Adding payload prohibited, exceeds maximum size of {} bytes | Current size [{}] | Payload size [{}]".format(
-                    self.__zombiegram_max_size, self.__current_zombiegram_size, payload.get_size()))
+                    self.__zombiegram_max_size, self.__current_zombiegram_size, size))
 
-        self.__current_zombiegram_size += payload.get_size()
+        self.__current_zombiegram_size += size
         self.payloads.append(payload)
 
     def get_payloads(self):
@@ -310,13 +364,7 @@ class Zombiegram:
         if not trust_key:
             self.__hmac = self.__unsigned_hmac_default  # 4byte zeros
         else:
-            try:
-                # TODO error capturing
-                digester = hmaclib.new(key=trust_key, msg=payload, digestmod=hashlib.sha256)
-                self.__hmac = digester.digest()[:4]
-            except TypeError:
-                digester = hmaclib.new(key=trust_key.encode(), msg=payload, digestmod=hashlib.sha256)
-                self.__hmac = digester.digest()[:4]
+            self.__hmac = _trust_context(trust_key).sign(payload)[:4]
         self.__is_immutable = True
 
     def is_signed(self):
@@ -343,24 +391,32 @@ class Zombiegram:
         self.__bytestring_representation = self.get_bytestring_representation()
 
     def __get_hmacless_bytestring(self):
-        def flag_encoder():
-            tampered_shift = 2
-            maintenance_shift = 3
-            flags = 0
-            flags |= self.priority
-            flags |= (self.tampered_flag << tampered_shift)
-            flags |= (self.maintenance_flag << maintenance_shift)
-            return flags
-
-        package = b""
-        package += self.source_id.to_bytes(4, "big")
-        package += self.seq_num.to_bytes(1, "big")
-        package += flag_encoder().to_bytes(1, "big")
-        for payload in self.payloads:
-            package += _payload_opcode_list.index(type(payload)).to_bytes(1, "big")
-            package += payload.get_bytestring_representation()
+        buffer = bytearray(self.__zombiegram_max_size)
+        length = self.pack_into(buffer)
+        return bytes(memoryview(buffer)[4:length])
 
-        return package
+    def pack_into(self, buffer, offset=0):
+        """Write the wire form of the Zombiegram into a caller-supplied buffer
+
+        No intermediate bytestrings are created; every payload packs itself through its precompiled struct layout.
+        If the Zombiegram has not been signed, the HMAC field is filled with zero bytes.
+
+        :param bytearray buffer: Writable buffer with at least :func:`~zombiegram.Zombiegram.get_max_package_size` bytes available from offset
+        :param int offset: Position in the buffer to start writing at
+        :return: Amount of bytes written
+        :rtype: int
+        """
+        hmac = self.hmac
+        if not hmac:
+            hmac = 0
+        elif not isinstance(hmac, int):
+            hmac = int.from_bytes(hmac[:4], "big")
+        _header_layout.pack_into(buffer, offset, hmac, self.source_id, self.seq_num,
+                                 _encode_flags(self.priority, self.tampered_flag, self.maintenance_flag))
+        position = offset + self.__header_size_bytes
+        for payload in self.payloads:
+            position = payload.pack_into(buffer, position)
+        return position - offset
 
     def get_bytestring_representation(self):
         """Retrieve the bytestring representation of the Zombiegram object.
@@ -404,21 +460,23 @@ class Zombiegram:
 
         if not trust_key:
             return False
+        if self.__trust and self.__trust[0] == trust_key:
+            return self.__trust[1]
 
-        hmac = self.__bytestring_representation[0:4]
+        representation = memoryview(self.__bytestring_representation)
+        trusted = _trust_context(trust_key).verify(representation[4:], bytes(representation[0:4]))
+        self.__trust = (trust_key, trusted)
+        return trusted
 
-        digester = None
-        try:
-            # TODO error capturing
-            digester = hmaclib.new(key=trust_key, msg=self.__bytestring_representation[4:], digestmod=hashlib.sha256)
-            self.__hmac = digester.digest()
-        except TypeError:
-            digester = hmaclib.new(key=trust_key.encode(), msg=self.__bytestring_representation[4:],
-                                   digestmod=hashlib.sha256)
-            self.__hmac = digester.digest()[:4]
-        generated_hmac = digester.digest()[:4]
+    def remember_trust(self, trust_key, trusted):
+        """Store the outcome of a verification done elsewhere (e.g. on the received frame), so that
+        :func:`~zombiegram.Zombiegram.is_payload_trusted` does not recompute the HMAC for that trust_key
 
-        return hmac == generated_hmac
+        :param trust_key: Key the zombiegram was verified with
+        :param bool trusted: Verification outcome
+        """
+        if trust_key:
+            self.__trust = (trust_key, trusted)
 
     @staticmethod
     def _payloads_from_package(payload):
@@ -428,27 +486,9 @@ class Zombiegram:
         :return: List of payload objects if parsing succeeded
         :raises MalformedZombiegram: When a payload is corrupted
         """
-        imported_payloads = []
-        offset = Zombiegram.__header_size_bytes
-        while True:
-            opcode = payload[offset]
-            if opcode < 0 or opcode > len(_payload_opcode_list):
-                raise MalformedZombiegram(
-                    "Package payload contains unknown opcode [{}] | Payload [{}]".format(opcode, str(payload)))
-
-            payload_class = _payload_opcode_list[opcode]
-            try:
-                offset += 1
-                payload_obj = payload_class.from_payload(payload, offset)
-                offset += payload_class.size
-                imported_payloads.append(payload_obj)
-            except IndexError:
-                raise MalformedZombiegram(
-                    "Package payload contains corrupted data | Opcode [{}] | Payload [{}]".format(opcode, str(payload)))
-
-            if offset >= len(payload) or payload_class in _no_piggyback_opcode_list:
-                break
-        return imported_payloads
+        record = ZombiegramRecord()
+        record.decode(payload)
+        return record.materialize_payloads()
 
     @staticmethod
     def from_package(payload):
@@ -458,32 +498,239 @@ class Zombiegram:
         :return: Zombiegram object
         :raises MalformedZombiegram: if the package size is smaller than or equal to the header size which would indicate no attached payload
         """
+        record = ZombiegramRecord()
+        record.decode(payload)
+        return record.to_zombiegram()
 
-        def flag_decoder(flag):
-            """Flag decoder
-            :returns: tuple (priority, tampered, maintenance)
-            """
-            priority_mask = 3
-            tampered_mask = 4
-            tampered_shift = 2
-            maintenance_mask = 8
-            maintenance_shift = 3
-
-            priority = flag & priority_mask
-            tampered = bool((flag & tampered_mask) >> tampered_shift)
-            maintenance = bool((flag & maintenance_mask) >> maintenance_shift)
-            return priority, tampered, maintenance
-
-        if len(payload) <= Zombiegram.__header_size_bytes:
+
+class ZombiegramRecord:
+    __max_payloads = (64 - 10) // 3  # Smallest payload is 2 bytes + 1 opcode byte
+
+    def __init__(self):
+        """Reusable decode target for received Zombiegrams
+
+        A record is allocated once and refilled by :func:`~zombiegram.ZombiegramRecord.decode` for every received frame.
+        Decoding only unpacks the header and walks the opcodes, storing where every payload starts; no payload objects
+        are created and the frame is not copied. Payload fields can be read through
+        :func:`~zombiegram.ZombiegramRecord.payload_fields`, or turned into the regular object API with
+        :func:`~zombiegram.ZombiegramRecord.to_zombiegram`.
+
+        :note: The record references the decoded buffer; it is only valid until that buffer is reused by the caller.
+        """
+        self.view = None
+        self.length = 0
+        self.hmac = 0
+        self.source_id = 0
+        self.seq_num = 0
+        self.priority = 0
+        self.tampered_flag = False
+        self.maintenance_flag = False
+        self.payload_count = 0
+        self.opcodes = bytearray(self.__max_payloads)
+        self.offsets = bytearray(self.__max_payloads)
+        self.sizes = bytearray(self.__max_payloads)
+
+    def decode(self, package, length=None):
+        """Parse a raw frame into this record
+
+        :param package: bytes, bytearray or memoryview holding the frame
+        :param int length: Amount of valid bytes in package; defaults to the full package
+        :return: The record itself
+        :raises MalformedZombiegram: When the frame is too small, contains an unknown opcode or a truncated payload
+        """
+        self.decode_header(package, length)
+        self.decode_payloads()
+        return self
+
+    def decode_header(self, package, length=None):
+        """Parse only the 10 byte header of a raw frame into this record
+
+        Payload offsets are not known until :func:`~zombiegram.ZombiegramRecord.decode_payloads` is called.
+
+        :param package: bytes, bytearray or memoryview holding the frame
+        :param int length: Amount of valid bytes in package; defaults to the full package
+        :return: The record itself
+        :raises MalformedZombiegram: When the frame is too small to contain a payload or larger than a Zombiegram can be
+        """
+        view = package if isinstance(package, memoryview) else memoryview(package)
+        if length is None:
+            length = len(view)
+        if length <= _header_layout.size:
             raise MalformedZombiegram(
                 "Package size is smaller [{} bytes] than expected or equal to the header size [{} bytes] | Payload [{}]".format(
-                    len(payload), Zombiegram.__header_size_bytes, str(payload)))
-        hmac, source_id, seq_num, flags = struct.unpack("!IIBB", payload[0:10])
-        flags = flag_decoder(flags)
-        imported_payloads = Zombiegram._payloads_from_package(payload)
-        return Zombiegram(hmac=hmac, source_id=source_id, seq_num=seq_num, priority_flag=flags[0],
-                          tampered_flag=flags[1], maintenance_flag=flags[2], raw_payload=payload,
-                          imported_payloads=imported_payloads)
+                    length, _header_layout.size, bytes(view[:length])))
+        if length > Zombiegram.get_max_package_size(): # Payload offsets are stored in bytes
+            raise MalformedZombiegram(
+                "Package size [{} bytes] exceeds the maximum Zombiegram size [{} bytes]".format(
+                    length, Zombiegram.get_max_package_size()))
+
+        self.view = view
+        self.length = length
+        self.hmac, self.source_id, self.seq_num, flags = _header_layout.unpack_from(view, 0)
+        self.priority, self.tampered_flag, self.maintenance_flag = _decode_flags(flags)
+        self.payload_count = -1
+        return self
+
+    def decode_payloads(self):
+        """Walk the payload opcodes of the frame whose header was decoded last
+
+        :return: The record itself
+        :raises MalformedZombiegram: When the frame contains an unknown opcode or a truncated payload
+        """
+        view = self.view
+        length = self.length
+        count = 0
+        offset = _header_layout.size
+        while offset < length:
+            opcode = view[offset]
+            if opcode >= len(_payload_opcode_list):
+                raise MalformedZombiegram(
+                    "Package payload contains unknown opcode [{}] | Payload [{}]".format(opcode, bytes(view[:length])))
+            if count >= self.__max_payloads:
+                raise MalformedZombiegram("Package contains more payloads than a Zombiegram can hold.")
+
+            payload_class = _payload_opcode_list[opcode]
+            offset += 1
+            size = payload_class.size if payload_class.size else length - offset  # Sizeless payloads span the remainder
+            if size <= 0 or offset + size > length:
+                raise MalformedZombiegram(
+                    "Package payload contains corrupted data | Opcode [{}] | Payload [{}]".format(opcode, bytes(view[:length])))
+
+            self.opcodes[count] = opcode
+            self.offsets[count] = offset
+            self.sizes[count] = size
+            count += 1
+            offset += size
+
+            if not payload_class.can_be_combined:
+                break
+        self.payload_count = count
+        return self
+
+    def payload_class(self, index):
+        """Retrieve the payload class of the payload at the given index"""
+        return _payload_opcode_list[self.opcodes[index]]
+
+    def payload_fields(self, index):
+        """Unpack the raw fields of the payload at the given index without creating a payload object
+
+        :return: tuple of fields in wire order (see the payload's struct layout)
+        """
+        return self.payload_class(index).unpack_fields(self.view, self.offsets[index], self.sizes[index])
+
+    def materialize(self, index):
+        """Create the payload object for the payload at the given index"""
+        return self.payload_class(index).from_payload(self.view[:self.offsets[index] + self.sizes[index]],
+                                                      self.offsets[index])
+
+    def materialize_payloads(self):
+        return [self.materialize(index) for index in range(self.payload_count)]
+
+    def to_bytes(self):
+        """Copy of the decoded frame"""
+        return bytes(self.view[:self.length])
+
+    def to_zombiegram(self):
+        """Convert the record into an (immutable) Zombiegram object including all of its payloads"""
+        return Zombiegram(hmac=self.hmac, source_id=self.source_id, seq_num=self.seq_num, priority_flag=self.priority,
+                          tampered_flag=self.tampered_flag, maintenance_flag=self.maintenance_flag,
+                          raw_payload=self.to_bytes(), imported_payloads=self.materialize_payloads())
+
+
+class ZombiegramView:
+    def __init__(self, package):
+        """Lazy, read-only view on a received Zombiegram
+
+        Only the 10 byte header is unpacked at creation, which is all that is needed to reject our own echoed frames
+        and duplicates. Payloads are decoded on first access and the full Zombiegram object is only built when asked for.
+
+        :param package: Received frame; must not be modified while the view is in use
+        :raises MalformedZombiegram: When the frame is too small to contain a payload
+        """
+        self._record = ZombiegramRecord().decode_header(package)
+        self._payloads = None
+        self._zombiegram = None
+        self._trust = None  # (trust_key, result) of the last verification
+
+    @property
+    def hmac(self):
+        return self._record.hmac
+
+    @property
+    def source_id(self):
+        return self._record.source_id
+
+    @property
+    def seq_num(self):
+        return self._record.seq_num
+
+    @property
+    def priority(self):
+        return self._record.priority
+
+    @property
+    def tampered_flag(self):
+        return self._record.tampered_flag
+
+    @property
+    def maintenance_flag(self):
+        return self._record.maintenance_flag
+
+    def get_payloads(self):
+        """Retrieve all payloads belonging to this zombiegram, decoding them on first access
+
+        :return: tuple of all payloads and their contents
+        :rtype: tuple
+        :raises MalformedZombiegram: When a payload is corrupted
+        """
+        if self._payloads is None:
+            self._record.decode_payloads()
+            self._payloads = tuple(self._record.materialize_payloads())
+        return self._payloads
+
+    def get_bytestring_representation(self):
+        return self._record.to_bytes()
+
+    def is_payload_trusted(self, trust_key):
+        """Check the HMAC of the received frame against the trust_key, without decoding its payloads
+
+        :param trust_key: Key for hashing
+        :rtype: bool
+        """
+        if not trust_key:
+            return False
+        if self._trust is None or self._trust[0] != trust_key:
+            record = self._record
+            frame = record.view
+            self._trust = (trust_key, _trust_context(trust_key).verify(frame[4:record.length], bytes(frame[0:4])))
+            if self._zombiegram is not None:
+                self._zombiegram.remember_trust(*self._trust)
+        return self._trust[1]
+
+    def remember_trust(self, trust_key, trusted):
+        """Store the outcome of an earlier verification of this exact frame, see :func:`is_payload_trusted`"""
+        if trust_key:
+            self._trust = (trust_key, trusted)
+            if self._zombiegram is not None:
+                self._zombiegram.remember_trust(trust_key, trusted)
+
+    def to_zombiegram(self):
+        """Materialise the full (immutable) Zombiegram object; the result is cached"""
+        if self._zombiegram is None:
+            record = self._record
+            self._zombiegram = Zombiegram(hmac=record.hmac, source_id=record.source_id, seq_num=record.seq_num,
+                                          priority_flag=record.priority, tampered_flag=record.tampered_flag,
+                                          maintenance_flag=record.maintenance_flag, raw_payload=record.to_bytes(),
+                                          imported_payloads=list(self.get_payloads()))
+            if self._trust is not None:
+                self._zombiegram.remember_trust(*self._trust)
+        return self._zombiegram
+
+    def __str__(self):
+        if self._payloads is None:
+            return "Zombiegram view {{source_id [{}] | seq_num [{}] | priority [{}] | payloads not decoded}}".format(
+                self.source_id, self.seq_num, self.priority)
+        return str(self.to_zombiegram())
 
 
 ############
@@ -492,8 +739,10 @@ class Zombiegram:
 
 
 class Payload:
-    size = 0  # Size in bytes (without opcode)
+    size = 0  # Size in bytes (without opcode), 0 means the payload spans the remainder of the Zombiegram
     can_be_combined = True  # Flag which specifies if the payload can be combined with others
+    opcode = None  # Set from _payload_opcode_list
+    _layout = None  # Precompiled struct layout of the payload fields
 
     def __init__(self):
         raise MethodNotImplementedException()
@@ -510,6 +759,37 @@ class Payload:
     def get_size(self):
         return self.size
 
+    def pack_into(self, buffer, offset):
+        """Write the opcode and payload into a caller-supplied buffer
+
+        :return: Buffer position right after the written payload
+        :rtype: int
+        """
+        data = self.get_bytestring_representation()
+        end = offset + 1 + len(data)
+        buffer[offset] = self.opcode
+        buffer[offset + 1:end] = data
+        return end
+
+    @classmethod
+    def pack_fields_into(cls, buffer, offset, *fields):
+        """Write the opcode and raw payload fields into a buffer without creating a payload object
+
+        :return: Buffer position right after the written payload
+        :rtype: int
+        """
+        buffer[offset] = cls.opcode
+        cls._layout.pack_into(buffer, offset + 1, *fields)
+        return offset + 1 + cls.size
+
+    @classmethod
+    def unpack_fields(cls, view, offset, size):
+        """Unpack the raw payload fields without creating a payload object
+
+        :return: tuple of fields in wire order
+        """
+        return cls._layout.unpack_from(view, offset)
+
     @staticmethod
     def from_payload(payload, offset):
         raise MethodNotImplementedException()
@@ -518,6 +798,7 @@ class Payload:
 class AcknowledgePayload(Payload):
     size = 5
     can_be_combined = False
+    _layout = _Layout("!IB")
 
     def __init__(self, source_id, seq_num):
         try:
@@ -542,6 +823,9 @@ class AcknowledgePayload(Payload):
         package += self.seq_num.to_bytes(1, "big")
         return package
 
+    def pack_into(self, buffer, offset):
+        return self.pack_fields_into(buffer, offset, self.source_id, self.seq_num)
+
     def serialize_to_dict(self):
         return {
             "source_id": self.source_id,
@@ -550,15 +834,14 @@ class AcknowledgePayload(Payload):
 
     @staticmethod
     def from_payload(payload, offset):
-        source_id = struct.unpack_from("!I", payload, offset)
-        source_id = source_id[0] # unpack_from always returns a tuple
-        seq_num = payload[offset+4]
+        source_id, seq_num = AcknowledgePayload._layout.unpack_from(payload, offset)
         return AcknowledgePayload(source_id, seq_num)
 
 
 class DetectionPayload(Payload):
     size = 2
     can_be_combined = True
+    _layout = _Layout("!BB")
 
     def __init__(self, confidence_percentage, hitcounter):
         """Detection Payload
@@ -594,6 +877,9 @@ class DetectionPayload(Payload):
         package += self.hitcounter.to_bytes(1, "big")
         return package
 
+    def pack_into(self, buffer, offset):
+        return self.pack_fields_into(buffer, offset, self.confidence, self.hitcounter)
+
     def serialize_to_dict(self):
         return {
             "confidence_percentage": self.confidence,
@@ -602,9 +888,7 @@ class DetectionPayload(Payload):
 
     @staticmethod
     def from_payload(payload, offset):
-        confidence_percentage, hitcounter = struct.unpack_from("!BB", payload, offset)
-        confidence_percentage = bytes_to_int(confidence_percentage)
-        hitcounter = bytes_to_int(hitcounter)
+        confidence_percentage, hitcounter = DetectionPayload._layout.unpack_from(payload, offset)
         return DetectionPayload(confidence_percentage, hitcounter)
 
 
@@ -647,6 +931,10 @@ class UsmsPayload(Payload):
             "ascii_text": self.ascii_payload
         }
 
+    @classmethod
+    def unpack_fields(cls, view, offset, size):
+        return (view[offset:offset + size],)
+
     @staticmethod
     def from_payload(payload, offset):
         usms = usmslib.bytes_to_ascii(payload[offset:])
@@ -656,7 +944,7 @@ class UsmsPayload(Payload):
 class DiagnosticPayload(Payload):
     size = 23
     can_be_combined = True
-    __default_neighbor_id = b"\x00\x00\x00\x00"
+    _layout = _Layout("!ffIIIBBB")
 
     def __init__(self, gps_coordinates, best_neighbors, battery_status, network_role, is_sensor=False, is_router=False,
                  is_gateway=False, sensor_id=0):
@@ -732,27 +1020,27 @@ class DiagnosticPayload(Payload):
         output += "}"
         return output
 
+    def __device_network_encoder(self):
+        sensor_shift = 2
+        router_shift = 3
+        gateway_shift = 4
+        roles = 0
+        roles |= self.network_role
+        roles |= (self.is_sensor << sensor_shift)
+        roles |= (self.is_router << router_shift)
+        roles |= (self.is_gateway << gateway_shift)
+        return roles
+
     def get_bytestring_representation(self):
-        def device_network_encoder():
-            sensor_shift = 2
-            router_shift = 3
-            gateway_shift = 4
-            roles = 0
-            roles |= self.network_role
-            roles |= (self.is_sensor << sensor_shift)
-            roles |= (self.is_router << router_shift)
-            roles |= (self.is_gateway << gateway_shift)
-            return roles
-
-        package = struct.pack("!ff", self.gps_latitude, self.gps_longitude)
-        package += self.best_neighbor_one.to_bytes(4, "big") if self.best_neighbor_one else self.__default_neighbor_id
-        package += self.best_neighbor_two.to_bytes(4, "big") if self.best_neighbor_two else self.__default_neighbor_id
-        package += self.best_neighbor_three.to_bytes(4,
-                                                     "big") if self.best_neighbor_three else self.__default_neighbor_id
-        package += self.battery_status.to_bytes(1, "big")
-        package += self.sensor_id.to_bytes(1, "big")
-        package += device_network_encoder().to_bytes(1, "big")
-        return package
+        package = bytearray(self.size + 1)
+        self.pack_into(package, 0)
+        return bytes(package[1:])
+
+    def pack_into(self, buffer, offset):
+        return self.pack_fields_into(buffer, offset, self.gps_latitude, self.gps_longitude,
+                                     self.best_neighbor_one or 0, self.best_neighbor_two or 0,
+                                     self.best_neighbor_three or 0, self.battery_status, self.sensor_id,
+                                     self.__device_network_encoder())
 
     def serialize_to_dict(self):
         neighbors = []
@@ -794,8 +1082,8 @@ class DiagnosticPayload(Payload):
 
             return network_role, is_sensor, is_router, is_gateway
 
-        gps_long, gps_lat, neighbor_one, neighbor_two, neighbor_three, battery_status, sensor_id, roles = struct.unpack_from(
-            "!ffIIIBBB", payload, offset)
+        gps_lat, gps_long, neighbor_one, neighbor_two, neighbor_three, battery_status, sensor_id, roles = DiagnosticPayload._layout.unpack_from(
+            payload, offset)
         network_role, is_sensor, is_router, is_gateway = device_network_decoder(roles)
         neighbors = []
         if neighbor_one: neighbors.append(neighbor_one)
@@ -808,17 +1096,12 @@ class DiagnosticPayload(Payload):
 class NetworkChange(Payload):
     size = 4
     can_be_combined = False
+    _layout = _Layout("!4s")
 
     def __init__(self, trust_key=None, signed_source_id=None):
         if trust_key:
             message = b'\x80}'
-            self.signed_source_id = None
-            try:
-                digester = hmaclib.new(key=trust_key, msg=message, digestmod=hashlib.sha256)
-                self.signed_source_id = digester.digest()[:4]
-            except TypeError:
-                digester = hmaclib.new(key=trust_key.encode(), msg=message, digestmod=hashlib.sha256)
-                self.signed_source_id = digester.digest()[:4]
+            self.signed_source_id = _trust_context(trust_key).sign(message)[:4]
 
             if not self.signed_source_id:
                 raise MalformedZombiegram("Could not create Network Change payload.")
@@ -836,15 +1119,116 @@ class NetworkChange(Payload):
     def get_bytestring_representation(self):
         return self.signed_source_id
 
+    def pack_into(self, buffer, offset):
+        return self.pack_fields_into(buffer, offset, self.signed_source_id)
+
     def serialize_to_dict(self):
         return {}
 
     @staticmethod
     def from_payload(payload, offset):
-        signed_source = payload[offset:(offset + 4)]
+        signed_source = bytes(payload[offset:(offset + 4)])
         return NetworkChange(signed_source_id=signed_source)
 
 
+class MultiAcknowledgePayload(Payload):
+    """Acknowledgement of several zombiegrams at once
+
+    Every entry acknowledges one source: a base seq_num and a bitmap of the 8 seq_nums following it (bit i set means
+    base + 1 + i is acknowledged as well, modulo 256). Consecutive seq_nums thus form a cumulative range, sparse ones
+    are still covered as long as they lie within the window. Like USMS the payload spans the remainder of the zombiegram.
+    """
+    __entry_layout = _Layout("!IBB")
+    __window = 8  # seq_nums covered by the bitmap on top of the base
+
+    max_entries = (64 - 10 - 1) // 6  # Zombiegram max size - header - opcode
+    size = 0
+    can_be_combined = False
+
+    def __init__(self, acknowledgements):
+        """Constructor
+
+        :param acknowledgements: Iterable of (source_id, seq_num) pairs; source IDs as bytestring or integer
+        :raises MalformedZombiegram: When a source ID or seq_num is invalid
+        :raises ZombiegramPayloadOverflow: When the pairs need more than max_entries entries
+        """
+        self.entries = []  # [source_id, base seq_num, bitmap]
+        pending = {}
+        for source_id, seq_num in acknowledgements:
+            try:
+                source_id = bytes_to_int(source_id)
+            except TypeError:
+                raise MalformedZombiegram("Source ID should be a bytestring or integer. | source_id [{}]".format(source_id))
+            if not isinstance(seq_num, int) or seq_num > 255 or seq_num < 0:
+                raise MalformedZombiegram(
+                    "Sequence number should represent an integer in the range [0,255] | Given [{}]".format(seq_num))
+            pending.setdefault(source_id, []).append(seq_num)
+
+        for source_id, seq_nums in pending.items():
+            # Start a window at the first seq_num that is not covered by the previous window (in wraparound order)
+            first = seq_nums[0]
+            seq_nums = sorted(set(seq_nums), key=lambda seq: (seq - first) % 256)
+            entry = None
+            for seq_num in seq_nums:
+                distance = (seq_num - entry[1]) % 256 if entry else 0
+                if entry and 0 < distance <= MultiAcknowledgePayload.__window:
+                    entry[2] |= 1 << (distance - 1)
+                else:
+                    entry = [source_id, seq_num, 0]
+                    self.entries.append(entry)
+
+        if len(self.entries) > MultiAcknowledgePayload.max_entries:
+            raise ZombiegramPayloadOverflow("Acknowledgements need {} entries, maximum of {} allowed.".format(
+                len(self.entries), MultiAcknowledgePayload.max_entries))
+        self.size = len(self.entries) * MultiAcknowledgePayload.__entry_layout.size
+
+    def __str__(self):
+        output = "Multi acknowledgement payload {"
+        output += " | ".join("source_id [{}] seq_num [{}] bitmap [{:08b}]".format(*entry) for entry in self.entries)
+        output += "}"
+        return output
+
+    def acknowledgements(self):
+        """Iterate over the acknowledged (source_id, seq_num) pairs"""
+        for source_id, base, bitmap in self.entries:
+            yield source_id, base
+            for bit in range(MultiAcknowledgePayload.__window):
+                if bitmap & (1 << bit):
+                    yield source_id, (base + 1 + bit) % 256
+
+    def get_bytestring_representation(self):
+        package = bytearray(self.size)
+        offset = 0
+        for entry in self.entries:
+            MultiAcknowledgePayload.__entry_layout.pack_into(package, offset, *entry)
+            offset += MultiAcknowledgePayload.__entry_layout.size
+        return bytes(package)
+
+    def serialize_to_dict(self):
+        return {
+            "acknowledgements": [{"source_id": source_id, "seq_num": seq_num} for source_id, seq_num in self.acknowledgements()]
+        }
+
+    @classmethod
+    def unpack_fields(cls, view, offset, size):
+        entry_size = cls.__entry_layout.size
+        return tuple(cls.__entry_layout.unpack_from(view, position)
+                     for position in range(offset, offset + size - entry_size + 1, entry_size))
+
+    @staticmethod
+    def from_payload(payload, offset):
+        entry_size = MultiAcknowledgePayload.__entry_layout.size
+        if (len(payload) - offset) % entry_size:
+            raise MalformedZombiegram("Multi acknowledgement payload is not a multiple of {} bytes.".format(entry_size))
+        if (len(payload) - offset) // entry_size > MultiAcknowledgePayload.max_entries:
+            raise MalformedZombiegram("Multi acknowledgement payload contains too many entries.")
+        acknowledgement = MultiAcknowledgePayload(())
+        for source_id, base, bitmap in MultiAcknowledgePayload.unpack_fields(payload, offset, len(payload) - offset):
+            acknowledgement.entries.append([source_id, base, bitmap])
+        acknowledgement.size = len(acknowledgement.entries) * entry_size
+        return acknowledgement
+
+
 # List allows us to look for Opcodes (= index of the payload item) and for payloads (indexing)
 # Please do not alter the order of items
 _payload_opcode_list = [
@@ -852,11 +1236,13 @@ _payload_opcode_list = [
     NetworkChange,  # 1
     DetectionPayload,  # 2
     UsmsPayload,  # 3
-    DiagnosticPayload  # 4
+    DiagnosticPayload,  # 4
+    MultiAcknowledgePayload  # 5
 ]
 
 _no_piggyback_opcode_list = []
-for payload in _payload_opcode_list:
+for opcode, payload in enumerate(_payload_opcode_list):
+    payload.opcode = opcode
     if not payload.can_be_combined:
         _no_piggyback_opcode_list.append(payload)
 
@@ -52,6 +52,7 @@ class Sleep:
         self.__activeTime = pycom.nvs_get(Sleep.ACTIVE_TIME_KEY)
         self.__inactiveTime = pycom.nvs_get(Sleep.INACTIVE_TIME_KEY)
         self.__wakeUpPins = []
+        self.__beforeSleepCallbacks = []
 
 
     def __initPersistentVariable(self, key, value=0):
@@ -71,6 +72,10 @@ class Sleep:
         except Exception as e:
             Exceptions.error(Exception('Sleep not available: ' + str(e)))
 
+    def addBeforeSleepCallback(self, callback):
+        # called without arguments right before deepsleep, e.g. to persist state that would otherwise be lost
+        self.__beforeSleepCallbacks.append(callback)
+
     def resetTimers(self):
         pycom.nvs_set(Sleep.ACTIVE_TIME_KEY, 0)
         pycom.nvs_set(Sleep.INACTIVE_TIME_KEY, 0)
@@ -82,6 +87,12 @@ class Sleep:
         pycom.nvs_set(Sleep.SLEEP_TIME_KEY, milliseconds)
         pycom.nvs_set(Sleep.ACTIVE_TIME_KEY, self.activeTime + utime.ticks_diff(utime.ticks_ms(), self.__activityStart))
 
+        for callback in self.__beforeSleepCallbacks:
+            try:
+                callback()
+            except Exception as e:
+                Exceptions.error(Exception('Before sleep callback failed: ' + str(e)))
+
         try:
             machine.deepsleep(milliseconds)
         except Exception as e:
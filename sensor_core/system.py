@@ -88,6 +88,9 @@ class System:
     def set_zombie_detected_callback(self, zombie_detection_callback=None):
         self.external_detection_callback = zombie_detection_callback
 
+    def addBeforeSleepCallback(self, callback):
+        self.__sleep.addBeforeSleepCallback(callback)
+
     def gpsChangeCallback(self, position):
         Config.set("device_position", position, True, True)
 
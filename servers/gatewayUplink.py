@@ -0,0 +1,360 @@
+from _thread import start_new_thread, allocate_lock
+import logging
+from volatileconfiguration import VolatileConfiguration as Config
+from zombiegram import ZombiegramView
+from journal import Journal
+from clock import monotonic_ms
+from event import Event
+
+try:
+    import ujson as json
+except ImportError: # CPython (host side tooling)
+    import json
+
+
+class GatewayUplink:
+    """Asynchronous delivery of zombiegrams to the gateway webhooks
+
+    The LoRa receive path only queues raw frames; a worker thread serializes them and delivers them as JSON arrays to
+    every configured gateway_webhook_* URL. Every hook has its own bounded queue and circuit breaker, so a slow or dead
+    hook neither stalls the radio nor holds back the other hooks.
+
+    A hook's breaker opens after a few consecutive failures and stays open for an exponentially growing backoff period.
+    Frames a hook cannot take (no upstream connectivity, breaker open, queue full) are stored in a journal on the SD card
+    (see :class:`Journal`), tagged with the hooks that still need them. Once a hook is healthy again and its queue has
+    drained, the worker replays its backlog in batches and moves its journal checkpoint forward after every delivered
+    batch. Without SD card frames stay in the RAM queues, dropping the oldest ones once they are full.
+    """
+
+    __hook_config_keys = ("gateway_webhook_1", "gateway_webhook_2", "gateway_webhook_3")
+    __max_queued_per_hook = 32 # Frames held in RAM per hook, beyond this frames go to the journal
+    __max_journal_queued = 64 # Frames waiting for the worker to write them to the journal
+    __max_batch_size = 8 # Records per POST
+    __flush_interval = 2 # Seconds queued records may wait for others to batch with
+    __failure_threshold = 3 # Consecutive failures before a hook's breaker opens
+    __base_backoff_ms = 5000
+    __max_backoff_ms = 300000
+    __journal_name = "gateway_journal"
+    __journal_retry_ms = 60000 # Interval in which a missing SD card is looked for again
+    __trusted_tag = 0x80 # Journal tag bit of frames that were signed with the trust key on arrival
+
+    def __init__(self, post=None, is_online=None):
+        """Constructor
+
+        :param post: Callable with the signature of urequests.post, defaults to urequests.post. Allows testing against
+                     a local HTTP stand-in on the host.
+        :param is_online: Callable telling whether the webhooks can be reached at all, defaults to
+                          WifiManager.is_uplink_available
+        """
+        if post is None:
+            import urequests
+            post = urequests.post
+        if is_online is None:
+            from wifi import WifiManager
+            is_online = WifiManager.is_uplink_available
+        self._post = post
+        self._is_online = is_online
+        self._hooks = {} # hook index => GatewayUplink.Hook
+        self._lock = allocate_lock()
+        self._wakeup = Event()
+        self._journal = None # Opened by the worker once the SD card is available
+        self._journal_queue = [] # [(frame, tag)] waiting to be appended to the journal
+        self._journal_available = True # Until opening the journal proves otherwise
+        self._journal_retry_at = 0
+        self._started = False
+        self._stop_called = False
+        self.delivered = 0
+        self.journaled = 0
+        self.dropped = 0
+
+    def start(self):
+        """Starts the delivery worker on a separate thread"""
+        if not self._started:
+            self._started = True
+            self._stop_called = False
+            start_new_thread(self._worker, ())
+
+    def stop(self):
+        self._stop_called = True
+        self._wakeup.set()
+
+    def configured_hooks(self):
+        """Retrieve the configured hooks as a list of (hook index, url)"""
+        hooks = []
+        for index, key in enumerate(GatewayUplink.__hook_config_keys):
+            hook = Config.get(key, None)
+            if hook:
+                hooks.append((index, hook))
+        return hooks
+
+    def _hook(self, index, url):
+        hook = self._hooks.get(index)
+        if hook is None:
+            hook = GatewayUplink.Hook(index, url)
+            self._hooks[index] = hook
+        elif hook.url != url: # Reconfigured, a new endpoint deserves a fresh breaker
+            hook.url = url
+            hook.close()
+        return hook
+
+    def enqueue(self, frame, trusted=False):
+        """Queue a received zombiegram for delivery to every configured hook, never blocks on the network or SD card
+
+        :param bytes frame: Raw zombiegram frame
+        :param bool trusted: Whether the frame was signed with the trust key on arrival
+        :return: Amount of hooks the frame got queued for
+        :rtype: int
+        """
+        hooks = self.configured_hooks()
+        if not hooks:
+            return 0
+        online = self._is_online()
+        tag = 0
+        wake = False
+        with self._lock:
+            for index, url in hooks:
+                hook = self._hook(index, url)
+                full = len(hook.queue) >= GatewayUplink.__max_queued_per_hook
+                if self._journal_available and (not online or hook.is_open or hook.backlog or full):
+                    tag |= 1 << index
+                    hook.backlog = True # Later frames have to queue up behind the journaled ones
+                else:
+                    if full:
+                        hook.queue.pop(0)
+                        self.dropped += 1
+                    hook.queue.append((frame, trusted))
+                    wake = wake or len(hook.queue) >= GatewayUplink.__max_batch_size
+            if tag:
+                if len(self._journal_queue) >= GatewayUplink.__max_journal_queued:
+                    self._journal_queue.pop(0)
+                    self.dropped += 1
+                self._journal_queue.append((frame, tag | (GatewayUplink.__trusted_tag if trusted else 0)))
+        if wake:
+            self._wakeup.set()
+        return len(hooks)
+
+    def _open_journal(self):
+        if self._journal is None:
+            try:
+                self._journal = Journal(GatewayUplink.__journal_name)
+                self._journal_available = True
+            except Exception as e:
+                if self._journal_available:
+                    logging.getLogger("gatewayuplink").warning("Gateway journal unavailable, zombiegrams are only queued in RAM | Reason [{}]".format(str(e)))
+                self._journal_available = False
+                self._journal_retry_at = monotonic_ms() + GatewayUplink.__journal_retry_ms
+                return None
+            configured = [index for index, _ in self.configured_hooks()]
+            for index in range(len(GatewayUplink.__hook_config_keys)):
+                if index in configured:
+                    self._journal.add_reader(GatewayUplink.Hook.reader_name(index))
+                else:
+                    self._journal.remove_reader(GatewayUplink.Hook.reader_name(index))
+        return self._journal
+
+    def _write_journal(self):
+        """Append the frames queued by the receive path to the journal, in one block write"""
+        with self._lock:
+            entries = self._journal_queue
+            self._journal_queue = []
+        if not entries:
+            return
+        journal = self._open_journal()
+        if journal is None:
+            self.dropped += len(entries)
+            with self._lock:
+                for hook in self._hooks.values():
+                    hook.backlog = False
+            return
+        try:
+            for frame, tag in entries:
+                journal.append(frame, tag)
+            journal.flush()
+            self.journaled += len(entries)
+        except Exception as e:
+            self.dropped += len(entries)
+            self._journal = None # Reopened (and possibly recovered) on the next write
+            logging.getLogger("gatewayuplink").warning("Zombiegrams could not be journaled | Reason [{}]".format(str(e)))
+
+    def _spill(self, hook):
+        """Move the RAM queue of a hook whose breaker opened to the journal, so the RAM is not held up by a dead hook"""
+        if not self._journal_available:
+            return
+        with self._lock:
+            queue = hook.queue
+            hook.queue = []
+            hook.backlog = True
+            for frame, trusted in queue:
+                self._journal_queue.append((frame, (1 << hook.index) | (GatewayUplink.__trusted_tag if trusted else 0)))
+        self._write_journal()
+
+    @staticmethod
+    def _serialize(frame, trusted, trust_key):
+        zombiegram = ZombiegramView(frame).to_zombiegram()
+        zombiegram.remember_trust(trust_key, trusted) # Trust as verified on arrival, the key may have changed since
+        return json.dumps(zombiegram.serialize_to_dict(trust_key))
+
+    def _deliver(self, hook, batch):
+        """POST a batch of frames as one JSON array of serialized zombiegrams
+
+        :param batch: List of (frame, trusted)
+        :return: True on a 2xx response or when nothing in the batch could be serialized
+        :rtype: bool
+        """
+        trust_key = Config.get("device_trust_key", None)
+        records = []
+        for frame, trusted in batch:
+            try:
+                records.append(GatewayUplink._serialize(frame, trusted, trust_key))
+            except Exception as e:
+                logging.getLogger("gatewayuplink").warning("Zombiegram could not be serialized for the gateway hooks | Reason [{}]".format(str(e)))
+        if not records:
+            return True
+        try:
+            response = self._post(hook.url, data="[" + ",".join(records) + "]", headers={"Content-Type": "application/json"})
+            try:
+                status = response.status_code
+            finally:
+                response.close()
+            if 200 <= status <= 299:
+                return True
+            logging.getLogger("gatewayuplink").debug("External hook [{}] refused records | Status [{}]".format(hook.url, status))
+        except Exception as e:
+            logging.getLogger("gatewayuplink").debug("External hook [{}] could not be contacted | Reason [{}]".format(hook.url, str(e)))
+        return False
+
+    def _replay(self, hook):
+        """Deliver one batch of a hook's journal backlog
+
+        :return: True when a batch was delivered or the backlog turned out empty, False on a failed delivery
+        """
+        journal = self._open_journal()
+        if journal is None:
+            hook.backlog = False
+            return True
+        reader = GatewayUplink.Hook.reader_name(hook.index)
+        records, position = journal.read(reader, GatewayUplink.__max_batch_size, 1 << hook.index)
+        if records:
+            batch = [(frame, bool(tag & GatewayUplink.__trusted_tag)) for tag, frame in records]
+            if not self._deliver(hook, batch):
+                return False
+            self.delivered += len(batch)
+            logging.getLogger("gatewayuplink").debug("Replayed [{}] journaled zombiegrams to external hook [{}]".format(len(batch), hook.url))
+        journal.set_checkpoint(reader, position)
+        if not journal.pending(reader):
+            with self._lock:
+                if not any(tag & (1 << hook.index) for _, tag in self._journal_queue):
+                    hook.backlog = False
+        return True
+
+    def flush(self, now=None):
+        """Write pending journal entries and deliver one batch per hook whose breaker allows it
+
+        A hook first drains its RAM queue, then its journal backlog.
+
+        :param int now: Current monotonic time in milliseconds, defaults to monotonic_ms()
+        :return: Monotonic ms at which the next open breaker closes again, or None
+        """
+        if now is None:
+            now = monotonic_ms()
+        if not self._journal_available and now >= self._journal_retry_at:
+            self._open_journal() # The SD card might have been inserted meanwhile
+        self._write_journal()
+        hooks = dict(self.configured_hooks())
+        online = self._is_online()
+        retry_at = None
+        for index in list(self._hooks):
+            hook = self._hooks[index]
+            if index not in hooks:
+                with self._lock:
+                    self._hooks.pop(index, None)
+                if self._journal is not None:
+                    self._journal.remove_reader(GatewayUplink.Hook.reader_name(index))
+                continue
+            if hook.is_open and now < hook.retry_at:
+                retry_at = hook.retry_at if retry_at is None else min(retry_at, hook.retry_at)
+                continue
+            if not online:
+                continue
+
+            with self._lock:
+                batch = hook.queue[:GatewayUplink.__max_batch_size]
+            if batch:
+                delivered = self._deliver(hook, batch) # Outside of the lock, the receive path keeps queueing meanwhile
+                if delivered:
+                    with self._lock:
+                        del hook.queue[:len(batch)]
+                    self.delivered += len(batch)
+                    logging.getLogger("gatewayuplink").debug("Propagated [{}] zombiegrams to external hook [{}]".format(len(batch), hook.url))
+            elif hook.backlog:
+                delivered = self._replay(hook)
+            else:
+                continue
+
+            if delivered:
+                hook.close()
+            else:
+                hook.fail(now, GatewayUplink.__failure_threshold, GatewayUplink.__base_backoff_ms, GatewayUplink.__max_backoff_ms)
+                if hook.is_open:
+                    logging.getLogger("gatewayuplink").warning("External hook [{}] unavailable, backing off for [{}] ms".format(hook.url, hook.retry_at - now))
+                    retry_at = hook.retry_at if retry_at is None else min(retry_at, hook.retry_at)
+                    self._spill(hook)
+        return retry_at
+
+    def pending(self):
+        """Retrieve the amount of frames queued in RAM per hook url and whether journaled frames wait for it"""
+        with self._lock:
+            return {hook.url: {"queued": len(hook.queue), "backlog": hook.backlog} for hook in self._hooks.values()}
+
+    def _restore_backlog(self):
+        """Pick up the journal backlog of a previous boot"""
+        journal = self._open_journal()
+        if journal is None:
+            return
+        with self._lock:
+            for index, url in self.configured_hooks():
+                if journal.pending(GatewayUplink.Hook.reader_name(index)):
+                    self._hook(index, url).backlog = True
+
+    def _worker(self):
+        logging.getLogger("gatewayuplink").info("Gateway uplink worker started.")
+        self._restore_backlog()
+        while not self._stop_called:
+            try:
+                retry_at = self.flush()
+            except Exception as e:
+                retry_at = None
+                logging.getLogger("gatewayuplink").error("Gateway uplink flush failed | Reason [{}]".format(str(e)))
+            timeout = GatewayUplink.__flush_interval
+            if retry_at is not None:
+                timeout = max(min(timeout, (retry_at - monotonic_ms()) / 1000), 0.05)
+            self._wakeup.wait(timeout)
+        self._write_journal()
+        self._started = False
+        logging.getLogger("gatewayuplink").info("Gateway uplink worker stopped.")
+
+    class Hook:
+        """Delivery state of a single webhook: its queue of frames, its circuit breaker and whether it has a backlog"""
+
+        def __init__(self, index, url):
+            self.index = index # Position in the hook configuration keys, its bit in the journal tags
+            self.url = url
+            self.queue = [] # [(frame, trusted)]
+            self.failures = 0 # Consecutive failures
+            self.is_open = False
+            self.retry_at = 0
+            self.backlog = False # Frames of this hook are waiting in the journal
+
+        @staticmethod
+        def reader_name(index):
+            return "hook{}".format(index)
+
+        def close(self):
+            self.failures = 0
+            self.is_open = False
+
+        def fail(self, now, threshold, base_backoff_ms, max_backoff_ms):
+            self.failures += 1
+            if self.failures >= threshold:
+                self.is_open = True
+                self.retry_at = now + min(base_backoff_ms << min(self.failures - threshold, 16), max_backoff_ms)
@@ -7,8 +7,32 @@ from    json        import loads, dumps
 from    os          import stat
 from    _thread     import start_new_thread
 import  socket
+import  select
+import  sys
 import  gc
 import  re
+import  metrics
+from    clock       import monotonic_ms, ticks_us, elapsed_us
+
+try :
+    from errno import EAGAIN
+except :
+    EAGAIN = 11
+
+try :
+    from hashlib import sha256
+except :
+    from uhashlib import sha256
+
+try :
+    from binascii import hexlify
+except :
+    from ubinascii import hexlify
+
+_pollReportsObjects = sys.implementation.name != 'cpython'
+
+_requests       = metrics.counter("microwebsrv_requests_total", "HTTP requests handled")
+_requestLatency = metrics.histogram("microwebsrv_request_duration_ms", (10, 25, 50, 100, 250, 500, 1000, 2500, 5000), "Time between the first byte of an HTTP request and the last byte of its response")
 
 try :
     from microWebTemplate import MicroWebTemplate
@@ -21,7 +45,7 @@ except :
     pass
 
 class MicroWebSrvRoute :
-    def __init__(self, route, method, func, routeArgNames, routeRegex) :
+    def __init__(self, route, method, func, routeArgNames, routeRegex=None) :
         self.route         = route        
         self.method        = method       
         self.func          = func         
@@ -29,6 +53,49 @@ class MicroWebSrvRoute :
         self.routeRegex    = routeRegex   
 
 
+class MicroWebSrvStaticFile :
+    # A file of the web path with its precompressed .gz sibling (either may be missing), size and ETag of both are
+    # determined once and kept in the static index of the server
+    def __init__(self, name, path, gzPath) :
+        self.name   = name      # File name the content type is derived from
+        self.path   = path
+        self.gzPath = gzPath
+        self.size   = 0
+        self.etag   = None
+        self.gzSize = 0
+        self.gzEtag = None
+
+    def describe(self, buf) :
+        if self.path :
+            self.size, self.etag = MicroWebSrvStaticFile._describeFile(self.path, buf)
+        if self.gzPath :
+            self.gzSize, self.gzEtag = MicroWebSrvStaticFile._describeFile(self.gzPath, buf)
+            self.gzEtag = self.gzEtag[:-1] + '-gz"'
+
+    @staticmethod
+    def _describeFile(path, buf) :
+        # The ETag is a digest of the content, so it survives reflashing the same assets
+        h    = sha256()
+        size = 0
+        with open(path, 'rb') as file :
+            while True :
+                x = file.readinto(buf)
+                if not x :
+                    break
+                h.update(buf if x == len(buf) else buf[:x])
+                size += x
+        return size, '"%s"' % hexlify(h.digest()[:8]).decode()
+
+
+class MicroWebSrvRouteNode :
+    # One path segment of the routes with arguments: literal segments are looked up by name, arguments are tried in
+    # registration order with their converter
+    def __init__(self) :
+        self.literals = { }   # segment => node
+        self.args     = [ ]   # [(argument name, converter, node)]
+        self.handlers = { }   # method => function, for routes ending at this node
+
+
 class MicroWebSrv :
 
     # ============================================================================
@@ -74,6 +141,14 @@ class MicroWebSrv :
 
     _pyhtmlPagesExt = '.pyhtml'
 
+    _wordRegex = re.compile('^\\w*$')
+
+    _sendBufferSize = 2 * 1436   # Two full TCP segments (lwIP MSS on the ESP32) per send
+    _staticIndexSize = 32       # Static files described at most, the index starts over beyond this
+
+    _pollIntervalMs = 1000   # Stop requests and idle connections are handled at this pace
+    _recvSize       = 536    # Bytes read per receive, one TCP segment of the default MSS
+
     # ============================================================================
     # ===( Class globals  )=======================================================
     # ============================================================================
@@ -152,6 +227,12 @@ class MicroWebSrv :
     def _isPyHTMLFile(filename) :
         return filename.lower().endswith(MicroWebSrv._pyhtmlPagesExt)
 
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _wouldBlock(ex) :
+        return bool(ex.args) and ex.args[0] == EAGAIN
+
     # ============================================================================
     # ===( Constructor )==========================================================
     # ============================================================================
@@ -172,49 +253,243 @@ class MicroWebSrv :
         self.WebSocketThreaded          = True
         self.AcceptWebSocketCallback    = None
         self.LetCacheStaticContentLevel = 2
+        self.MaxConnections             = 4      # Further clients wait in the listen backlog
+        self.MaxRequestHeaderSize       = 2048   # Larger request heads are answered with 431
+        self.MaxRequestContentSize      = 8192   # Larger request contents are answered with 413
+        self.RequestTimeoutSec          = 10     # Connections without progress for this long are closed
+        self.KeepAliveTimeoutSec        = 5      # Idle persistent connections are closed after this long
+        self.MaxRequestsPerConnection   = 16     # Persistent connections are closed after this many requests
+
+        self.StaticMaxAgeSec            = 3600   # Cache-Control max-age of static files, revalidated by ETag after
+
+        self._staticIndex   = { }   # URL path => MicroWebSrvStaticFile
+        self._sendBuffer    = memoryview(bytearray(MicroWebSrv._sendBufferSize))   # Shared by all file responses
+        self._clients       = { }   # poll key => _client
+        self._poll          = None
+        self._stopRequested = False
 
         self.zombie_router = zombie_router
 
+        # Dispatch table, built once: routes without arguments are looked up by (method, path), routes with
+        # arguments in a trie of path segments
         self._routeHandlers = []
-        routeHandlers += self._docoratedRouteHandlers
-        for route, method, func in routeHandlers :
-            routeParts = route.split('/')
-            # -> ['', 'users', '<uID>', 'addresses', '<addrID>', 'test', '<anotherID>']
-            routeArgNames = []
-            routeRegex    = ''
-            for s in routeParts :
-                if s.startswith('<') and s.endswith('>') :
-                    routeArgNames.append(s[1:-1])
-                    routeRegex += '/(\\w*)'
-                elif s :
-                    routeRegex += '/' + s
-            routeRegex += '$'
-            # -> '/users/(\w*)/addresses/(\w*)/test/(\w*)$'
-            routeRegex = re.compile(routeRegex)
-
-            self._routeHandlers.append(MicroWebSrvRoute(route, method, func, routeArgNames, routeRegex))
+        self._staticRoutes  = { }   # (method, path) => function
+        self._staticMethods = { }   # path => [methods], for the Allow header of 405 responses
+        self._routeTree     = MicroWebSrvRouteNode()
+        for route, method, func in list(routeHandlers) + self._docoratedRouteHandlers :
+            self._addRoute(route, method.upper(), func)
+
+    # ============================================================================
+    # ===( Routing )==============================================================
+    # ============================================================================
+
+    @staticmethod
+    def _convertInt(s) :
+        if not (s.isdigit() or (s[:1] == '-' and s[1:].isdigit())) :
+            raise ValueError()
+        return int(s)
+
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _convertStr(s) :
+        if not s :
+            raise ValueError()
+        return s
+
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _convertAuto(s) :
+        # Arguments without type: a word, passed as int when it is one (as routes always did)
+        if not MicroWebSrv._wordRegex.match(s) :
+            raise ValueError()
+        try :
+            return int(s)
+        except :
+            return s
+
+    # ----------------------------------------------------------------------------
+
+    @staticmethod
+    def _splitPath(path) :
+        # '/users/12/' -> ['users', '12'], a single trailing slash is ignored
+        if path.endswith('/') :
+            path = path[:-1]
+        return path.split('/')[1:] if path else [ ]
+
+    # ----------------------------------------------------------------------------
+
+    def _addRoute(self, route, method, func) :
+        segments = MicroWebSrv._splitPath(route)
+        # -> ['users', '<int:uID>', 'addresses', '<addrID>']
+        routeArgNames = [ ]
+        node          = self._routeTree
+        for segment in segments :
+            if segment.startswith('<') and segment.endswith('>') :
+                elements = segment[1:-1].split(':', 1)
+                if len(elements) == 2 :
+                    if elements[0] not in MicroWebSrv._routeConverters :
+                        raise ValueError("Unknown route argument type [%s] in [%s]" % (elements[0], route))
+                    name, converter = elements[1], MicroWebSrv._routeConverters[elements[0]]
+                else :
+                    name, converter = elements[0], MicroWebSrv._convertAuto
+                routeArgNames.append(name)
+                child = None
+                for argName, argConverter, argNode in node.args :
+                    if argName == name and argConverter == converter :
+                        child = argNode
+                if child is None :
+                    child = MicroWebSrvRouteNode()
+                    node.args.append((name, converter, child))
+                node = child
+            else :
+                child = node.literals.get(segment)
+                if child is None :
+                    child = MicroWebSrvRouteNode()
+                    node.literals[segment] = child
+                node = child
+        self._routeHandlers.append(MicroWebSrvRoute(route, method, func, routeArgNames))
+        if routeArgNames :
+            node.handlers.setdefault(method, func)
+        else :
+            path = '/' + '/'.join(segments)
+            if (method, path) not in self._staticRoutes :
+                self._staticRoutes[(method, path)] = func
+                self._staticMethods.setdefault(path, [ ]).append(method)
+
+    # ----------------------------------------------------------------------------
+
+    def _matchRoute(self, node, segments, index, method, routeArgs, allowed) :
+        # Depth first, literal segments before arguments; methods of paths that match with another method are
+        # collected in allowed
+        if index == len(segments) :
+            func = node.handlers.get(method)
+            if func :
+                return func
+            for m in node.handlers :
+                if m not in allowed :
+                    allowed.append(m)
+            return None
+        segment = segments[index]
+        child   = node.literals.get(segment)
+        if child :
+            func = self._matchRoute(child, segments, index+1, method, routeArgs, allowed)
+            if func :
+                return func
+        for name, converter, child in node.args :
+            try :
+                value = converter(segment)
+            except :
+                continue
+            routeArgs[name] = value
+            func = self._matchRoute(child, segments, index+1, method, routeArgs, allowed)
+            if func :
+                return func
+            del routeArgs[name]
+        return None
+
+    # ----------------------------------------------------------------------------
+
+    def ResolveRoute(self, resUrl, method) :
+        """ Returns (function, route arguments or None, allowed methods); the allowed methods list the methods
+            routed for this path when none is routed for the given method """
+        method   = method.upper()
+        segments = MicroWebSrv._splitPath(resUrl)
+        path     = '/' + '/'.join(segments)
+        func     = self._staticRoutes.get((method, path))
+        if func :
+            return (func, None, None)
+        allowed   = list(self._staticMethods.get(path, ()))
+        routeArgs = { }
+        func      = self._matchRoute(self._routeTree, segments, 0, method, routeArgs, allowed)
+        if func :
+            return (func, routeArgs, None)
+        return (None, None, allowed)
 
     # ============================================================================
     # ===( Server Process )=======================================================
     # ============================================================================
 
+    @staticmethod
+    def _pollKey(sock) :
+        # MicroPython's poll reports the registered socket objects, CPython's their file descriptors
+        return sock if _pollReportsObjects else sock.fileno()
+
+    # ----------------------------------------------------------------------------
+
     def _serverProcess(self) :
+        # A single poll loop serves every connection: requests are parsed as their bytes arrive and responses are sent
+        # as far as each socket takes them, so one slow client no longer holds up the others
         self._started = True
-        while True :
+        self._poll    = select.poll()
+        self._poll.register(self._server, select.POLLIN)
+        serverKey     = MicroWebSrv._pollKey(self._server)
+        accepting     = True
+        nextSweep     = monotonic_ms()
+        while not self._stopRequested :
             try :
-                client, cliAddr = self._server.accept()
-            except Exception as ex :
-                if ex.args and ex.args[0] == 113 :
-                    break
-                continue
-            self._client(self, client, cliAddr, self.zombie_router)
+                events = self._poll.poll(MicroWebSrv._pollIntervalMs)
+            except :
+                events = ()
+            for obj, event in events :
+                if obj == serverKey :
+                    self._acceptClient()
+                else :
+                    client = self._clients.get(obj)
+                    if client :
+                        client._onEvent(event)
+            now = monotonic_ms()
+            if now >= nextSweep :
+                for client in list(self._clients.values()) :
+                    client._checkTimeout(now)
+                nextSweep = now + MicroWebSrv._pollIntervalMs
+            # At the connection limit new clients wait in the listen backlog, unless an idle connection can make room
+            if accepting != (len(self._clients) < self.MaxConnections or self._idleClient() is not None) :
+                accepting = not accepting
+                self._poll.modify(self._server, select.POLLIN if accepting else 0)
+        for client in list(self._clients.values()) :
+            client._close()
+        try :
+            self._server.close()
+        except :
+            pass
+        self._poll    = None
         self._started = False
 
+    # ----------------------------------------------------------------------------
+
+    def _acceptClient(self) :
+        try :
+            sock, addr = self._server.accept()
+        except :
+            return
+        if len(self._clients) >= self.MaxConnections :
+            idle = self._idleClient()
+            if idle is None :
+                sock.close()
+                return
+            idle._close()
+        client = MicroWebSrv._client(self, sock, addr, self.zombie_router)
+        self._clients[client._pollKey] = client
+        self._poll.register(sock, select.POLLIN)
+
+    # ----------------------------------------------------------------------------
+
+    def _idleClient(self) :
+        # Persistent connection waiting for its next request the longest, None when there is none
+        idle = None
+        for client in self._clients.values() :
+            if client._isIdle() and (idle is None or client._lastActivity < idle._lastActivity) :
+                idle = client
+        return idle
+
     # ============================================================================
     # ===( Functions )============================================================
     # ============================================================================
 
     def Start(self, threaded=False) :
+        self._stopRequested = False
         if not self._started :
             self._server = socket.socket( socket.AF_INET,
                                           socket.SOCK_STREAM,
@@ -223,7 +498,8 @@ class MicroWebSrv :
                                      socket.SO_REUSEADDR,
                                      1 )
             self._server.bind(self._srvAddr)
-            self._server.listen(1)
+            self._server.listen(self.MaxConnections)
+            self._server.setblocking(False)
             if threaded :
                 MicroWebSrv._startThread(self._serverProcess)
             else :
@@ -232,8 +508,9 @@ class MicroWebSrv :
     # ----------------------------------------------------------------------------
 
     def Stop(self) :
+        # The poll loop closes every socket within one poll interval
         if self._started :
-            self._server.close()
+            self._stopRequested = True
 
     # ----------------------------------------------------------------------------
 
@@ -257,28 +534,8 @@ class MicroWebSrv :
     # ----------------------------------------------------------------------------
     
     def GetRouteHandler(self, resUrl, method) :
-        if self._routeHandlers :
-            #resUrl = resUrl.upper()
-            if resUrl.endswith('/') :
-                resUrl = resUrl[:-1]
-            method = method.upper()
-            for rh in self._routeHandlers :
-                if rh.method == method :
-                    m = rh.routeRegex.match(resUrl)
-                    if m :   # found matching route?
-                        if rh.routeArgNames :
-                            routeArgs = {}
-                            for i, name in enumerate(rh.routeArgNames) :
-                                value = m.group(i+1)
-                                try :
-                                    value = int(value)
-                                except :
-                                    pass
-                                routeArgs[name] = value
-                            return (rh.func, routeArgs)
-                        else :
-                            return (rh.func, None)
-        return (None, None)
+        func, routeArgs, allowed = self.ResolveRoute(resUrl, method)
+        return (func, routeArgs)
 
     # ----------------------------------------------------------------------------
 
@@ -294,6 +551,35 @@ class MicroWebSrv :
                 return physPath
         return None
 
+    # ----------------------------------------------------------------------------
+
+    def _getStaticFile(self, urlPath) :
+        # Files are looked up and described on their first request only, see InvalidateStaticFiles()
+        asset = self._staticIndex.get(urlPath)
+        if asset is None :
+            if '..' in urlPath :
+                return None
+            path = self._physPathFromURLPath(urlPath)
+            name = path or self._webPath + urlPath   # A file may exist only precompressed
+            if urlPath == '/' and not path :
+                return None
+            gzPath = name + '.gz' if MicroWebSrv._fileExists(name + '.gz') else None
+            if not path and not gzPath :
+                return None
+            asset = MicroWebSrvStaticFile(name, path, gzPath)
+            if not MicroWebSrv._isPyHTMLFile(asset.name) :
+                asset.describe(self._sendBuffer)
+            if len(self._staticIndex) >= MicroWebSrv._staticIndexSize :
+                self._staticIndex = { }
+            self._staticIndex[urlPath] = asset
+        return asset
+
+    # ----------------------------------------------------------------------------
+
+    def InvalidateStaticFiles(self) :
+        """ Forgets the sizes and ETags of the static files, to be called after files in the web path changed """
+        self._staticIndex = { }
+
     # ============================================================================
     # ===( Class Client  )========================================================
     # ============================================================================
@@ -303,94 +589,321 @@ class MicroWebSrv :
         # ------------------------------------------------------------------------
 
         def __init__(self, microWebSrv, socket, addr, zombie_router=None) :
-            socket.settimeout(2)
+            socket.setblocking(False)
             self._microWebSrv   = microWebSrv
             self._socket        = socket
             self._addr          = addr
-            self._method        = None
-            self._path          = None
-            self._httpVer       = None
-            self._resPath       = "/"
-            self._queryString   = ""
-            self._queryParams   = { }
-            self._headers       = { }
-            self._contentType   = None
-            self._contentLength = 0
-            self.zombie_router = zombie_router
-            
-            if hasattr(socket, 'readline'):   # MicroPython
-                self._socketfile = self._socket
-            else:   # CPython
-                self._socketfile = self._socket.makefile('rwb')
-                        
-            self._processRequest()
+            self._pollKey       = MicroWebSrv._pollKey(socket)
+            self.zombie_router  = zombie_router
+            self._received      = b''       # Request bytes not processed yet
+            self._sendQueue     = [ ]       # Response bytes the socket did not take yet
+            self._sendOffset    = 0         # Bytes of the first queued chunk already sent
+            self._producer      = None      # Iterator over the remaining response content (files, streams)
+            self._closed        = False
+            self._detached      = False     # Handed over to a websocket, blocking from then on
+            self._lastActivity  = monotonic_ms()
+            self._requestCount  = 0
+            self._keepAlive     = False     # Whether the connection stays open after the current response
+            self._resetRequest()
+
+        # ------------------------------------------------------------------------
+
+        def _resetRequest(self) :
+            self._method         = None
+            self._path           = None
+            self._httpVer        = None
+            self._resPath        = "/"
+            self._queryString    = ""
+            self._queryParams    = { }
+            self._headers        = { }
+            self._contentType    = None
+            self._contentLength  = 0
+            self._content        = b''
+            self._contentOffset  = 0
+            self._headerEnd      = None
+            self._requestStarted = None
+            self._responding     = False
+            self._responseWritten = False
+
+        # ------------------------------------------------------------------------
+
+        def _onEvent(self, event) :
+            try :
+                if event & select.POLLERR :
+                    self._close()
+                    return
+                if event & (select.POLLIN | select.POLLHUP) :
+                    self._onReadable()
+                if event & select.POLLOUT and not self._closed :
+                    self._onWritable()
+            except :
+                self._close()
+
+        # ------------------------------------------------------------------------
+
+        def _onReadable(self) :
+            try :
+                data = self._socket.recv(MicroWebSrv._recvSize)
+            except OSError as ex :
+                if MicroWebSrv._wouldBlock(ex) :
+                    return
+                raise
+            if not data :
+                self._close()   # Peer closed the connection
+                return
+            self._lastActivity = monotonic_ms()
+            if self._requestStarted is None :
+                self._requestStarted = ticks_us()
+            self._received += data
+            self._parseRequest()
+
+        # ------------------------------------------------------------------------
+
+        def _parseRequest(self) :
+            # Pipelined requests are answered one after the other, in order, as long as their responses complete
+            # right away; otherwise the rest waits until the response in progress is sent
+            while self._received and not self._responding and not self._closed :
+                if self._requestStarted is None :
+                    self._requestStarted = ticks_us()
+                if self._headerEnd is None :
+                    end = self._received.find(b'\r\n\r\n')
+                    if end < 0 or end > self._microWebSrv.MaxRequestHeaderSize :
+                        if end >= 0 or len(self._received) > self._microWebSrv.MaxRequestHeaderSize :
+                            self._respondError(431)
+                        return
+                    lines = self._received[:end].decode().split('\r\n')
+                    self._headerEnd = end + 4
+                    if not self._parseFirstLine(lines[0]) or not self._parseHeader(lines[1:]) :
+                        self._respondError(400)
+                        return
+                    if 'transfer-encoding' in self._headers :
+                        self._respondError(411)   # Only Content-Length framing is supported
+                        return
+                    if self._contentLength > self._microWebSrv.MaxRequestContentSize :
+                        self._respondError(413)
+                        return
+                    self._keepAlive = self._wantsKeepAlive()
+                end = self._headerEnd + self._contentLength
+                if len(self._received) < end :
+                    return   # Content still underway
+                self._content  = self._received[self._headerEnd:end]
+                self._received = self._received[end:]
+                self._processRequest()
+
+        # ------------------------------------------------------------------------
+
+        def _wantsKeepAlive(self) :
+            # HTTP/1.1 connections persist unless the client asks otherwise, HTTP/1.0 clients get the connection closed
+            srv = self._microWebSrv
+            if self._httpVer != 'HTTP/1.1' or srv._stopRequested :
+                return False
+            if 'close' in self._headers.get('connection', '').lower() :
+                return False
+            return self._requestCount + 1 < srv.MaxRequestsPerConnection
 
         # ------------------------------------------------------------------------
 
         def _processRequest(self) :
+            self._responding = True
+            response = MicroWebSrv._response(self)
             try :
-                response = MicroWebSrv._response(self)
-                if self._parseFirstLine(response) :
-                    if self._parseHeader(response) :
-                        upg = self._getConnUpgrade()
-                        if not upg :
-                            routeHandler, routeArgs = self._microWebSrv.GetRouteHandler(self._resPath, self._method)
-                            if routeHandler :
-                                if routeArgs is not None:
-                                    routeHandler(self, response, routeArgs)
-                                else:
-                                    routeHandler(self, response)
-                            elif self._method.upper() == "GET" :
-                                filepath = self._microWebSrv._physPathFromURLPath(self._resPath)
-                                if filepath :
-                                    if MicroWebSrv._isPyHTMLFile(filepath) :
-                                        response.WriteResponsePyHTMLFile(filepath)
-                                    else :
-                                        contentType = self._microWebSrv.GetMimeTypeFromFilename(filepath)
-                                        if contentType :
-                                            if self._microWebSrv.LetCacheStaticContentLevel > 0 :
-                                                if self._microWebSrv.LetCacheStaticContentLevel > 1 and \
-                                                   'if-modified-since' in self._headers :
-                                                    response.WriteResponseNotModified()
-                                                else:
-                                                    headers = { 'Last-Modified' : 'Fri, 1 Jan 2018 23:42:00 GMT', \
-                                                                'Cache-Control' : 'max-age=315360000' }
-                                                    response.WriteResponseFile(filepath, contentType, headers)
-                                            else :
-                                                response.WriteResponseFile(filepath, contentType)
-                                        else :
-                                            response.WriteResponseForbidden()
-                                else :
-                                    response.WriteResponseNotFound()
+                upg = self._getConnUpgrade()
+                if not upg :
+                    routeHandler, routeArgs, allowed = self._microWebSrv.ResolveRoute(self._resPath, self._method)
+                    if routeHandler :
+                        if routeArgs is not None:
+                            routeHandler(self, response, routeArgs)
+                        else:
+                            routeHandler(self, response)
+                    elif allowed :
+                        response.WriteResponseMethodNotAllowed(allowed)
+                    elif self._method.upper() == "GET" :
+                        asset = self._microWebSrv._getStaticFile(self._resPath)
+                        if asset :
+                            if MicroWebSrv._isPyHTMLFile(asset.name) :
+                                response.WriteResponsePyHTMLFile(asset.name)
                             else :
-                                response.WriteResponseMethodNotAllowed()
-                        elif upg == 'websocket' and 'MicroWebSocket' in globals() \
-                             and self._microWebSrv.AcceptWebSocketCallback :
-                                MicroWebSocket( socket         = self._socket,
-                                                httpClient     = self,
-                                                httpResponse   = response,
-                                                maxRecvLen     = self._microWebSrv.MaxWebSocketRecvLen,
-                                                threaded       = self._microWebSrv.WebSocketThreaded,
-                                                acceptCallback = self._microWebSrv.AcceptWebSocketCallback )
-                                return
+                                contentType = self._microWebSrv.GetMimeTypeFromFilename(asset.name)
+                                if contentType :
+                                    response.WriteResponseStaticFile(asset, contentType)
+                                else :
+                                    response.WriteResponseForbidden()
                         else :
-                            response.WriteResponseNotImplemented()
+                            response.WriteResponseNotFound()
                     else :
-                        response.WriteResponseBadRequest()
+                        response.WriteResponseMethodNotAllowed(['GET'])
+                elif upg == 'websocket' and 'MicroWebSocket' in globals() \
+                     and self._microWebSrv.AcceptWebSocketCallback :
+                        self._detach()
+                        MicroWebSocket( socket         = self._socket,
+                                        httpClient     = self,
+                                        httpResponse   = response,
+                                        maxRecvLen     = self._microWebSrv.MaxWebSocketRecvLen,
+                                        threaded       = self._microWebSrv.WebSocketThreaded,
+                                        acceptCallback = self._microWebSrv.AcceptWebSocketCallback )
+                        return
+                else :
+                    response.WriteResponseNotImplemented()
             except :
+                self._keepAlive = False   # Whatever the handler already wrote can not be framed anymore
                 response.WriteResponseInternalServerError()
+            if not self._responseWritten :
+                self._keepAlive = False   # Without any response, closing the connection is the only answer left
+            self._finishResponse()
+
+        # ------------------------------------------------------------------------
+
+        def _respondError(self, code) :
+            self._responding = True
+            self._keepAlive  = False   # The rest of the received bytes can not be framed
+            MicroWebSrv._response(self).WriteResponseError(code)
+            self._finishResponse()
+
+        # ------------------------------------------------------------------------
+
+        def _finishResponse(self) :
+            if self._closed :
+                return
+            if self._sendQueue or self._producer :
+                self._microWebSrv._poll.modify(self._socket, select.POLLOUT)
+            else :
+                self._complete()
+
+        # ------------------------------------------------------------------------
+
+        def _complete(self) :
+            if self._requestStarted is not None :
+                _requests.inc()
+                _requestLatency.observe(elapsed_us(self._requestStarted) // 1000)
+            self._requestCount += 1
+            if not self._keepAlive or self._microWebSrv._stopRequested :
+                self._close()
+                return
+            self._lastActivity = monotonic_ms()
+            self._resetRequest()
+            self._microWebSrv._poll.modify(self._socket, select.POLLIN)
+
+        # ------------------------------------------------------------------------
+
+        def _isIdle(self) :
+            return self._requestCount > 0 and not self._responding and not self._received and not self._closed
+
+        # ------------------------------------------------------------------------
+
+        def _trySend(self, data) :
+            try :
+                sent = self._socket.send(data)
+                return sent if sent else 0
+            except OSError as ex :
+                if MicroWebSrv._wouldBlock(ex) :
+                    return 0
+                raise
+
+        # ------------------------------------------------------------------------
+
+        def _send(self, data) :
+            # Sends what the socket takes right away and queues the rest, which the poll loop sends once the socket is
+            # writable again; handlers never wait for a slow client. Responses too large to be held in memory at once
+            # are written as streams or files, their chunks are only pulled once the queue got sent.
+            if self._closed and not self._detached :
+                raise OSError('Connection closed')
+            self._responseWritten = True
+            size = len(data)
+            sent = 0
+            if not self._sendQueue :
+                sent = self._trySend(data)
+            if self._detached :
+                while sent < size :
+                    sent += self._socket.send(memoryview(data)[sent:])
+                return size
+            if sent < size :
+                if type(data) == bytes :   # Immutable, queued as is
+                    if not self._sendQueue :
+                        self._sendOffset = sent
+                    self._sendQueue.append(data)
+                else :                     # May be a reused buffer
+                    self._sendQueue.append(bytes(memoryview(data)[sent:]))
+            return size
+
+        # ------------------------------------------------------------------------
+
+        def _flush(self) :
+            # Returns whether the whole queue got sent
+            while self._sendQueue :
+                chunk = self._sendQueue[0]
+                sent  = self._trySend(memoryview(chunk)[self._sendOffset:])
+                if not sent :
+                    return False
+                self._sendOffset += sent
+                if self._sendOffset >= len(chunk) :
+                    self._sendQueue.pop(0)
+                    self._sendOffset = 0
+            return True
+
+        # ------------------------------------------------------------------------
+
+        def _onWritable(self) :
+            self._lastActivity = monotonic_ms()
+            while self._flush() :
+                if self._producer is None :
+                    self._complete()
+                    self._parseRequest()   # Pipelined requests received meanwhile
+                    return
+                try :
+                    chunk = next(self._producer)
+                except StopIteration :
+                    self._producer = None
+                    continue
+                if chunk :
+                    self._send(chunk.encode() if type(chunk) == str else chunk)
+
+        # ------------------------------------------------------------------------
+
+        def _checkTimeout(self, now) :
+            timeout = self._microWebSrv.KeepAliveTimeoutSec if self._isIdle() else self._microWebSrv.RequestTimeoutSec
+            if now - self._lastActivity > timeout * 1000 :
+                self._close()
+
+        # ------------------------------------------------------------------------
+
+        def _forget(self) :
+            self._closed = True
+            try :
+                self._microWebSrv._poll.unregister(self._socket)
+            except :
+                pass
+            self._microWebSrv._clients.pop(self._pollKey, None)
+            if self._producer and hasattr(self._producer, 'close') :
+                try :
+                    self._producer.close()   # Closes files of unfinished responses
+                except :
+                    pass
+            self._producer    = None
+            self._sendQueue   = [ ]
+
+        # ------------------------------------------------------------------------
+
+        def _close(self) :
+            if self._closed :
+                return
+            self._forget()
             try :
-                if self._socketfile is not self._socket:
-                    self._socketfile.close()
                 self._socket.close()
             except :
                 pass
 
         # ------------------------------------------------------------------------
 
-        def _parseFirstLine(self, response) :
+        def _detach(self) :
+            self._forget()
+            self._detached = True
+            self._socket.setblocking(True)
+
+        # ------------------------------------------------------------------------
+
+        def _parseFirstLine(self, line) :
             try :
-                elements = self._socketfile.readline().decode().strip().split()
+                elements = line.strip().split()
                 if len(elements) == 3 :
                     self._method  = elements[0].upper()
                     self._path    = elements[1]
@@ -413,18 +926,18 @@ class MicroWebSrv :
     
         # ------------------------------------------------------------------------
 
-        def _parseHeader(self, response) :
-            while True :
-                elements = self._socketfile.readline().decode().strip().split(':', 1)
-                if len(elements) == 2 :
+        def _parseHeader(self, lines) :
+            try :
+                for line in lines :
+                    elements = line.split(':', 1)
+                    if len(elements) != 2 :
+                        return False
                     self._headers[elements[0].strip().lower()] = elements[1].strip()
-                elif len(elements) == 1 and len(elements[0]) == 0 :
-                    if self._method == 'POST' or self._method == 'PUT' :
-                        self._contentType   = self._headers.get("content-type", None)
-                        self._contentLength = int(self._headers.get("content-length", 0))
-                    return True
-                else :
-                    return False
+                self._contentType   = self._headers.get("content-type", None)
+                self._contentLength = int(self._headers.get("content-length", 0))
+                return self._contentLength >= 0
+            except :
+                return False
 
         # ------------------------------------------------------------------------
 
@@ -496,17 +1009,16 @@ class MicroWebSrv :
         # ------------------------------------------------------------------------
 
         def ReadRequestContent(self, size=None) :
-            self._socket.setblocking(False)
-            b = None
-            try :
-                if not size :
-                    b = self._socketfile.read(self._contentLength)
-                elif size > 0 :
-                    b = self._socketfile.read(size)
-            except :
-                pass
-            self._socket.setblocking(True)
-            return b if b else b''
+            # The content was received completely before the route handler got called
+            start = self._contentOffset
+            if not size :
+                b = self._content[start:]
+            elif size > 0 :
+                b = self._content[start:start+size]
+            else :
+                b = b''
+            self._contentOffset += len(b)
+            return b
 
         # ------------------------------------------------------------------------
 
@@ -547,7 +1059,7 @@ class MicroWebSrv :
             if data :
                 if type(data) == str :
                     data = data.encode()
-                return self._client._socketfile.write(data)
+                return self._client._send(data)
             return 0
 
         # ------------------------------------------------------------------------
@@ -578,6 +1090,15 @@ class MicroWebSrv :
 
         # ------------------------------------------------------------------------
 
+        def _writeConnectionHeader(self) :
+            if self._client._keepAlive :
+                self._writeHeader("Connection", "keep-alive")
+                self._writeHeader("Keep-Alive", "timeout=%d" % self._client._microWebSrv.KeepAliveTimeoutSec)
+            else :
+                self._writeHeader("Connection", "close")
+
+        # ------------------------------------------------------------------------
+
         def _writeEndHeader(self) :
             self._write("\r\n")
 
@@ -588,11 +1109,12 @@ class MicroWebSrv :
             if isinstance(headers, dict) :
                 for header in headers :
                     self._writeHeader(header, headers[header])
-            if contentLength > 0 :
-                self._writeContentTypeHeader(contentType, contentCharset)
-                self._writeHeader("Content-Length", contentLength)
+            if code != 304 :   # A 304 has no body and must not describe one
+                if contentLength > 0 :
+                    self._writeContentTypeHeader(contentType, contentCharset)
+                self._writeHeader("Content-Length", contentLength)   # Frames the response on persistent connections
             self._writeServerHeader()
-            self._writeHeader("Connection", "close")
+            self._writeConnectionHeader()
             self._writeEndHeader()
 
         # ------------------------------------------------------------------------
@@ -606,8 +1128,6 @@ class MicroWebSrv :
                     self._writeHeader(header, headers[header])
             self._writeServerHeader()
             self._writeEndHeader()
-            if self._client._socketfile is not self._client._socket :
-                self._client._socketfile.flush()   # CPython needs flush to continue protocol
 
         # ------------------------------------------------------------------------
 
@@ -628,6 +1148,30 @@ class MicroWebSrv :
 
         # ------------------------------------------------------------------------
 
+        def WriteResponseStream(self, chunks, contentType=None, contentCharset=None, headers=None) :
+            # Content of unknown length: chunked on persistent connections, otherwise the connection is closed to mark
+            # its end. The chunks are pulled by the server whenever the client is ready for more.
+            try :
+                self._writeFirstLine(200)
+                if isinstance(headers, dict) :
+                    for header in headers :
+                        self._writeHeader(header, headers[header])
+                self._writeContentTypeHeader(contentType, contentCharset)
+                self._writeServerHeader()
+                if self._client._keepAlive :
+                    self._writeHeader("Transfer-Encoding", "chunked")
+                self._writeConnectionHeader()
+                self._writeEndHeader()
+                if self._client._keepAlive :
+                    self._client._producer = MicroWebSrv._response._chunked(chunks)
+                else :
+                    self._client._producer = iter(chunks)
+                return True
+            except :
+                return False
+
+        # ------------------------------------------------------------------------
+
         def WriteResponsePyHTMLFile(self, filepath, headers=None, vars=None) :
             if 'MicroWebTemplate' in globals() :
                 with open(filepath, 'r') as file :
@@ -653,20 +1197,9 @@ class MicroWebSrv :
             try :
                 size = stat(filepath)[6]
                 if size > 0 :
-                    with open(filepath, 'rb') as file :
-                        self._writeBeforeContent(200, headers, contentType, None, size)
-                        try :
-                            buf = bytearray(1024)
-                            while size > 0 :
-                                x = file.readinto(buf)
-                                if x < len(buf) :
-                                    buf = memoryview(buf)[:x]
-                                self._write(buf)
-                                size -= x
-                            return True
-                        except :
-                            self.WriteResponseInternalServerError()
-                            return False
+                    self._writeBeforeContent(200, headers, contentType, None, size)
+                    self._client._producer = MicroWebSrv._response._fileChunks(filepath, 0, size, self._client._microWebSrv._sendBuffer)
+                    return True
             except :
                 pass
             self.WriteResponseNotFound()
@@ -674,6 +1207,99 @@ class MicroWebSrv :
 
         # ------------------------------------------------------------------------
 
+        @staticmethod
+        def _chunked(chunks) :
+            for chunk in chunks :
+                if chunk :
+                    if type(chunk) == str :
+                        chunk = chunk.encode()
+                    yield ('%x\r\n' % len(chunk)).encode()
+                    yield chunk
+                    yield b'\r\n'
+            yield b'0\r\n\r\n'
+
+        # ------------------------------------------------------------------------
+
+        @staticmethod
+        def _fileChunks(filepath, offset, size, buf) :
+            # The file is opened once the client is ready for content and closed when the response ends or is aborted.
+            # Every chunk is read into the shared send buffer, whatever the socket does not take right away is copied
+            # into the send queue of the connection before the next chunk (of any connection) is read.
+            with open(filepath, 'rb') as file :
+                if offset :
+                    file.seek(offset)
+                while size > 0 :
+                    x = file.readinto(buf if size >= len(buf) else buf[:size])
+                    if not x :
+                        return
+                    yield buf if x == len(buf) else buf[:x]
+                    size -= x
+
+        # ------------------------------------------------------------------------
+
+        def _parseRange(self, size, etag) :
+            # (first, last) byte of a single range request, None to send the whole file, False when not satisfiable
+            spec = self._client._headers.get('range')
+            if not spec or not spec.startswith('bytes=') or ',' in spec :
+                return None
+            ifRange = self._client._headers.get('if-range')
+            if ifRange and ifRange != etag :
+                return None   # Changed since the client got its part
+            try :
+                first, last = spec[6:].strip().split('-', 1)
+                if not first :
+                    suffix = int(last)
+                    if suffix <= 0 :
+                        return False
+                    return (max(0, size - suffix), size - 1)
+                first = int(first)
+                last  = min(int(last), size - 1) if last else size - 1
+            except :
+                return None
+            if first > last or first >= size :
+                return False
+            return (first, last)
+
+        # ------------------------------------------------------------------------
+
+        def WriteResponseStaticFile(self, asset, contentType) :
+            # Serves the .gz sibling to clients accepting gzip, answers If-None-Match with 304 and single byte ranges
+            # with 206
+            srv     = self._client._microWebSrv
+            gzip    = asset.gzPath and 'gzip' in self._client._headers.get('accept-encoding', '')
+            if not gzip and not asset.path :
+                return self.WriteResponseError(406)
+            path, size, etag = (asset.gzPath, asset.gzSize, asset.gzEtag) if gzip else (asset.path, asset.size, asset.etag)
+            headers = { 'Accept-Ranges' : 'bytes' }
+            if asset.gzPath :
+                headers['Vary'] = 'Accept-Encoding'
+            if srv.LetCacheStaticContentLevel > 0 :
+                headers['ETag']          = etag
+                headers['Cache-Control'] = 'max-age=%d' % srv.StaticMaxAgeSec
+                ifNoneMatch = self._client._headers.get('if-none-match')
+                if srv.LetCacheStaticContentLevel > 1 and ifNoneMatch and (etag in ifNoneMatch or ifNoneMatch.strip() == '*') :
+                    return self.WriteResponseNotModified(headers)
+            if gzip :
+                headers['Content-Encoding'] = 'gzip'
+            byteRange = self._parseRange(size, etag)
+            if byteRange is False :
+                headers['Content-Range'] = 'bytes */%d' % size
+                return self.WriteResponseError(416, headers)
+            if byteRange :
+                code, offset, length     = 206, byteRange[0], byteRange[1] - byteRange[0] + 1
+                headers['Content-Range'] = 'bytes %d-%d/%d' % (byteRange[0], byteRange[1], size)
+            else :
+                code, offset, length     = 200, 0, size
+            try :
+                self._writeBeforeContent(code, headers, contentType, None, length)
+                if length > 0 :
+                    self._client._producer = MicroWebSrv._response._fileChunks(path, offset, length, srv._sendBuffer)
+                return True
+            except :
+                return False
+
+        # ------------------------------------------------------------------------
+
         def WriteResponseFileAttachment(self, filepath, attachmentName, headers=None) :
             if not isinstance(headers, dict) :
                 headers = { }
@@ -698,10 +1324,10 @@ class MicroWebSrv :
 
         # ------------------------------------------------------------------------
 
-        def WriteResponseError(self, code) :
+        def WriteResponseError(self, code, headers=None) :
             responseCode = self._responseCodes.get(code, ('Unknown reason', ''))
             return self.WriteResponse( code,
-                                       None,
+                                       headers,
                                        "text/html",
                                        "UTF-8",
                                        self._errCtnTmpl % {
@@ -721,8 +1347,8 @@ class MicroWebSrv :
 
         # ------------------------------------------------------------------------
 
-        def WriteResponseNotModified(self) :
-            return self.WriteResponseError(304)
+        def WriteResponseNotModified(self, headers=None) :
+            return self.WriteResponse(304, headers, None, None, None)   # Never has a body
 
         # ------------------------------------------------------------------------
 
@@ -744,8 +1370,9 @@ class MicroWebSrv :
 
         # ------------------------------------------------------------------------
 
-        def WriteResponseMethodNotAllowed(self) :
-            return self.WriteResponseError(405)
+        def WriteResponseMethodNotAllowed(self, allowed=None) :
+            headers = { "Allow" : ", ".join(allowed) } if allowed else None
+            return self.WriteResponseError(405, headers)
 
         # ------------------------------------------------------------------------
 
@@ -847,6 +1474,8 @@ class MicroWebSrv :
                   'Cannot satisfy request range.'),
             417: ('Expectation Failed',
                   'Expect condition could not be satisfied.'),
+            431: ('Request Header Fields Too Large',
+                  'Request header fields are too large.'),
 
             500: ('Internal Server Error', 'Server got itself in trouble'),
             501: ('Not Implemented',
@@ -863,3 +1492,9 @@ class MicroWebSrv :
     # ============================================================================
     # ============================================================================
 
+# Typed route arguments, e.g. '/users/<int:uID>'
+MicroWebSrv._routeConverters = {
+    'int'   : MicroWebSrv._convertInt,
+    'float' : float,
+    'str'   : MicroWebSrv._convertStr
+}
@@ -4,12 +4,39 @@ import socket
 from loramesh import Loramesh
 from zombiegram import *
 import logging
-import time
 import machine
-from dropqueue import DropQueue
+from replaywindow import ReplayWindowTable
+from neighbortable import NeighborTable
+from diagnosticslog import DiagnosticsLog
+from retransmissionpolicy import AdaptiveRetransmissionPolicy
 from volatileconfiguration import VolatileConfiguration as Config
-import urequests
 import gc
+import heapq
+import os
+import struct
+import time
+from clock import monotonic_ms, ticks_us, elapsed_us
+from event import Event
+from airtime import AirtimeBudget, time_on_air_ms
+from gatewayUplink import GatewayUplink
+import metrics
+
+# Updated on the RX/TX paths, see metrics.py (rendered at /metrics)
+_frames_received = metrics.counter("zombierouter_frames_received_total", "LoRa frames received")
+_frames_sent = metrics.counter("zombierouter_frames_sent_total", "LoRa frames sent, retransmissions and acknowledgements included")
+_frames_duplicate = metrics.counter("zombierouter_frames_duplicate_total", "Received zombiegrams that were already seen")
+_frames_dropped_own = metrics.counter("zombierouter_frames_dropped_total", "Frames dropped before being processed or sent", {"reason": "own"})
+_frames_dropped_untrusted = metrics.counter("zombierouter_frames_dropped_total", labels={"reason": "untrusted"})
+_frames_dropped_malformed = metrics.counter("zombierouter_frames_dropped_total", labels={"reason": "malformed"})
+_frames_dropped_send_failed = metrics.counter("zombierouter_frames_dropped_total", labels={"reason": "send_failed"})
+_frames_dropped_queue_full = metrics.counter("zombierouter_frames_dropped_total", labels={"reason": "queue_full"})
+_frames_dropped_airtime = metrics.counter("zombierouter_frames_dropped_total", labels={"reason": "airtime"})
+_retransmissions = metrics.counter("zombierouter_retransmissions_total", "Retransmitted zombiegrams")
+_ack_latency_ms = metrics.histogram("zombierouter_ack_latency_ms", (250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000), "Time between the first transmission of a cached zombiegram and each new acknowledgement")
+_retransmission_cache_size = metrics.gauge("zombierouter_retransmission_cache_size", "Zombiegrams awaiting acknowledgements")
+_transmit_queue_depth = metrics.gauge("zombierouter_transmit_queue_depth", "Queued payloads waiting to be sent")
+_hmac_sign_us = metrics.histogram("zombierouter_hmac_us", (250, 500, 1000, 2000, 4000, 8000, 16000), "Time spent computing zombiegram HMACs", {"operation": "sign"})
+_hmac_verify_us = metrics.histogram("zombierouter_hmac_us", (250, 500, 1000, 2000, 4000, 8000, 16000), labels={"operation": "verify"})
 
 class ZombieRouterException(Exception):
     pass
@@ -26,6 +53,20 @@ class ZombieRouter:
     __device_source_id = bytes_to_int(machine.unique_id()) & 0xFFFFFFFF
     __port = 1337
     __max_transmissions_per_burst = 10
+    __replay_window_size = 30 # Sequence numbers remembered per source
+    __max_tracked_sources = 64 # Least recently seen sources are evicted beyond this
+    __idle_tick_interval = 10 # Maximal seconds between two processor ticks
+    __min_tick_interval = 0.05 # Minimal seconds between two processor ticks
+    __max_queued_per_priority = 16 # Oldest queued zombiegram of a priority lane is dropped beyond this
+    __mesh_overhead_bytes = 25 # Estimated OpenThread MAC + 6LoWPAN/UDP overhead per LoRa frame
+    __urgent_priority = 3
+    __max_verified_frames = 64 # Verification outcomes remembered
+    __ack_delay_ms = 200 # Acknowledgements are held back this long to be aggregated, urgent zombiegrams are acked at once
+    __state_filename = "/flash/datastore/router_state.bin" # Snapshot written before deep sleep, see save_state()
+    __state_magic = b"ZRS\x01" # File identifier and format version
+    __max_state_age = 3600 # Seconds after which snapshotted retransmissions are no longer worth sending
+    __diagnostics_filename = "/flash/datastore/diagnostics.bin" # Ring buffer of diagnostic samples, see record_diagnostics()
+    __diagnostics_capacity = 1024 # Samples kept, 3.5 days at the default 5 minute interval
 
     def __init__(self, lora_object):
         self._started = False
@@ -36,15 +77,34 @@ class ZombieRouter:
             self._lora = LoRa(mode=LoRa.LORA, region=LoRa.EU868, bandwidth=LoRa.BW_125KHZ, sf=7)
         self._lora_mesh = None
         self._socket = None
-        self._neighbor_sequences = {}
-        self._package_acks = {}
-        self._zombiegram_queue = []
+        self._neighbor_sequences = ReplayWindowTable(ZombieRouter.__max_tracked_sources, ZombieRouter.__replay_window_size)
+        self._neighbors = NeighborTable() # Refreshed from the mesh once per processor tick
+        self._retransmission_cache = ZombieRouter.RetransmissionCache()
+        self._retransmission_cache.completion_listener = self._neighbors.record_acknowledgements
+        self._retransmission_policy = AdaptiveRetransmissionPolicy(self._neighbors, Config)
+        self._zombiegram_queue = ZombieRouter.TransmitQueue(ZombieRouter.__max_queued_per_priority)
         self._zombiegram_queue_lock = allocate_lock()
+        self._queue_blocked_until = None # Monotonic ms at which the airtime budget allows the queue head again
+        self._lora_sf, self._lora_bandwidth_hz = self._lora_phy_settings()
+        self._airtime_budget = AirtimeBudget(now=monotonic_ms())
+        self._batching_report_at = monotonic_ms()
+        self._batching_report_frames_saved = 0
+        self._wakeup = Event() # Wakes the processor thread (queued zombiegrams, acks, new neighbors, stop)
+        self._gateway_uplink = GatewayUplink()
+        self._mesh_ip = None
+        self._verified_frames = ZombieRouter.VerifiedFrameCache(ZombieRouter.__max_verified_frames)
+        self._pending_acks = [] # [(source_id, seq_num, address of the neighbor it came from)]
+        self._pending_acks_due = None # Monotonic ms at which the held back acknowledgements have to go out
+        self._pending_acks_lock = allocate_lock()
+        self._diagnostics = None # Opened on the first sample
+        self._diagnostics_due = monotonic_ms() # A sample is taken right after (re)booting
+        self.battery_level = None # Function returning the battery level in range [0,101] (101: unknown), see sensor_core Battery
 
     def start(self):
         """Starts the ZombieRouter LoRa mechanism on a separate thread
         """
         if not self._started:
+            self._restore_state() # Before the receive callback, so restored replay windows apply to the first frame
             self._lora_mesh = Loramesh(lora=self._lora)
             self._lora_mesh.mesh.rx_cb(self._process_package)
             self._socket = socket.socket(socket.AF_LORA, socket.SOCK_RAW)
@@ -52,11 +112,117 @@ class ZombieRouter:
             self._started = True
             self._stop_called = False
             start_new_thread(self._lora_zombiegram_processor, ())
+            self._gateway_uplink.start()
 
     def stop(self):
-        logging.getLogger("zombierouter").info("Zombierouter stop issued. Please wait LoRa routing threads to stop. (10sec)")
+        logging.getLogger("zombierouter").info("Zombierouter stop issued. Please wait for the LoRa routing thread to stop.")
         self._stop_called = True
         self._lora_mesh.mesh.rx_cb(self._process_package_dummy)
+        self._wakeup.set()
+        self._gateway_uplink.stop()
+
+    def save_state(self):
+        """Write a snapshot of the router state to flash, meant to be called right before deep sleep
+
+        The snapshot holds the sequence number counter, the replay windows and the raw frames of the pending
+        retransmissions, see :func:`_encode_state`. It is restored (and removed) by the next :func:`start`.
+
+        :return: Size of the snapshot in bytes, 0 when it could not be written
+        :rtype: int
+        """
+        try:
+            data = self._encode_state()
+            temporary_filename = ZombieRouter.__state_filename + ".tmp"
+            with open(temporary_filename, "wb") as f:
+                f.write(data)
+            try:
+                os.remove(ZombieRouter.__state_filename)
+            except OSError:
+                pass
+            os.rename(temporary_filename, ZombieRouter.__state_filename) # A sleep interrupted while writing leaves the previous snapshot intact
+            logging.getLogger("zombierouter").info("Router state saved | Retransmissions [{}] | Size [{}] bytes".format(self._retransmission_cache.retransmission_count(), len(data)))
+            return len(data)
+        except Exception as e:
+            logging.getLogger("zombierouter").error("Router state could not be saved | Reason [{}]".format(str(e)))
+            return 0
+
+    def _restore_state(self):
+        try:
+            with open(ZombieRouter.__state_filename, "rb") as f:
+                data = f.read()
+        except OSError:
+            return # Cold boot or nothing was saved
+        try:
+            os.remove(ZombieRouter.__state_filename) # Applied once; a later power cycle must not replay it
+        except OSError:
+            pass
+        try:
+            restored = self._decode_state(data)
+            logging.getLogger("zombierouter").info("Router state restored | Replay windows [{}] | Retransmissions [{}]".format(restored[0], restored[1]))
+        except Exception as e:
+            logging.getLogger("zombierouter").warning("Router state snapshot is invalid, ignored | Reason [{}]".format(str(e)))
+
+    def _encode_state(self):
+        """Binary snapshot of the router state (all fields big endian)
+
+        magic (4s) | seq_num (B) | saved at, seconds of the RTC (I) | window count (B)
+        per window: source_id (I) | highest seq_num (B) | bitmap (I)
+        retransmission count (B)
+        per retransmission: own message (B) | attempts (B) | ack count (B) | frame length (H) | acked ids (I each) | frame
+
+        :rtype: bytes
+        """
+        windows = self._neighbor_sequences.get_state()[-255:] # Most recently used ones
+        retransmissions = self._retransmission_cache.get_state()[:255]
+        parts = [struct.pack("!4sBIB", ZombieRouter.__state_magic, Config.get("lora_seq_num", 0) % 256, int(time.time()), len(windows))]
+        for source_id, highest, bitmap in windows:
+            parts.append(struct.pack("!IBI", source_id, highest, bitmap))
+        parts.append(struct.pack("!B", len(retransmissions)))
+        for frame, own_message, attempts, acked_ids in retransmissions:
+            acked_ids = acked_ids[:255]
+            parts.append(struct.pack("!BBBH", own_message, attempts, len(acked_ids), len(frame)))
+            for acked_id in acked_ids:
+                parts.append(struct.pack("!I", acked_id))
+            parts.append(frame)
+        return b"".join(parts)
+
+    def _decode_state(self, data):
+        """Apply a snapshot written by :func:`_encode_state`
+
+        Retransmissions older than the maximum state age are dropped, the sequence number and replay windows are always
+        restored since forgetting them causes collisions and duplicate processing.
+
+        :return: tuple (restored windows, restored retransmissions)
+        :raises ValueError: When the snapshot is not recognised or truncated
+        """
+        if data[:4] != ZombieRouter.__state_magic:
+            raise ValueError("Unknown snapshot format")
+        _, seq_num, saved_at, window_count = struct.unpack_from("!4sBIB", data, 0)
+        offset = 10
+        windows = []
+        for _ in range(window_count):
+            windows.append(struct.unpack_from("!IBI", data, offset))
+            offset += 9
+        retransmissions = []
+        retransmission_count = struct.unpack_from("!B", data, offset)[0]
+        offset += 1
+        for _ in range(retransmission_count):
+            own_message, attempts, ack_count, frame_length = struct.unpack_from("!BBBH", data, offset)
+            offset += 5
+            acked_ids = list(struct.unpack_from("!" + "I" * ack_count, data, offset)) if ack_count else []
+            offset += 4 * ack_count
+            frame = bytes(data[offset:offset + frame_length])
+            if len(frame) != frame_length:
+                raise ValueError("Snapshot is truncated")
+            offset += frame_length
+            retransmissions.append((frame, bool(own_message), attempts, acked_ids))
+
+        Config.set("lora_seq_num", seq_num, False)
+        self._neighbor_sequences.set_state(windows)
+        age = time.time() - saved_at
+        if age < 0 or age > ZombieRouter.__max_state_age:
+            return len(windows), 0 # The RTC was reset or the zombiegrams are too old to still matter
+        return len(windows), self._retransmission_cache.set_state(retransmissions, monotonic_ms())
 
     def is_network_ready(self):
         """Retrieve whether the network is ready for packet transmissions
@@ -66,93 +232,233 @@ class ZombieRouter:
         """
         started = self._started
         connected = self._lora_mesh.is_connected() if started else False
-        has_neighbors = True if connected and self._lora_mesh.neighbors() else False
+        has_neighbors = True if connected and len(self._neighbors) else False
         return has_neighbors
 
     def retransmission_count(self):
-        count = 0
-        for source, rt_cache in self._package_acks.items():
-            count += rt_cache.retransmission_count()
-        return count
+        return self._retransmission_cache.retransmission_count()
     
     def get_neighbors(self):
-        neighbor_ids = []
-        if self._started and self._lora_mesh.neighbors():
-            count = 0
-            for neighbor in self._lora_mesh.neighbors():
-                neighbor_ids.append(neighbor[0] & 0xFFFFFFFF)
-        return neighbor_ids
+        """Retrieve the IDs of all mesh neighbors, best link quality first"""
+        return self._neighbors.best() if self._started else []
+
+    def get_best_neighbors(self, k=3):
+        """Retrieve the IDs of the k mesh neighbors with the best link quality, e.g. for a DiagnosticPayload"""
+        return self._neighbors.best(k) if self._started else []
+
+    def get_neighbor_table(self):
+        """Retrieve the smoothed link statistics of every neighbor, best first (see NeighborTable.snapshot)"""
+        return self._neighbors.snapshot()
+
+    def get_retransmission_state(self):
+        """Retrieve the retransmission policy in use with its current targets, attempt budgets and ack probabilities"""
+        state = self._retransmission_policy.snapshot()
+        state["policy"] = "adaptive" if self._retransmission_cache.policy else "static"
+        state["cached"] = self._retransmission_cache.retransmission_count()
+        state["delivered"] = self._retransmission_cache.delivered
+        state["exhausted"] = self._retransmission_cache.exhausted
+        return state
+
+    def get_diagnostics(self):
+        """Retrieve the diagnostics log, None when it could not be opened (yet)"""
+        return self._diagnostics
+
+    def record_diagnostics(self):
+        """Append a sample of the battery level, position, roles and neighbor state to the diagnostics log on flash
+
+        Taken every `diagnostics_interval` seconds by the processor and right before deep sleep, so the history can be
+        fetched later on (see /diagnostics) instead of keeping devices awake to answer polls.
+
+        :return: Whether the sample was stored
+        :rtype: bool
+        """
+        try:
+            if self._diagnostics is None:
+                self._diagnostics = DiagnosticsLog(ZombieRouter.__diagnostics_filename, ZombieRouter.__diagnostics_capacity)
+            position = Config.get("device_position", None) or (0.0, 0.0)
+            battery = 101
+            if self.battery_level:
+                battery = min(101, max(0, int(self.battery_level())))
+            roles = (DiagnosticsLog.ROLE_SENSOR if Config.get("device_is_sensor", False) else 0) | \
+                    (DiagnosticsLog.ROLE_ROUTER if Config.get("device_is_router", False) else 0) | \
+                    (DiagnosticsLog.ROLE_GATEWAY if Config.get("device_is_gateway", False) else 0) | \
+                    (DiagnosticsLog.FLAG_TAMPERED if Config.get("lora_tampered_flag", False) else 0) | \
+                    (DiagnosticsLog.FLAG_MAINTENANCE if Config.get("lora_maintenance_flag", False) else 0)
+            mesh_state = self._lora_mesh.state if self._lora_mesh else 0
+            sample = [int(time.time()), float(position[0]), float(position[1]), battery, roles, mesh_state,
+                      min(255, len(self._neighbors)), min(255, self._retransmission_cache.retransmission_count())]
+            best = self._neighbors.best(3)
+            for index in range(3):
+                neighbor_id = best[index] if index < len(best) else 0
+                sample += [neighbor_id & 0xFFFFFFFF, int(self._neighbors.quality(neighbor_id) * 255)]
+            sample.append(gc.mem_free() if hasattr(gc, "mem_free") else 0)
+            self._diagnostics.append(sample)
+            return True
+        except Exception as e:
+            logging.getLogger("zombierouter").warning("Diagnostic sample could not be recorded | Reason [{}]".format(str(e)))
+            return False
+
+    def _handle_diagnostics(self, now):
+        interval = Config.get("diagnostics_interval", 300)
+        if not interval or now < self._diagnostics_due:
+            return
+        self._diagnostics_due = now + interval * 1000
+        self.record_diagnostics()
+
+    def _refresh_neighbors(self):
+        """Query the mesh neighbor records, only done once per tick since every query goes through the OpenThread stack"""
+        self._neighbors.update(self._lora_mesh.neighbors())
+
+    def _lora_phy_settings(self):
+        """Retrieve the spreading factor and bandwidth (Hz) of the LoRa radio, used for airtime calculations"""
+        bandwidths = {LoRa.BW_125KHZ: 125000, LoRa.BW_250KHZ: 250000, LoRa.BW_500KHZ: 500000}
+        try:
+            return self._lora.sf(), bandwidths.get(self._lora.bandwidth(), 125000)
+        except Exception:
+            return 7, 125000
+
+    def _frame_airtime_ms(self, zombiegram_length):
+        return time_on_air_ms(zombiegram_length + ZombieRouter.__mesh_overhead_bytes, self._lora_sf, self._lora_bandwidth_hz)
 
     def _handle_retransmissions(self):
-        # Retrieve all unfinished packages
-        package_collection = []
-        total_wipes = 0
-        
-        neighbor_count = len(self._lora_mesh.neighbors()) if self._lora_mesh.neighbors() else 0
-        for source, rt_cache in self._package_acks.items():
-            source_collection, wipes = rt_cache.remove_completed_packages(neighbor_count)
-            package_collection += source_collection
-            total_wipes += wipes
-        if neighbor_count == 0 and total_wipes > 0:
+        now = monotonic_ms()
+        neighbor_count = len(self._neighbors)
+        if neighbor_count:
+            neighbor_count = max(1, self._neighbors.active_count()) # Neighbors not heard from for a while will not ack
+        adaptive = Config.get("lora_retransmission_policy", "adaptive") == "adaptive"
+        self._retransmission_cache.policy = self._retransmission_policy if adaptive else None
+
+        # Out of airtime: only urgent retransmissions go out, others are deferred until the budget recovers
+        max_airtime = self._frame_airtime_ms(Zombiegram.get_max_package_size())
+        min_priority = 0 if self._airtime_budget.can_send(max_airtime, now) else ZombieRouter.__urgent_priority
+        defer_ms = self._airtime_budget.ms_until_available(max_airtime, now)
+        package_collection, wipes = self._retransmission_cache.pop_due(now, neighbor_count, ZombieRouter.__max_transmissions_per_burst, min_priority, defer_ms)
+        if neighbor_count == 0 and wipes > 0:
             logging.getLogger("zombierouter").debug("Current neighbor count is 0, all retransmission caches were wiped.")
             return
 
-        # Sort by priorty
-        package_collection.sort(key=lambda x: x.priority, reverse=True) # Highest priority = highest value -> Reverse required
-        
-        # Retransmit
-        for package in package_collection[0:10]:
+        # Retransmit (already sorted by priority)
+        for package in package_collection:
             self.forward_zombiegram(package, False)
+            _retransmissions.inc()
             logging.getLogger("zombierouter").debug("Retransmitting package from source_id [{}] to all neighbors.".format(package.source_id))
 
+    def _seconds_until_next_tick(self):
+        next_due = self._retransmission_cache.next_due()
+        ack_due = self._pending_acks_due
+        if ack_due is not None and (next_due is None or ack_due < next_due):
+            next_due = ack_due
+        if self._queue_blocked_until is not None and (next_due is None or self._queue_blocked_until < next_due):
+            next_due = self._queue_blocked_until
+        if next_due is None:
+            return ZombieRouter.__idle_tick_interval
+        seconds = (next_due - monotonic_ms()) / 1000
+        return min(ZombieRouter.__idle_tick_interval, max(ZombieRouter.__min_tick_interval, seconds))
+
+    def _tick(self):
+        """Run a single iteration of the processor thread
+
+        :return: Seconds until the next iteration is due, unless the processor is woken up earlier
+        :rtype: float
+        """
+        self._refresh_neighbors()
+        new_ip = self._lora_mesh.ip() # Triggers internal update (Pycom weird implementation detail)
+        if self._mesh_ip != new_ip:
+            logging.getLogger("zombieserver").info("LoRa mesh interface IP changed from [{}] to [{}]".format(self._mesh_ip, new_ip))
+            self._mesh_ip = new_ip
+
+        # Held back acknowledgements
+        self._flush_acknowledgements()
+
+        # Handle queued items
+        if self.is_network_ready() and len(self._zombiegram_queue):
+            self._flush_zombiegram_queue()
+
+        # Retransmission logic
+        self._handle_retransmissions()
+        self._report_batching(monotonic_ms())
+        self._handle_diagnostics(monotonic_ms())
+        _retransmission_cache_size.set(self._retransmission_cache.retransmission_count())
+        _transmit_queue_depth.set(len(self._zombiegram_queue))
+        return self._seconds_until_next_tick()
+
     def _lora_zombiegram_processor(self):
         # Start up Meshing
-        while True:
-            time.sleep(2) # Short sleep since this is only a mesh boot
+        while not self._stop_called:
+            self._wakeup.wait(2) # Short sleep since this is only a mesh boot
             if not self._lora_mesh.is_connected():
                 continue
             break
 
         # A mesh has been initialised or we are connected to one
-        ip = self._lora_mesh.ip()
+        self._mesh_ip = self._lora_mesh.ip()
         while not self._stop_called:
-            new_ip = self._lora_mesh.ip() # Triggers internal update (Pycom weird implementation detail)
-            if ip != new_ip:
-                logging.getLogger("zombieserver").info("LoRa mesh interface IP changed from [{}] to [{}]".format(ip, new_ip))
-                ip = new_ip
-
-            # Handle queued items
-            if self.is_network_ready() and self._zombiegram_queue:
-                with self._zombiegram_queue_lock:
-                    for queue_item in self._zombiegram_queue:
-                        self.send_zombiegram(queue_item[0], *(queue_item[1]))
-                    logging.getLogger("zombierouter").info("A total of [{}] queued zombiegrams were sent out.".format(len(self._zombiegram_queue)))
-                    del self._zombiegram_queue[:]
-
-            # Retransmission logic
-            self._handle_retransmissions()
-
-            time.sleep(10) # Longer sleep
+            # Sleep until woken up or until the next retransmission is due (idle nodes still only tick every 10 sec)
+            try:
+                interval = self._tick()
+            except Exception as e: # One bad tick must not stop routing
+                logging.getLogger("zombierouter").error("Router tick failed | Reason [{}]".format(str(e)))
+                interval = ZombieRouter.__idle_tick_interval
+            self._wakeup.wait(interval)
 
         self._lora_mesh.mesh.deinit()
         self._socket.close()
         self._started = False
         with self._zombiegram_queue_lock:
-            del self._zombiegram_queue[:]
+            self._zombiegram_queue.clear()
         logging.getLogger("zombierouter").info("Zombierouter thread stopped. Router is now inactive.")        
 
-    def _handle_gateway_propagation(self, zombiegram):
-        gateway_hooks = []
-        if Config.get("gateway_webhook_1", None): gateway_hooks.append(Config.get("gateway_webhook_1"))
-        if Config.get("gateway_webhook_2", None): gateway_hooks.append(Config.get("gateway_webhook_2"))
-        if Config.get("gateway_webhook_3", None): gateway_hooks.append(Config.get("gateway_webhook_3"))
+    def _flush_zombiegram_queue(self):
+        """Send queued zombiegrams, highest priority first, as far as the airtime budget allows
 
-        for hook in gateway_hooks:
-            try:
-                urequests.post(hook, json=zombiegram.serialize_to_dict(Config.get("device_trust_key", None)))
-                logging.getLogger("zombierouter").debug("Propagated incoming zombiegram to external hook [{}]".format(hook))
-            except Exception as e:
-                logging.getLogger("zombierouter").debug("External hook [{}] could not be contacted | Reason [{}]".format(hook, str(e)))
+        Combinable payloads of the same priority are piggybacked into as few zombiegrams as possible once their linger
+        window passed. Urgent zombiegrams are always sent (they may put the budget in debt). When the budget runs out,
+        low priority zombiegrams are dropped and the remaining ones wait until the budget recovers.
+        """
+        sent = 0
+        linger_ms = Config.get("lora_batch_linger_ms", 500)
+        capacity = Zombiegram.get_max_package_size() - Zombiegram.get_header_size()
+        while True:
+            with self._zombiegram_queue_lock:
+                now = monotonic_ms()
+                priority, items, self._queue_blocked_until = self._zombiegram_queue.next_batch(now, linger_ms, capacity)
+                if not items:
+                    break
+                payloads = []
+                length = Zombiegram.get_header_size()
+                for item in items:
+                    payloads += item[1]
+                    length += item[2]
+                airtime = self._frame_airtime_ms(length)
+                if priority < ZombieRouter.__urgent_priority and not self._airtime_budget.can_send(airtime, now):
+                    dropped = self._zombiegram_queue.drop_lane(0)
+                    if dropped:
+                        _frames_dropped_airtime.inc(dropped)
+                        logging.getLogger("zombierouter").warning("Airtime budget exhausted, dropped [{}] low priority queued zombiegrams.".format(dropped))
+                    if len(self._zombiegram_queue):
+                        self._queue_blocked_until = now + self._airtime_budget.ms_until_available(airtime, now)
+                    break
+                self._zombiegram_queue.remove(priority, items)
+            self.send_zombiegram(priority, *payloads) # Outside of the lock, queueing should never wait on the radio
+            sent += 1
+        if sent:
+            logging.getLogger("zombierouter").info("A total of [{}] queued zombiegrams were sent out.".format(sent))
+
+    def _report_batching(self, now):
+        if now - self._batching_report_at < 60000:
+            return
+        saved = self._zombiegram_queue.frames_saved - self._batching_report_frames_saved
+        if saved:
+            logging.getLogger("zombierouter").info("Piggybacking saved [{}] zombiegrams in the last minute.".format(saved))
+        self._batching_report_at = now
+        self._batching_report_frames_saved = self._zombiegram_queue.frames_saved
+
+    def _handle_gateway_propagation(self, zombiegram):
+        # Only the raw frame is queued here, the gateway uplink worker serializes it and does the (slow) HTTP delivery
+        try:
+            self._gateway_uplink.enqueue(zombiegram.get_bytestring_representation(), zombiegram.is_payload_trusted(Config.get("device_trust_key", None)))
+        except Exception as e:
+            logging.getLogger("zombierouter").warning("Zombiegram could not be queued for the gateway hooks | Reason [{}]".format(str(e)))
 
     def _process_package_dummy(self):
         pass
@@ -165,34 +471,54 @@ class ZombieRouter:
             if len(rcv_data) == 0: # Mandatory check
                 break
 
+            _frames_received.inc()
             rcv_addr = rcv_addr[0]
             logging.getLogger("zombieserver").debug("LoRa interface detected incoming message from IP [{}]".format(rcv_addr))
             try:
-                zg = Zombiegram.from_package(rcv_data)
+                # Only the header is decoded here; own and duplicate frames are dropped before any payload is parsed
+                zg = ZombiegramView(rcv_data)
                 logging.getLogger("zombieserver").debug(zg)
 
                 # Check if this message is not one of our own returning
                 if zg.source_id == bytes_to_int(ZombieRouter.__device_source_id):
                     logging.getLogger("zombieserver").debug("Incoming message is our own, ignoring.")
+                    _frames_dropped_own.inc()
+                    continue
+
+                # Forged frames are dropped before they are acknowledged, forwarded or take up a retransmission slot. Without
+                # a trust key (not configured yet or cleared by a NetworkChange) nothing can be verified, so every frame passes
+                trust_key = Config.get("device_trust_key", None)
+                if trust_key and Config.get("lora_verify_before_forward", False) and not self._verified_frames.verify(zg, trust_key):
+                    logging.getLogger("zombierouter").debug("Zombiegram from [{}] with seq_num [{}] failed trust verification, dropped.".format(zg.source_id, zg.seq_num))
+                    _frames_dropped_untrusted.inc()
                     continue
 
-                # Check if we already encountered this neighbor
-                if not zg.source_id in self._neighbor_sequences:
-                    self._neighbor_sequences[zg.source_id] = DropQueue(10)
+                # A source we do not know yet; the mesh changed, let the processor reconsider queued zombiegrams
+                if zg.source_id not in self._neighbor_sequences:
+                    self._wakeup.set()
 
                 # Check if we already encountered this message
                 zombiegram_needs_to_be_acknowledged = True
                 zombiegram_needs_gateway_forwarding = True
-                if zg.seq_num not in self._neighbor_sequences[zg.source_id]:
+                if not self._neighbor_sequences.is_replay(zg.source_id, zg.seq_num):
                     # This zombiegram has not been encountered before, acknowledge it and process its contents and forward if needed
                     for payload in zg.get_payloads():
+                        if isinstance(payload, (AcknowledgePayload, MultiAcknowledgePayload)) and zombiegram_needs_to_be_acknowledged:
+                            self._neighbors.learn_source_id(rcv_addr, zg.source_id) # Acknowledgements are never forwarded, the sender created it
                         if isinstance(payload, AcknowledgePayload):
                             zombiegram_needs_to_be_acknowledged = False
                             zombiegram_needs_gateway_forwarding = False
                             try:
-                                self._package_acks[payload.source_id].add_ack_from(zg.source_id, payload.seq_num)
-                            except: pass # We can ignore this; a cache miss can happen when enough acks are already received and the given seq_num is removed by _handle_retransmissions()
+                                self._retransmission_cache.add_ack_from(zg.source_id, payload.source_id, payload.seq_num)
+                                self._wakeup.set() # Retransmission schedule changed
+                            except ZombieRouterInvalidAckCache: pass # We can ignore this; a cache miss can happen when enough acks are already received and the given seq_num is removed
                             logging.getLogger("zombierouter").debug("Received acknowledgement from [{}] for a sent zombiegram from source_id [{}] with seq_num [{}]".format(zg.source_id, payload.source_id, payload.seq_num))
+                        if isinstance(payload, MultiAcknowledgePayload):
+                            zombiegram_needs_to_be_acknowledged = False
+                            zombiegram_needs_gateway_forwarding = False
+                            if self._retransmission_cache.add_acks_from(zg.source_id, payload.acknowledgements()):
+                                self._wakeup.set() # Retransmission schedule changed
+                            logging.getLogger("zombierouter").debug("Received aggregated acknowledgement from [{}] | {}".format(zg.source_id, payload))
                         if isinstance(payload, NetworkChange):
                             Config.set("device_trust_key", None, True, True)
                             Config.save_configuration_to_datastore("global")
@@ -200,23 +526,25 @@ class ZombieRouter:
 
                     # We only forward non-ack zombiegrams
                     if zombiegram_needs_to_be_acknowledged:
-                        self.forward_zombiegram(zg)
+                        self.forward_zombiegram(zg.to_zombiegram())
 
                     # Gateway forwarding
                     if Config.get("device_is_gateway", False) and zombiegram_needs_gateway_forwarding:
                         self._handle_gateway_propagation(zg)
 
                     # Add to seen queue
-                    self._neighbor_sequences[zg.source_id].append(zg.seq_num)
+                    self._neighbor_sequences.add(zg.source_id, zg.seq_num)
                 else:
                     logging.getLogger("zombierouter").debug("Zombiegram from [{}] with seq_num[{}] was already seen by this device, ignoring.".format(zg.source_id, zg.seq_num))
+                    _frames_duplicate.inc()
 
                 # An Acknowledgement is needed in any case since our ack might have gotten lost or this is the first time we see this zombiegram
                 if zombiegram_needs_to_be_acknowledged:
-                    self._send_acknowledgement(source=zg.source_id, seq=zg.seq_num, to=rcv_addr)
+                    self._queue_acknowledgement(source=zg.source_id, seq=zg.seq_num, to=rcv_addr, priority=zg.priority)
                 
             except Exception as e:
                 logging.getLogger("zombieserver").warning("LoRa interface received unknown/malformed data | Exception [{}] | Data [{}]".format(str(e), rcv_data))
+                _frames_dropped_malformed.inc()
         
     def _create_zombiegram_header(self, priority):
         seq = 0
@@ -236,34 +564,77 @@ class ZombieRouter:
         zg = self._create_zombiegram_header(priority)
         for payload in payloads:
             zg.add_payload(payload)
+        started = ticks_us()
         zg.sign_package(Config.get("device_trust_key", None))
+        _hmac_sign_us.observe(elapsed_us(started))
         return zg
         
     def _send_zombiegram_to(self, zombiegram, address, add_to_retransmission_cache=False):
+        data = zombiegram.get_bytestring_representation()
         try:
-            self._socket.sendto(zombiegram.get_bytestring_representation(), (address, ZombieRouter.__port)) # MULTICAST_LINK_ALL = All neighbors
+            self._socket.sendto(data, (address, ZombieRouter.__port)) # MULTICAST_LINK_ALL = All neighbors
         except Exception as e: # Socket only throws OSError (µpython implementation specifics), we want to capture everything here
             logging.getLogger("zombierouter").error("Sending data over LoRa network failed even though setup completed! Data will be lost. | Addressed to [{}] | Reason [{}]".format(address, str(e)))
+            _frames_dropped_send_failed.inc()
             return
+        _frames_sent.inc()
+        self._airtime_budget.consume(self._frame_airtime_ms(len(data)), monotonic_ms(), True) # Every transmission counts towards the duty cycle
 
         # Retransmission queue logic
         if add_to_retransmission_cache:
             try:
-                if zombiegram.source_id not in self._package_acks:
-                    self._package_acks[zombiegram.source_id] = ZombieRouter.RetransmissionCache()
                 own_message = bytes_to_int(ZombieRouter.__device_source_id) == zombiegram.source_id
-                self._package_acks[zombiegram.source_id].add_package(zombiegram, own_message)
+                self._retransmission_cache.add_package(zombiegram, own_message, monotonic_ms())
                 logging.getLogger("zombierouter").debug("Zombiegram from [{}] with seq_num [{}] added to the retransmission cache.".format(zombiegram.source_id, zombiegram.seq_num))
                 if own_message and Config.get("device_is_gateway", False):
                     self._handle_gateway_propagation(zombiegram)
             except ZombieRouterInvalidAckCache as e:
                 logging.getLogger("zombierouter").warning("Adding zombiegram from [{}] with seq_num [{}] to retransmission cache failed! | Reason [{}]".format(zombiegram.source_id, zombiegram.seq_num, str(e)))
 
-    def _send_acknowledgement(self, source, seq, to):
-        ack = AcknowledgePayload(source, seq)
-        zg = self._create_zombiegram_with_payloads(1, ack)
-        self._send_zombiegram_to(zg, to, False)
-        logging.getLogger("zombierouter").debug("Acknowledgement for seq_num [{}] sent to [{}]".format(seq, to))
+    def _queue_acknowledgement(self, source, seq, to, priority):
+        """Hold back an acknowledgement so it can be aggregated with others
+
+        :param int source: Source ID of the acknowledged zombiegram
+        :param int seq: seq_num of the acknowledged zombiegram
+        :param str to: Address of the neighbor the zombiegram was received from
+        :param int priority: Priority of the acknowledged zombiegram, urgent ones are acknowledged without delay
+        """
+        now = monotonic_ms()
+        deadline = now if priority >= ZombieRouter.__urgent_priority else now + ZombieRouter.__ack_delay_ms
+        with self._pending_acks_lock:
+            if not any(ack[0] == source and ack[1] == seq for ack in self._pending_acks):
+                self._pending_acks.append((source, seq, to))
+            if len(self._pending_acks) >= MultiAcknowledgePayload.max_entries: # Always fits a single payload
+                deadline = now
+            if self._pending_acks_due is None or deadline < self._pending_acks_due:
+                self._pending_acks_due = deadline
+        self._wakeup.set()
+
+    def _flush_acknowledgements(self):
+        """Send the held back acknowledgements once their delay passed
+
+        A lone acknowledgement is sent to the neighbor it belongs to with the original payload, which every firmware
+        version understands. Several are aggregated into multi acknowledgements sent to all neighbors; neighbors credit
+        an acknowledgement to the acknowledging source, not to the address it was sent to.
+        """
+        with self._pending_acks_lock:
+            if self._pending_acks_due is None or self._pending_acks_due > monotonic_ms():
+                return
+            acknowledgements = self._pending_acks
+            self._pending_acks = []
+            self._pending_acks_due = None
+
+        if len(acknowledgements) == 1:
+            source, seq, to = acknowledgements[0]
+            self._send_zombiegram_to(self._create_zombiegram_with_payloads(1, AcknowledgePayload(source, seq)), to, False)
+            logging.getLogger("zombierouter").debug("Acknowledgement for seq_num [{}] sent to [{}]".format(seq, to))
+            return
+
+        batch = MultiAcknowledgePayload.max_entries # Each pair needs at most one entry
+        for start in range(0, len(acknowledgements), batch):
+            ack = MultiAcknowledgePayload([(source, seq) for source, seq, _ in acknowledgements[start:start + batch]])
+            self._send_zombiegram_to(self._create_zombiegram_with_payloads(1, ack), self._lora_mesh.MULTICAST_LINK_ALL, False)
+        logging.getLogger("zombierouter").debug("[{}] acknowledgements sent to all neighbors".format(len(acknowledgements)))
 
     def forward_zombiegram(self, zombiegram, add_to_retransmission_cache=True):
         """Send a Zombiegram object over the LoRa network to all neighbors
@@ -289,86 +660,377 @@ class ZombieRouter:
     def queue_zombiegram(self, priority, *payloads):
         # zg = self._create_zombiegram_with_payloads(priority, *payloads)
         with self._zombiegram_queue_lock:        
-            self._zombiegram_queue.append((priority, payloads))
+            if self._zombiegram_queue.push(priority, payloads, monotonic_ms()):
+                logging.getLogger("zombierouter").warning("Transmit queue for priority [{}] is full, dropped its oldest zombiegram.".format(priority))
+                _frames_dropped_queue_full.inc()
+        self._wakeup.set()
         logging.getLogger("zombierouter").info("Payloads were queued with a priority of [{}]".format(priority))
 
+    class TransmitQueue:
+        """Multi-level transmit queue with one FIFO lane per Zombiegram priority
+
+        The head of the highest non-empty priority lane is always sent first, so urgent zombiegrams preempt everything
+        that was queued before them. Every lane is bounded; when full, its oldest item is dropped.
+
+        Items that only hold combinable payloads (e.g. detections and diagnostics) are piggybacked: they linger for a
+        short window, after which as many combinable items of the same priority as fit are bin-packed into a single
+        zombiegram. Urgent items never linger.
+        """
+
+        def __init__(self, max_items_per_lane):
+            self._lanes = [[], [], [], []] # low, normal, high and urgent respectively; items are (priority, payloads, size, combinable, queued at)
+            self._max_items_per_lane = max_items_per_lane
+            self.dropped = 0
+            self.frames_saved = 0 # Zombiegrams that were not needed thanks to piggybacking
+
+        def __len__(self):
+            return len(self._lanes[0]) + len(self._lanes[1]) + len(self._lanes[2]) + len(self._lanes[3])
+
+        def push(self, priority, payloads, now):
+            """Queue payloads
+
+            :param int priority: Zombiegram priority, invalid values are queued as normal priority
+            :param tuple payloads: Payload objects
+            :param int now: Current monotonic time in milliseconds
+            :return: True when the lane was full and its oldest item got dropped
+            :rtype: bool
+            """
+            if not isinstance(priority, int) or priority < 0 or priority > 3:
+                priority = 1
+            lane = self._lanes[priority]
+            overflow = len(lane) >= self._max_items_per_lane
+            if overflow:
+                lane.pop(0)
+                self.dropped += 1
+            size = 0
+            combinable = True
+            for payload in payloads:
+                size += 1 + payload.get_size() # Opcode + payload
+                combinable = combinable and payload.can_be_combined
+            lane.append((priority, payloads, size, combinable, now))
+            return overflow
+
+        def next_batch(self, now, linger_ms, capacity):
+            """Select the items that should go out next as a single zombiegram, without removing them
+
+            :param int now: Current monotonic time in milliseconds
+            :param int linger_ms: How long combinable items wait for others to piggyback on
+            :param int capacity: Bytes available for payloads (opcodes included) in one zombiegram
+            :return: tuple (priority, list of items, monotonic ms at which a lingering lane becomes ready or None); priority and items are None when nothing is ready
+            :rtype: tuple
+            """
+            linger_until = None
+            for priority in range(3, -1, -1):
+                lane = self._lanes[priority]
+                if not lane:
+                    continue
+                head = lane[0]
+                if priority == 3 or not head[3]:
+                    return priority, [head], linger_until
+
+                combinable = [item for item in lane if item[3]]
+                if now - head[4] < linger_ms and sum(item[2] for item in combinable) < capacity:
+                    ready_at = head[4] + linger_ms
+                    linger_until = ready_at if linger_until is None else min(linger_until, ready_at)
+                    continue
+
+                # First fit decreasing for a single zombiegram, the oldest item always goes along
+                batch = [head]
+                used = head[2]
+                for item in sorted(combinable[1:], key=lambda x: x[2], reverse=True):
+                    if used + item[2] <= capacity:
+                        batch.append(item)
+                        used += item[2]
+                return priority, batch, linger_until
+            return None, None, linger_until
+
+        def remove(self, priority, items):
+            """Remove items previously selected by :func:`next_batch`"""
+            lane = self._lanes[priority]
+            for item in items:
+                lane.remove(item)
+            self.frames_saved += len(items) - 1
+
+        def drop_lane(self, priority):
+            """Drop every queued item of a priority lane
+
+            :return: Amount of dropped items
+            :rtype: int
+            """
+            count = len(self._lanes[priority])
+            del self._lanes[priority][:]
+            self.dropped += count
+            return count
+
+        def clear(self):
+            for lane in self._lanes:
+                del lane[:]
+
+    class VerifiedFrameCache:
+        """Bounded cache of frame verification outcomes keyed by (source_id, seq_num, hmac)
+
+        The HMAC is part of the key, so a forged frame reusing a trusted (source_id, seq_num) never hits a trusted
+        entry. Beyond max_entries the oldest entry is evicted; a trust key change drops every entry.
+        """
+
+        def __init__(self, max_entries):
+            self._max_entries = max_entries
+            self._outcomes = {} # (source_id, seq_num, hmac) => trusted
+            self._order = [] # Keys, oldest first
+            self._trust_key = None
+            self.hits = 0
+            self.misses = 0
+            self.untrusted = 0
+
+        def verify(self, view, trust_key):
+            """Verify a received frame once; later copies of the same frame are answered from the cache
+
+            :param ZombiegramView view: Received frame
+            :param trust_key: Device trust key
+            :return: Whether the frame is signed with the trust key
+            :rtype: bool
+            """
+            if trust_key != self._trust_key:
+                self._outcomes = {}
+                self._order = []
+                self._trust_key = trust_key
+
+            key = (view.source_id, view.seq_num, view.hmac)
+            trusted = self._outcomes.get(key)
+            if trusted is None:
+                self.misses += 1
+                started = ticks_us()
+                trusted = view.is_payload_trusted(trust_key)
+                _hmac_verify_us.observe(elapsed_us(started))
+                if len(self._order) >= self._max_entries:
+                    self._outcomes.pop(self._order.pop(0), None)
+                self._outcomes[key] = trusted
+                self._order.append(key)
+            else:
+                self.hits += 1
+                view.remember_trust(trust_key, trusted) # Spares the gateway serialization a recomputation
+            if not trusted:
+                self.untrusted += 1
+            return trusted
+
     class RetransmissionCache:
-        """Keep a cache of sent or forwarded zombiegrams
+        """Keep a cache of sent or forwarded zombiegrams and schedule their retransmissions
         This class manages their respective unique acknowledgement counts
 
-        :note: This cache is specific to a device (i.e. source_id); keeping a global cache will result in ZombieRouterInvalidAckCache exceptions due to cache collisions
+        Entries are indexed by (source_id, seq_num), so acknowledgements and removals are O(1). Retransmissions are kept
+        in a heap ordered by (next due time, priority, attempt count). Every entry backs off exponentially starting
+        from a priority dependent delay (sub-second for urgent zombiegrams) and is given up after a maximum amount of
+        attempts.
+
+        When and after how many attempts a package is done is decided by the policy (see AdaptiveRetransmissionPolicy),
+        without policy fixed fractions of the neighbor count are used.
+
+        :note: One cache is shared by all sources; keys include the source_id so sequence numbers of different devices never collide
         """
-        
+
         __own_message_propagation_value = 0.5
         __neighbor_message_propagation_value = 0.3
         __priority_propagation_values = [0.7, 0.8, 0.9, 1] # low, normal, high and urgent respectively
+        __priority_base_backoff_ms = [8000, 4000, 2000, 500] # low, normal, high and urgent respectively
+        __max_backoff_ms = 60000
+        __max_attempts = 6
 
         def __init__(self):
-            # seq_num => [received ack count, [list of acked destionation ids], Zombiegram, own message (bool)]
+            # (source_id, seq_num) => [received ack count, {acked destination id: transmissions until its ack}, Zombiegram, own message (bool), attempts, due time (ms), first transmission (ms)]
             self._cache = {}
+            # Heap of (due time (ms), -priority, attempts, source_id, seq_num); entries that no longer match the cache are skipped
+            self._schedule = []
+            self._neighbor_count = None # Neighbor count of the last pop_due(), used to complete packages on ack arrival
+            self.completion_listener = None # Called with the acked destination ids, acknowledgeable transmissions and source_id of every package that leaves the cache
+            self.policy = None # Decides thresholds and attempt budgets, the static constants are used when None
+            self.delivered = 0 # Packages removed because they reached their threshold
+            self.exhausted = 0 # Packages removed because they used up their attempts
 
         def retransmission_count(self):
             return len(self._cache)
 
-        def add_package(self, send_zombiegram, own_message):
+        def _treshold(self, data, current_neighbor_count):
+            own_message_treshold = (current_neighbor_count * ZombieRouter.RetransmissionCache.__own_message_propagation_value) # Value without priority
+            neighbor_message_treshold = (current_neighbor_count * ZombieRouter.RetransmissionCache.__neighbor_message_propagation_value) if current_neighbor_count > 1 else 0 # Value without priority
+            return (own_message_treshold if data[3] else neighbor_message_treshold) * ZombieRouter.RetransmissionCache.__priority_propagation_values[data[2].priority]
+
+        def _is_delivered(self, data, current_neighbor_count):
+            if self.policy:
+                return self.policy.is_delivered(data[2], data[1], data[3], current_neighbor_count)
+            return data[0] >= self._treshold(data, current_neighbor_count)
+
+        def _max_attempts(self, data):
+            if self.policy:
+                return self.policy.max_attempts(data[2], data[1], data[3])
+            return ZombieRouter.RetransmissionCache.__max_attempts
+
+        def _complete(self, key, delivered, transmissions):
+            data = self._cache.pop(key, None)
+            if data:
+                if delivered:
+                    self.delivered += 1
+                else:
+                    self.exhausted += 1
+                if self.completion_listener:
+                    self.completion_listener(data[1], transmissions, data[2].source_id)
+
+        def _schedule_entry(self, key, data, due):
+            data[5] = due
+            heapq.heappush(self._schedule, (due, -data[2].priority, data[4], key[0], key[1]))
+
+        def add_package(self, send_zombiegram, own_message, now):
             """Add a zombiegram to the retransmission cache
             
             :param send_zombiegram: Sent out zombiegram
-            :type send_zombiegram: zombiegram   
-            :raises ZombieRouterInvalidAckCache: When the seq_num is already known to the system (i.e. we have a collision)
+            :type send_zombiegram: zombiegram
+            :param bool own_message: Whether the zombiegram originates from this device
+            :param int now: Current monotonic time in milliseconds
+            :raises ZombieRouterInvalidAckCache: When the (source_id, seq_num) is already known to the system (i.e. we have a collision)
             """
-            if send_zombiegram.seq_num in self._cache:
+            key = (send_zombiegram.source_id, send_zombiegram.seq_num)
+            if key in self._cache:
                 raise ZombieRouterInvalidAckCache("Cache item with seq_num [{}] causes a collision. Are items not being removed? Did we send 255 LoRa messages in short time?".format(send_zombiegram.seq_num))
-            self._cache[send_zombiegram.seq_num] = [0, [], send_zombiegram, own_message]
+            data = [0, {}, send_zombiegram, own_message, 0, 0, now]
+            self._cache[key] = data
+            self._schedule_entry(key, data, now + ZombieRouter.RetransmissionCache.__priority_base_backoff_ms[send_zombiegram.priority])
 
-        def add_ack_from(self, source_id, seq_num):
+        def add_ack_from(self, ack_source_id, source_id, seq_num):
             """Indicate an acknowledgement happened from a certain source
             
-            :param int source_id: Source ID as converted by the Zombiegram class
+            :param int ack_source_id: Source ID of the acknowledging device, as converted by the Zombiegram class
+            :param int source_id: Source ID of the acknowledged zombiegram
             :param int seq_num: seq_num that was acknowledged
-            :raises ZombieRouterInvalidAckCache: When the cache has no notion of the given seq_num (i.e. no add_package() happened explicitly before)
+            :raises ZombieRouterInvalidAckCache: When the cache has no notion of the given zombiegram (i.e. no add_package() happened explicitly before)
             """
-            if not self._cache.get(seq_num):
-                raise ZombieRouterInvalidAckCache("Cache item with seq_num [{}] does not exist.".format(seq_num))
-            if source_id not in self._cache[seq_num][1]:
-                self._cache[seq_num][1].append(source_id)
-                self._cache[seq_num][0] += 1
-
-        def get_ack_count(self, seq_num):
-            """Retrieve the ack count of a certain seq_num
+            key = (source_id, seq_num)
+            data = self._cache.get(key)
+            if not data:
+                raise ZombieRouterInvalidAckCache("Cache item with source_id [{}] and seq_num [{}] does not exist.".format(source_id, seq_num))
+            if ack_source_id not in data[1]:
+                data[1][ack_source_id] = data[4] + 1
+                data[0] += 1
+                _ack_latency_ms.observe(monotonic_ms() - data[6])
+                if self._neighbor_count and self._is_delivered(data, self._neighbor_count):
+                    self._complete(key, True, data[4]) # Acks to the latest transmission may still be underway; its heap entry is dropped lazily
+
+        def add_acks_from(self, ack_source_id, acknowledgements):
+            """Indicate several acknowledgements happened from a certain source (see MultiAcknowledgePayload)
+
+            :param int ack_source_id: Source ID of the acknowledging device, as converted by the Zombiegram class
+            :param acknowledgements: Iterable of acknowledged (source_id, seq_num) pairs
+            :return: Amount of acknowledgements that matched a cached zombiegram, others are ignored
+            :rtype: int
+            """
+            matched = 0
+            for source_id, seq_num in acknowledgements:
+                try:
+                    self.add_ack_from(ack_source_id, source_id, seq_num)
+                    matched += 1
+                except ZombieRouterInvalidAckCache:
+                    pass # Enough acks were already received and the zombiegram got removed
+            return matched
+
+        def get_ack_count(self, source_id, seq_num):
+            """Retrieve the ack count of a certain zombiegram
             
+            :param int source_id: source_id we want the count of
             :param int seq_num: seq_num we want the count of
-            :raises ZombieRouterInvalidAckCache: When the seq_num is not known to the cache
+            :raises ZombieRouterInvalidAckCache: When the zombiegram is not known to the cache
             :return: Ack count
             :rtype: int
             """
-            if not self._cache.get(seq_num):
-                raise ZombieRouterInvalidAckCache("Cache item with seq_num [{}] does not exist.".format(seq_num))
-            return self._cache[seq_num][0]
+            data = self._cache.get((source_id, seq_num))
+            if not data:
+                raise ZombieRouterInvalidAckCache("Cache item with source_id [{}] and seq_num [{}] does not exist.".format(source_id, seq_num))
+            return data[0]
 
-        def remove_completed_packages(self, current_neighbor_count):
-            """Remove all packages from the cache that hit or exceed the calculated treshold
-            
+        def get_state(self):
+            """Retrieve the pending packages as a list of (raw frame, own message, attempts, acked destination ids)"""
+            return [(data[2].get_bytestring_representation(), data[3], data[4], list(data[1])) for data in list(self._cache.values())]
+
+        def set_state(self, state, now):
+            """Add packages previously retrieved with :func:`get_state`, their retransmission is due after the usual backoff
+
+            :param state: Iterable of (raw frame, own message, attempts, acked destination ids)
+            :param int now: Current monotonic time in milliseconds
+            :return: Amount of packages added, packages whose (source_id, seq_num) is already cached are skipped
+            :rtype: int
+            """
+            added = 0
+            for frame, own_message, attempts, acked_ids in state:
+                zombiegram = ZombiegramView(frame).to_zombiegram()
+                key = (zombiegram.source_id, zombiegram.seq_num)
+                if key in self._cache:
+                    continue
+                data = [len(acked_ids), {acked_id: attempts for acked_id in acked_ids}, zombiegram, own_message, attempts, 0, now]
+                self._cache[key] = data
+                backoff = ZombieRouter.RetransmissionCache.__priority_base_backoff_ms[zombiegram.priority] << attempts
+                self._schedule_entry(key, data, now + min(backoff, ZombieRouter.RetransmissionCache.__max_backoff_ms))
+                added += 1
+            return added
+
+        def _pop_stale(self):
+            while self._schedule:
+                due, _, attempts, source_id, seq_num = self._schedule[0]
+                data = self._cache.get((source_id, seq_num))
+                if data and data[5] == due and data[4] == attempts:
+                    return
+                heapq.heappop(self._schedule)
+
+        def next_due(self):
+            """Retrieve when the next retransmission is due
+
+            :return: Monotonic time in milliseconds or None when nothing is scheduled
+            """
+            self._pop_stale()
+            return self._schedule[0][0] if self._schedule else None
+
+        def pop_due(self, now, current_neighbor_count, limit, min_priority=0, defer_ms=0):
+            """Retrieve the zombiegrams whose retransmission is due and reschedule them with backoff
+
+            Packages that are delivered according to the policy are removed, as are packages that used up their attempts.
+
+            :param int now: Current monotonic time in milliseconds
             :param int current_neighbor_count: Current neighbor count, setting this value to 0 wipes the cache
-            :return: List of all packages that do not meet the given treshold
-            :rtype: list
+            :param int limit: Maximum amount of zombiegrams returned, remaining due packages stay due
+            :param int min_priority: Due packages with a lower priority are not returned but deferred
+            :param int defer_ms: Delay for deferred packages
+            :return: tuple (list of due zombiegrams sorted by priority, amount of removed packages)
+            :rtype: tuple
             """
+            self._neighbor_count = current_neighbor_count
             if current_neighbor_count == 0:
                 wipes = len(self._cache)
                 self._cache = {}
+                self._schedule = []
                 return [], wipes
 
-            own_message_treshold = (current_neighbor_count * ZombieRouter.RetransmissionCache.__own_message_propagation_value) # Value without priority
-            neighbor_message_treshold = (current_neighbor_count * ZombieRouter.RetransmissionCache.__neighbor_message_propagation_value) if current_neighbor_count > 1 else 0 # Value without priority
-
-            retry_zombiegrams = []
+            due_entries = []
             wipes = 0
-            for seq_num, data in self._cache.items():
-                treshold = (own_message_treshold if data[3] else neighbor_message_treshold) * ZombieRouter.RetransmissionCache.__priority_propagation_values[data[2].priority]
-                if data[0] >= treshold:
-                    self._cache.pop(seq_num, None) # Key should exist, silently ignore it with "None" if it doesn't for some reason
+            self._pop_stale()
+            while self._schedule and self._schedule[0][0] <= now:
+                due, _, attempts, source_id, seq_num = heapq.heappop(self._schedule)
+                key = (source_id, seq_num)
+                data = self._cache.get(key)
+                if not data or data[5] != due or data[4] != attempts:
+                    continue # Stale heap entry
+                delivered = self._is_delivered(data, current_neighbor_count)
+                if delivered or data[4] >= self._max_attempts(data):
+                    self._complete(key, delivered, data[4] + 1)
                     wipes += 1
-                else:
+                    continue
+                due_entries.append((key, data))
+
+            due_entries.sort(key=lambda x: (-x[1][2].priority, x[1][4])) # Highest priority first, fewest attempts first
+            retry_zombiegrams = []
+            for key, data in due_entries:
+                if data[2].priority < min_priority:
+                    self._schedule_entry(key, data, now + defer_ms) # Deferred, does not count as an attempt
+                elif len(retry_zombiegrams) < limit:
+                    data[4] += 1
+                    backoff = ZombieRouter.RetransmissionCache.__priority_base_backoff_ms[data[2].priority] << data[4]
+                    self._schedule_entry(key, data, now + min(backoff, ZombieRouter.RetransmissionCache.__max_backoff_ms))
                     retry_zombiegrams.append(data[2])
+                else:
+                    self._schedule_entry(key, data, now) # Burst limit reached, stays due
             return retry_zombiegrams, wipes
- 
\ No newline at end of file
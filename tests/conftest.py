@@ -0,0 +1,36 @@
+"""Host side test setup (CPython)
+
+The repository modules are imported by bare name as on the device. The Pycom specific modules are replaced by the
+stand-ins of the mesh simulator (benchmarks/meshsim.py), except for the clock which keeps running in real time.
+"""
+
+import os
+import sys
+import types
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(os.path.join(ROOT, "benchmarks"))
+
+import meshsim  # Appends network_core, servers and utilities to sys.path
+import clock
+
+meshsim.install_stand_ins(types.SimpleNamespace(monotonic_ms=clock.monotonic_ms))
+
+
+@pytest.fixture
+def mesh():
+    """Factory of simulated meshes (see benchmarks/meshsim.py), e.g. mesh("--nodes", "3", "--topology", "line")
+
+    The simulator runs in virtual time; the real clock is restored afterwards.
+    """
+    monotonic_ms = clock.monotonic_ms
+
+    def build(*argv):
+        network = meshsim.Network(meshsim.parse_args(list(argv)))
+        network.build()
+        return network
+
+    yield build
+    clock.monotonic_ms = monotonic_ms
@@ -0,0 +1,39 @@
+import pytest
+
+import metrics
+
+
+def test_render_groups_labelled_registrations():
+    first = metrics.counter("test_frames_total", "Frames", {"reason": "a"})
+    metrics.gauge("test_depth", "Depth").set(3)
+    second = metrics.counter("test_frames_total", "Frames", {"reason": "b"})
+    first.inc()
+    second.inc(2)
+    text = metrics.render()
+    lines = [line for line in text.split("\n") if "test_frames_total" in line]
+    assert lines == ["# HELP test_frames_total Frames", "# TYPE test_frames_total counter",
+                     'test_frames_total{reason="a"} 1', 'test_frames_total{reason="b"} 2']
+    assert "test_depth 3" in text
+    assert metrics.counter("test_frames_total", labels={"reason": "a"}) is first
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.histogram("test_latency_ms", (10, 100), "Latency")
+    for value in (5, 50, 500):
+        histogram.observe(value)
+    text = metrics.render()
+    assert 'test_latency_ms_bucket{le="10"} 1' in text
+    assert 'test_latency_ms_bucket{le="100"} 2' in text
+    assert 'test_latency_ms_bucket{le="+Inf"} 3' in text
+    assert "test_latency_ms_sum 555" in text and "test_latency_ms_count 3" in text
+
+
+def test_kind_conflict():
+    metrics.gauge("test_conflict")
+    with pytest.raises(ValueError):
+        metrics.counter("test_conflict")
+
+
+def test_base_metric_has_no_samples():
+    with pytest.raises(metrics.MethodNotImplementedException):
+        metrics._Metric("test_base", "", None).samples()
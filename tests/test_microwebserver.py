@@ -0,0 +1,191 @@
+import gzip
+import http.client
+import socket
+import threading
+import time
+
+import pytest
+
+from microWebServer import MicroWebSrv
+
+
+def hello(client, response):
+    response.WriteResponseOk(contentType="text/plain", content="hello")
+
+
+def echo(client, response):
+    response.WriteResponseOk(contentType="text/plain", content=client.ReadRequestContent())
+
+
+def big(client, response):
+    response.WriteResponseOk(contentType="application/octet-stream", content=b"x" * (8 * 1024 * 1024))
+
+
+def stream(client, response):
+    response.WriteResponseStream(("line {}\n".format(index) for index in range(3)), "text/plain")
+
+
+ROUTES = [("/hello", "GET", hello), ("/echo", "POST", echo), ("/big", "GET", big), ("/stream", "GET", stream)]
+
+
+BIG = bytes(range(256)) * 400
+SCRIPT = b"console.log('zombie');\n" * 300
+
+
+@pytest.fixture
+def www(tmp_path):
+    (tmp_path / "big.png").write_bytes(BIG)
+    (tmp_path / "app.js").write_bytes(SCRIPT)
+    (tmp_path / "app.js.gz").write_bytes(gzip.compress(SCRIPT))
+    (tmp_path / "css").mkdir()
+    (tmp_path / "css" / "only.css.gz").write_bytes(gzip.compress(b"body { color: red; }"))
+    return tmp_path
+
+
+@pytest.fixture
+def server(www):
+    tmp_path = www
+    srv = MicroWebSrv(routeHandlers=ROUTES, port=0, bindIP="127.0.0.1", webPath=str(tmp_path))
+    thread = threading.Thread(target=srv.Start, daemon=True)  # Start(threaded=True) needs the µpython _thread
+    thread.start()
+    while not srv.IsStarted():
+        time.sleep(0.01)
+    srv.port = srv._server.getsockname()[1]
+    srv.webPath = tmp_path
+    yield srv
+    srv.Stop()
+    thread.join(5)
+
+
+def connect(server):
+    return http.client.HTTPConnection("127.0.0.1", server.port, timeout=5)
+
+
+def raw_request(server, data):
+    s = socket.create_connection(("127.0.0.1", server.port), timeout=5)
+    s.sendall(data)
+    received = b""
+    while True:
+        try:
+            chunk = s.recv(65536)
+        except ConnectionResetError:  # The server may close with part of an oversized request unread
+            break
+        if not chunk:
+            break
+        received += chunk
+    s.close()
+    return received
+
+
+def test_keep_alive(server):
+    connection = connect(server)
+    for path in ("/hello", "/stream", "/hello"):
+        connection.request("GET", path)
+        response = connection.getresponse()
+        body = response.read()
+        assert response.status == 200 and response.getheader("Connection") == "keep-alive"
+    assert body == b"hello"
+    assert len(server._clients) == 1
+    connection.request("POST", "/echo", body=b"abc")
+    assert connection.getresponse().read() == b"abc"
+
+
+def test_streams_are_chunked_on_persistent_connections(server):
+    connection = connect(server)
+    connection.request("GET", "/stream")
+    response = connection.getresponse()
+    assert response.getheader("Transfer-Encoding") == "chunked"
+    assert response.read() == b"line 0\nline 1\nline 2\n"
+
+
+def test_pipelined_requests(server):
+    received = raw_request(server, b"GET /hello HTTP/1.1\r\nHost: x\r\n\r\n"
+                                   b"POST /echo HTTP/1.1\r\nContent-Length: 5\r\n\r\nworld"
+                                   b"GET /hello HTTP/1.1\r\nConnection: close\r\n\r\n")
+    assert received.count(b"HTTP/1.1 200 OK") == 3
+    assert received.index(b"hello") < received.index(b"world") < received.rindex(b"hello")
+
+
+def test_http_1_0_closes(server):
+    received = raw_request(server, b"GET /hello HTTP/1.0\r\n\r\n")
+    assert b"Connection: close" in received and received.endswith(b"hello")
+
+
+def test_unsupported_request_framing(server):
+    assert raw_request(server, b"POST /echo HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n").startswith(b"HTTP/1.1 411")
+    assert raw_request(server, b"GET /hello HTTP/1.1\r\nX: " + b"y" * 2100 + b"\r\n\r\n").startswith(b"HTTP/1.1 431")
+
+
+def test_slow_client_does_not_stall_others(server):
+    slow = socket.socket()
+    slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    slow.connect(("127.0.0.1", server.port))
+    slow.sendall(b"GET /big HTTP/1.1\r\n\r\n")  # Never reads its response
+    time.sleep(0.2)
+
+    started = time.time()
+    connection = connect(server)
+    connection.request("GET", "/hello")
+    assert connection.getresponse().read() == b"hello"
+    assert time.time() - started < 1
+
+    received = 0  # The big response is still delivered in full once the client reads
+    slow.settimeout(5)
+    while received < 8 * 1024 * 1024:
+        chunk = slow.recv(1 << 20)
+        assert chunk
+        received += len(chunk)
+    slow.close()
+
+
+def get(connection, path, **headers):
+    connection.request("GET", path, headers=headers)
+    response = connection.getresponse()
+    return response, response.read()
+
+
+def test_static_file_and_etag(server):
+    connection = connect(server)
+    response, body = get(connection, "/big.png")
+    etag = response.getheader("ETag")
+    assert response.status == 200 and body == BIG and etag
+    assert response.getheader("Accept-Ranges") == "bytes"
+
+    response, body = get(connection, "/big.png", **{"If-None-Match": etag})
+    assert response.status == 304 and body == b""
+    assert response.getheader("ETag") == etag
+    assert response.getheader("Content-Length") is None and response.getheader("Content-Type") is None
+
+    response, body = get(connection, "/big.png", **{"If-None-Match": '"other"'})
+    assert response.status == 200 and body == BIG
+
+
+def test_static_file_ranges(server):
+    connection = connect(server)
+    etag = get(connection, "/big.png")[0].getheader("ETag")
+    for range_, expected, content_range in (("bytes=10-19", BIG[10:20], "bytes 10-19/102400"),
+                                            ("bytes=-5", BIG[-5:], "bytes 102395-102399/102400"),
+                                            ("bytes=102390-", BIG[102390:], "bytes 102390-102399/102400")):
+        response, body = get(connection, "/big.png", Range=range_)
+        assert response.status == 206 and body == expected
+        assert response.getheader("Content-Range") == content_range
+
+    response, body = get(connection, "/big.png", Range="bytes=200000-")
+    assert response.status == 416 and response.getheader("Content-Range") == "bytes */102400"
+    assert get(connection, "/big.png", Range="bytes=0-9", **{"If-Range": '"old"'})[1] == BIG
+    assert get(connection, "/big.png", Range="bytes=0-9", **{"If-Range": etag})[1] == BIG[:10]
+
+
+def test_static_gzip_siblings(server):
+    connection = connect(server)
+    response, body = get(connection, "/app.js")
+    assert body == SCRIPT and response.getheader("Content-Encoding") is None
+    assert response.getheader("Vary") == "Accept-Encoding"
+
+    response, body = get(connection, "/app.js", **{"Accept-Encoding": "gzip, deflate"})
+    assert response.getheader("Content-Encoding") == "gzip" and gzip.decompress(body) == SCRIPT
+
+    response, body = get(connection, "/css/only.css", **{"Accept-Encoding": "gzip"})
+    assert response.status == 200 and response.getheader("Content-Type") == "text/css"
+    assert get(connection, "/css/only.css")[0].status == 406
+    assert get(connection, "/../etc/passwd")[0].status == 404
@@ -0,0 +1,98 @@
+import meshsim
+from neighbortable import NeighborTable
+
+MAC_A = 0x70B3D50000000001
+MAC_B = 0x70B3D50000000002
+SOURCE_A = 0x0AC4A1B2  # machine.unique_id() is the WiFi MAC, unrelated to the mesh MAC
+SOURCE_B = 0x0AC4C3D4
+
+
+def records(*neighbors):
+    return [meshsim.NeighborRecord((mac, 3, rloc16, rssi, 0)) for mac, rloc16, rssi in neighbors]
+
+
+def link_local(mac):
+    interface_id = mac ^ (1 << 57)
+    return "fe80::{:x}:{:x}:{:x}:{:x}".format(interface_id >> 48, (interface_id >> 32) & 0xFFFF, (interface_id >> 16) & 0xFFFF, interface_id & 0xFFFF)
+
+
+def test_neighbors_are_listed_by_mac_until_their_source_id_is_known():
+    table = NeighborTable()
+    table.update(records((MAC_A, 0x0400, -80), (MAC_B, 0x0401, -90)))
+    assert set(table) == {MAC_A, MAC_B}
+    assert SOURCE_A not in table
+
+
+def test_source_id_learned_from_rloc_address():
+    table = NeighborTable()
+    table.update(records((MAC_A, 0x0400, -80), (MAC_B, 0x0401, -90)))
+    assert table.learn_source_id("fdde:ad00:beef:0:0:ff:fe00:401", SOURCE_B)
+    assert set(table) == {MAC_A, SOURCE_B}
+    assert table.get(SOURCE_B)["mac"] == MAC_B
+    table.update(records((MAC_A, 0x0400, -80), (MAC_B, 0x0401, -90)))  # Stays mapped on refresh
+    assert set(table) == {MAC_A, SOURCE_B}
+
+
+def test_source_id_learned_from_link_local_address():
+    table = NeighborTable()
+    table.update(records((MAC_A, 0x0400, -80)))
+    assert table.learn_source_id(link_local(MAC_A), SOURCE_A)
+    assert set(table) == {SOURCE_A}
+
+
+def test_unresolvable_addresses_are_ignored():
+    table = NeighborTable()
+    table.update(records((MAC_A, 0x0400, -80)))
+    assert not table.learn_source_id("fdde:ad00:beef:0:1234:5678:9abc:def0", SOURCE_A)  # Mesh-local EID
+    assert not table.learn_source_id("fdde:ad00:beef:0:0:ff:fe00:999", SOURCE_A)  # Not a neighbor
+    assert not table.learn_source_id("not an address", SOURCE_A)
+    assert set(table) == {MAC_A}
+
+
+def test_acknowledgements_credit_the_mapped_neighbor():
+    table = NeighborTable()
+    table.update(records((MAC_A, 0x0400, -80), (MAC_B, 0x0401, -90)))
+    table.learn_source_id("fdde:ad00:beef:0:0:ff:fe00:400", SOURCE_A)
+    table.learn_source_id("fdde:ad00:beef:0:0:ff:fe00:401", SOURCE_B)
+    for _ in range(10):
+        table.record_acknowledgements({SOURCE_A: 1}, 1)
+    assert table.ack_probability(SOURCE_A) > 0.9
+    assert table.ack_probability(SOURCE_B) < 0.1
+    assert table.best() == [SOURCE_A, SOURCE_B]
+
+
+def test_mapping_is_forgotten_with_the_neighbor():
+    table = NeighborTable()
+    table.update(records((MAC_A, 0x0400, -80)))
+    table.learn_source_id("fdde:ad00:beef:0:0:ff:fe00:400", SOURCE_A)
+    table.update(records())
+    assert len(table) == 0
+    table.update(records((MAC_A, 0x0400, -80)))
+    assert set(table) == {MAC_A}
+
+
+def test_mesh_neighbors_are_keyed_by_source_id(mesh):
+    network = mesh("--nodes", "4", "--topology", "line", "--loss", "0", "--rate", "6")
+    network.generate_traffic()
+    network.sim.run(60000)
+    for node in network.nodes:
+        expected = {neighbor.source_id for neighbor, link in node.links}
+        assert set(node.router._neighbors) == expected
+        assert all(neighbor.source_id != neighbor.mac & 0xFFFFFFFF for neighbor, link in node.links)
+        if len(node.links) == 2:  # Acks of lossless links are credited to the neighbor that sent them
+            assert all(node.router._neighbors.ack_probability(source_id) > 0.9 for source_id in expected)
+
+
+def test_iteration_survives_learned_source_ids():
+    # The retransmission policy iterates on the processor thread while acknowledgements re-key entries
+    table = NeighborTable()
+    table.update(records((MAC_A, 0x0400, -80), (MAC_B, 0x0401, -90)))
+    visited = []
+    for neighbor_id in table:
+        visited.append(neighbor_id)
+        table.learn_source_id("fdde:ad00:beef:0:0:ff:fe00:400", SOURCE_A)
+        table.learn_source_id("fdde:ad00:beef:0:0:ff:fe00:401", SOURCE_B)
+    assert visited == [MAC_A, MAC_B]
+    assert set(table) == {SOURCE_A, SOURCE_B}
+    assert table.active_count() == 2 and table.quality(SOURCE_A) > table.quality(SOURCE_B)
+    assert table.best() == [SOURCE_A, SOURCE_B]
@@ -0,0 +1,100 @@
+import pytest
+
+from replaywindow import ReplayWindow, ReplayWindowTable
+
+
+def test_new_window_accepts_anything():
+    window = ReplayWindow(30)
+    assert 0 not in window and 255 not in window
+
+
+def test_duplicates_within_window():
+    window = ReplayWindow(30)
+    for seq_num in (10, 12, 11):
+        window.add(seq_num)
+    assert 10 in window and 11 in window and 12 in window
+    assert 9 not in window  # Behind but never seen
+    assert 13 not in window
+
+
+def test_wraparound():
+    window = ReplayWindow(30)
+    for seq_num in (250, 253, 255, 0, 2):
+        window.add(seq_num)
+    assert all(seq_num in window for seq_num in (250, 253, 255, 0, 2))
+    assert 254 not in window and 1 not in window and 3 not in window
+    assert window.get_state()[0] == 2
+
+
+def test_far_ahead_clears_the_bitmap():
+    window = ReplayWindow(30)
+    window.add(10)
+    window.add(10 + 100)
+    assert window.get_state() == (110, 1)
+    assert 10 not in window
+
+
+def test_late_retransmission_keeps_the_window():
+    window = ReplayWindow(30)
+    for seq_num in range(95, 101):
+        window.add(seq_num)
+    assert 60 not in window
+    window.add(60)
+    assert window.get_state()[0] == 100
+    assert 60 in window
+    assert all(seq_num in window for seq_num in range(95, 101))
+
+
+def test_old_frames_after_a_burst_are_rejected():
+    window = ReplayWindow(30)
+    for seq_num in range(70, 101):
+        window.add(seq_num)
+    for seq_num in (40, 20, 55, 40, 5):  # Scattered late retransmissions never form a run
+        window.add(seq_num)
+    assert window.get_state()[0] == 100
+    assert all(seq_num in window for seq_num in range(71, 101))
+
+
+@pytest.mark.parametrize("behind", [32, 38, 98, 127])
+def test_far_behind_run_is_a_restarted_sequence(behind):
+    # A rebooted source picks a random sequence number, which may land behind the window of its previous boot
+    window = ReplayWindow(30)
+    for seq_num in range(200, 231):
+        window.add(seq_num)
+    restarted = [(230 - behind + offset) % 256 for offset in range(3)]
+    window.add(restarted[0])
+    window.add(restarted[0])
+    assert restarted[0] in window and restarted[1] not in window
+    window.add(restarted[1])
+    assert window.get_state()[0] == 230
+    window.add(restarted[2])
+    assert window.get_state()[0] == restarted[2]
+    assert all(seq_num in window for seq_num in restarted)
+    next_seq_num = (restarted[2] + 1) % 256
+    assert next_seq_num not in window
+
+
+def test_state_round_trip():
+    window = ReplayWindow(30)
+    for seq_num in (1, 3, 4):
+        window.add(seq_num)
+    restored = ReplayWindow(30)
+    restored.set_state(*window.get_state())
+    assert [seq_num in restored for seq_num in range(6)] == [seq_num in window for seq_num in range(6)]
+
+
+def test_invalid_size():
+    with pytest.raises(ValueError):
+        ReplayWindow(0)
+    with pytest.raises(ValueError):
+        ReplayWindow(129)
+
+
+def test_table_evicts_least_recently_used_source():
+    table = ReplayWindowTable(max_sources=2, window_size=30)
+    table.add(1, 10)
+    table.add(2, 10)
+    assert table.is_replay(1, 10)  # Touches source 1
+    table.add(3, 10)
+    assert 2 not in table and 1 in table and 3 in table
+    assert not table.is_replay(2, 10)
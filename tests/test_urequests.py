@@ -0,0 +1,238 @@
+import socket
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import urequests
+
+
+class MicroSocket:
+    """usocket.socket stand-in: µpython sockets offer the stream methods write, readline and read themselves"""
+
+    def __init__(self, family, kind, proto):
+        self._socket = socket.socket(family, kind, proto)
+        self._file = None
+
+    def settimeout(self, timeout):
+        self._socket.settimeout(timeout)
+
+    def connect(self, address):
+        self._socket.connect(address)
+        self._file = self._socket.makefile("rb")
+
+    def write(self, data):
+        self._socket.sendall(data)
+        return len(data)
+
+    def readline(self):
+        return self._file.readline()
+
+    def read(self, size):
+        return self._file.read1(size)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+        self._socket.close()
+
+
+@pytest.fixture(autouse=True)
+def micro_sockets(monkeypatch):
+    monkeypatch.setattr(urequests, "usocket", types.SimpleNamespace(AF_INET=socket.AF_INET, SOCK_STREAM=socket.SOCK_STREAM,
+                                                                     socket=MicroSocket))
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self):
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            body = b""
+            while True:
+                size = int(self.rfile.readline(), 16)
+                chunk = self.rfile.read(size + 2)[:size]
+                if not size:
+                    return body
+                body += chunk
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _reply(self, status, body=b"", headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/moved":
+            self._reply(302, headers=[("Location", "/target")])
+        elif self.path == "/peer":
+            self._reply(200, str(self.client_address[1]).encode())
+        elif self.path == "/chunked":
+            self.send_response(200)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for chunk in (b"zombie", b"-", b"gram" * 100):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self._reply(200, self.command.encode() + b" " + self.path.encode())
+
+    def do_POST(self):
+        body = self._body()
+        if self.path == "/temporary":
+            self._reply(307, headers=[("Location", "/target")])
+        elif self.path == "/see-other":
+            self._reply(303, headers=[("Location", "/target")])
+        else:
+            self._reply(200, b"POST " + self.path.encode() + b" " + body)
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def test_follows_redirects(base_url):
+    session = urequests.Session()
+    assert session.request("GET", base_url + "/moved").content == b"GET /target"
+    assert session.request("POST", base_url + "/temporary", data=b"abc").content == b"POST /target abc"
+    assert session.request("POST", base_url + "/see-other", data=b"abc").content == b"GET /target"
+
+
+def test_redirect_of_streamed_body_is_returned(base_url):
+    session = urequests.Session()
+    response = session.request("POST", base_url + "/temporary", data=iter([b"a", b"bc"]))
+    assert response.status_code == 307
+    assert response.headers["location"] == "/target"
+    response.close()
+    # A 303 drops the body, so it is followed even for streamed bodies
+    assert session.request("POST", base_url + "/see-other", data=iter([b"a"])).content == b"GET /target"
+
+
+def test_redirects_can_be_disabled(base_url):
+    response = urequests.Session().request("GET", base_url + "/moved", allow_redirects=False)
+    assert response.status_code == 302
+    response.close()
+
+
+def test_keep_alive_reuses_the_connection(base_url):
+    session = urequests.Session()
+    port = session.request("GET", base_url + "/peer").content
+    assert session.request("GET", base_url + "/peer").content == port
+    assert session.request("POST", base_url + "/echo", data=b"abc").content == b"POST /echo abc"
+    assert session.request("GET", base_url + "/peer").content == port
+
+
+def test_chunked_response(base_url):
+    session = urequests.Session()
+    port = session.request("GET", base_url + "/peer").content
+    assert session.request("GET", base_url + "/chunked").content == b"zombie-" + b"gram" * 100
+    assert session.request("GET", base_url + "/peer").content == port  # The chunked body ended cleanly
+
+
+class ScriptedServer:
+    """Raw HTTP server answering the first request on every connection and then acting out `after_first`"""
+
+    def __init__(self, after_first):
+        self.after_first = after_first
+        self.requests = []
+        self.connections = 0
+        self._server = socket.create_server(("127.0.0.1", 0))
+        self.url = "http://127.0.0.1:{}".format(self._server.getsockname()[1])
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                connection, _ = self._server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            with connection:
+                if self._handle(connection):
+                    self.after_first(self, connection)
+                self.reader.close()  # The socket only closes once its file is closed as well
+
+    def _handle(self, connection):
+        reader = self.reader = connection.makefile("rb")
+        head = reader.readline()
+        if not head:
+            return False
+        length = 0
+        while True:
+            line = reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            if line.lower().startswith(b"content-length:"):
+                length = int(line.split(b":")[1])
+        self.requests.append(head.split()[1] + b" " + reader.read(length))
+        return True
+
+    def reply(self, connection):
+        connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+
+    def close(self):
+        self._server.close()
+
+
+@pytest.fixture
+def scripted():
+    servers = []
+
+    def start(after_first):
+        servers.append(ScriptedServer(lambda server, connection: (server.reply(connection), after_first(server, connection))))
+        return servers[-1]
+    yield start
+    for server in servers:
+        server.close()
+
+
+def test_retries_when_the_idle_connection_was_closed(scripted):
+    server = scripted(lambda server, connection: None)  # Closes every connection after the first response
+    session = urequests.Session()
+    assert session.request("POST", server.url + "/a", data=b"1").content == b"ok"
+    time.sleep(0.05)
+    assert session.request("POST", server.url + "/b", data=b"2").content == b"ok"
+    assert server.connections == 2 and server.requests[-1] == b"/b 2"
+
+
+def test_retries_when_no_status_line_arrives(scripted):
+    def read_and_close(server, connection):
+        server._handle(connection)  # Takes the request but closes without answering, like an idle timeout would
+
+    server = scripted(read_and_close)
+    session = urequests.Session()
+    assert session.request("POST", server.url + "/a", data=b"1").content == b"ok"
+    assert session.request("POST", server.url + "/b", data=b"2").content == b"ok"
+    assert server.requests == [b"/a 1", b"/b 2", b"/b 2"]
+    assert server.connections == 2
+
+
+def test_never_retries_a_timeout(scripted):
+    def read_and_stall(server, connection):
+        server._handle(connection)
+        time.sleep(0.5)
+
+    server = scripted(read_and_stall)
+    session = urequests.Session(timeout=0.2)
+    assert session.request("POST", server.url + "/a", data=b"1").content == b"ok"
+    started = time.time()
+    with pytest.raises(OSError):
+        session.request("POST", server.url + "/slow", data=b"2")
+    assert time.time() - started < 0.4
+    assert server.requests == [b"/a 1", b"/slow 2"]
+    time.sleep(0.4)
+    assert server.connections == 1
@@ -0,0 +1,102 @@
+import random
+
+import pytest
+
+import usms
+
+ALPHABET = [chr(i) for i in range(ord("a"), ord("z") + 1)]
+ALPHABET += [chr(i) for i in range(ord("0"), ord("9") + 1)]
+ALPHABET += list(",?;.:/\\()[]!&|@#\'\"%*-_+=<> ")
+
+# The per-character codec the table driven one replaced, copied verbatim as the reference
+_usms_chars = [None] + ALPHABET
+
+
+def reference_bytes_to_ascii(bytestring):
+    pattern = [(2, 3), (4, 15), (6, 63)]  # (bits to shift, rest bit pattern)
+    pattern_index = 0
+    ascii_output = []
+    rest_bits = 0
+    for byte in bytestring:
+        six_bit_int_rep = (byte >> pattern[pattern_index][0]) | (rest_bits << (8 - pattern[pattern_index][0]))
+        rest_bits = byte & pattern[pattern_index][1]
+
+        if six_bit_int_rep not in range(0, len(_usms_chars)):
+            raise usms.UsmsCharacterOutOfRange("Unknown character index [{}]".format(str(six_bit_int_rep)))
+
+        if _usms_chars[six_bit_int_rep] is not None:
+            ascii_output.append(_usms_chars[six_bit_int_rep])
+
+        if pattern_index == 2 and _usms_chars[rest_bits] is not None:
+            if rest_bits not in range(0, len(_usms_chars)):
+                raise usms.UsmsCharacterOutOfRange("Unknown character index [{}]".format(str(rest_bits)))
+            ascii_output.append(_usms_chars[rest_bits])
+
+        pattern_index = (pattern_index + 1) % 3
+    return "".join(ascii_output)
+
+
+def reference_ascii_to_bytes(asciistring):
+    byte_output = []
+    pattern = [(2, 3, 4), (4, 15, 2), (6, 0, 0)]  # (bits to shift, rest bit pattern)
+    pattern_index = 0
+    for i in range(0, len(asciistring)):
+        int_rep = _usms_chars.index(asciistring[i]) << pattern[pattern_index][0] & 255
+        if pattern_index < 2:
+            next_int_rest = ((_usms_chars.index(asciistring[i + 1]) >> pattern[pattern_index][2]) if (i + 1) < len(asciistring) else 0) & pattern[pattern_index][1]
+            int_rep |= next_int_rest
+        else:
+            i += 1
+        byte_output.append(int_rep)
+
+        pattern_index = (pattern_index + 1) % 3
+    return bytes(byte_output)
+
+
+def random_messages(count, seed=1337):
+    rng = random.Random(seed)
+    return ["".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 70))) for _ in range(count)]
+
+
+def decode_or_none(decode, bytestring):
+    try:
+        return decode(bytestring)
+    except usms.UsmsCharacterOutOfRange:
+        return None
+
+
+def test_random_messages_match_the_reference():
+    for text in random_messages(2000):
+        encoded = usms.ascii_to_bytes(text)
+        assert encoded == reference_ascii_to_bytes(text), text
+        assert usms.bytes_to_ascii(encoded) == reference_bytes_to_ascii(encoded) == text, text
+
+
+def test_random_garbage_matches_the_reference():
+    # Arbitrary bytes have to be rejected or decoded alike
+    rng = random.Random(42)
+    for _ in range(5000):
+        garbage = bytes(rng.getrandbits(8) for _ in range(rng.randint(0, 20)))
+        assert decode_or_none(usms.bytes_to_ascii, garbage) == decode_or_none(reference_bytes_to_ascii, garbage), garbage
+
+
+@pytest.mark.parametrize("offset", [0, 1, 5])
+def test_encode_into_and_decode_into_at_an_offset(offset):
+    for text in random_messages(200, seed=offset):
+        encoded = bytearray(b"\xaa" * (offset + usms.encoded_size(text) + 2))
+        assert usms.encode_into(text, encoded, offset) == len(text)
+        assert bytes(encoded[offset:offset + len(text)]) == reference_ascii_to_bytes(text)
+        assert encoded[:offset] == b"\xaa" * offset and encoded[offset + len(text):] == b"\xaa\xaa"
+
+        source = bytes(encoded[offset:offset + len(text)])
+        decoded = bytearray(b"\xaa" * (offset + usms.decoded_size(source) + 2))
+        length = usms.decode_into(source, decoded, offset)
+        assert bytes(decoded[offset:offset + length]).decode() == reference_bytes_to_ascii(source)
+        assert decoded[:offset] == b"\xaa" * offset and decoded[offset + length:].strip(b"\xaa") == b""
+
+
+def test_characters_outside_the_alphabet():
+    with pytest.raises(usms.UsmsCharacterOutOfRange):
+        usms.ascii_to_bytes("Zombies")
+    with pytest.raises(usms.UsmsCharacterOutOfRange):
+        usms.encode_into("café", bytearray(8))
@@ -0,0 +1,92 @@
+import pytest
+
+from zombiegram import (AcknowledgePayload, DetectionPayload, DiagnosticPayload, MalformedZombiegram,
+                        MultiAcknowledgePayload, NetworkChange, UsmsPayload, Zombiegram, ZombiegramPayloadOverflow,
+                        ZombiegramRecord, ZombiegramView)
+
+TRUST_KEY = b"test-key"
+
+PAYLOADS = [
+    [AcknowledgePayload(0x0A0B0C0D, 12)],
+    [MultiAcknowledgePayload([(0x0A0B0C0D, 12), (0x01020304, 255)])],
+    [NetworkChange(trust_key=TRUST_KEY)],
+    [DetectionPayload(80, 3), DetectionPayload(5, 250)],
+    [UsmsPayload("zombies spotted near the north gate")],
+    [DiagnosticPayload((50.93, 5.33), [0x11111111, 0x22222222], 87, 1, True, True, False, 4)],
+]
+
+
+def build(payloads, seq_num=42, priority=2):
+    zg = Zombiegram(source_id=0x01020304, seq_num=seq_num, priority_flag=priority, tampered_flag=True)
+    for payload in payloads:
+        zg.add_payload(payload)
+    zg.sign_package(TRUST_KEY)
+    return zg
+
+
+@pytest.mark.parametrize("payloads", PAYLOADS)
+def test_round_trip(payloads):
+    frame = build(payloads).get_bytestring_representation()
+    decoded = Zombiegram.from_package(frame)
+    assert decoded.get_bytestring_representation() == frame
+    assert (decoded.source_id, decoded.seq_num, decoded.priority, decoded.tampered_flag) == (0x01020304, 42, 2, True)
+    for payload, expected in zip(decoded.get_payloads(), payloads):
+        fields = payload.serialize_to_dict()
+        expected_fields = expected.serialize_to_dict()
+        if "gps_coordinates" in fields:  # Stored as 32 bit floats
+            assert fields.pop("gps_coordinates") == pytest.approx(expected_fields.pop("gps_coordinates"))
+        assert fields == expected_fields
+    assert decoded.is_payload_trusted(TRUST_KEY)
+    assert not decoded.is_payload_trusted(b"other-key")
+
+
+def test_payload_overflow_counts_opcodes():
+    zg = Zombiegram(source_id=0x01020304, seq_num=1)
+    fitting = (Zombiegram.get_max_package_size() - 10) // 3  # Header of 10 bytes, 2 byte payloads plus their opcode
+    for index in range(fitting):
+        zg.add_payload(DetectionPayload(index, 1))
+    with pytest.raises(ZombiegramPayloadOverflow):
+        zg.add_payload(DetectionPayload(fitting, 1))
+    zg.sign_package(TRUST_KEY)
+    frame = zg.get_bytestring_representation()
+    assert len(frame) <= Zombiegram.get_max_package_size()
+    assert len(Zombiegram.from_package(frame).get_payloads()) == fitting
+
+
+@pytest.mark.parametrize("payloads", PAYLOADS)
+def test_pack_into_matches_object_encoding(payloads):
+    zg = build(payloads)
+    buffer = bytearray(Zombiegram.get_max_package_size())
+    length = zg.pack_into(buffer, 0)
+    assert bytes(buffer[:length]) == zg.get_bytestring_representation()
+
+
+def test_view_decodes_header_only_until_asked():
+    frame = build([DetectionPayload(80, 3)]).get_bytestring_representation()
+    view = ZombiegramView(frame)
+    assert (view.source_id, view.seq_num, view.priority) == (0x01020304, 42, 2)
+    assert view.get_bytestring_representation() == frame
+    assert view.is_payload_trusted(TRUST_KEY)
+    assert view.to_zombiegram().get_bytestring_representation() == frame
+
+
+def test_record_is_reusable():
+    record = ZombiegramRecord()
+    first = build([DetectionPayload(80, 3)], seq_num=1).get_bytestring_representation()
+    second = build([UsmsPayload("hi")], seq_num=2).get_bytestring_representation()
+    assert record.decode(first).payload_fields(0) == (80, 3)
+    record.decode(second)
+    assert (record.seq_num, record.payload_count, record.payload_class(0)) == (2, 1, UsmsPayload)
+
+
+@pytest.mark.parametrize("frame", [
+    b"\x00" * 10,  # Header only
+    b"\x00" * 10 + b"\xff",  # Unknown opcode
+    b"\x00" * 10 + bytes([1]) + b"\x00",  # Truncated payload
+    b"\x00" * 10 + bytes([1]) * 300,  # Longer than a Zombiegram can be
+])
+def test_malformed_frames(frame):
+    with pytest.raises(MalformedZombiegram):
+        ZombiegramRecord().decode(frame)
+    with pytest.raises(MalformedZombiegram):
+        Zombiegram.from_package(frame)
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from gatewayUplink import GatewayUplink
+from volatileconfiguration import VolatileConfiguration
+from zombiegram import DetectionPayload, Zombiegram, ZombiegramView
+
+
+class Response:
+    status_code = 200
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def posted(monkeypatch):
+    """Records posted to the configured gateway webhook"""
+    monkeypatch.setattr(VolatileConfiguration, "_configuration", {})
+    VolatileConfiguration.set("gateway_webhook_1", "http://gateway.test/hook", False)
+    VolatileConfiguration.set("device_trust_key", "meshsim", False)
+    return []
+
+
+def gateway_uplink(network, posted):
+    """Replace the simulator's stand-in on the gateway node by a GatewayUplink posting into `posted`"""
+    def post(url, data=None, headers=None):
+        assert url == "http://gateway.test/hook"
+        posted.extend(json.loads(data))
+        return Response()
+
+    uplink = GatewayUplink(post=post, is_online=lambda: True)
+    next(node for node in network.nodes if node.gateway).router._gateway_uplink = uplink
+    return uplink
+
+
+def deliver(uplink):
+    """Do what the worker thread would: post the queued frames in batches"""
+    for hook in uplink._hooks.values():
+        while hook.queue:
+            batch, hook.queue = hook.queue[:8], hook.queue[8:]
+            assert uplink._deliver(hook, batch)
+
+
+def test_zombiegrams_reach_the_webhook(mesh, posted):
+    network = mesh("--nodes", "3", "--topology", "line", "--loss", "0", "--rate", "6")
+    uplink = gateway_uplink(network, posted)
+    network.generate_traffic()
+    network.sim.run(30000)
+    deliver(uplink)
+
+    # Received frames of both other nodes as well as the gateway's own zombiegrams
+    assert {record["source_id"] for record in posted} == {node.source_id for node in network.nodes}
+    assert all(record["trusted"] for record in posted)
+    assert uplink.dropped == 0
+
+
+def test_gateway_propagation_queues_the_frame(mesh, posted):
+    network = mesh("--nodes", "2", "--topology", "line")
+    uplink = gateway_uplink(network, posted)
+    router = next(node for node in network.nodes if node.gateway).router
+
+    zombiegram = Zombiegram(source_id=0x01020304, seq_num=7, priority_flag=1)
+    zombiegram.add_payload(DetectionPayload(80, 3))
+    zombiegram.sign_package(b"meshsim")
+    router._handle_gateway_propagation(zombiegram)  # Own zombiegram
+    router._handle_gateway_propagation(ZombiegramView(zombiegram.get_bytestring_representation()))  # Received frame
+
+    assert uplink._hooks[0].queue == [(zombiegram.get_bytestring_representation(), True)] * 2
+
+
+@pytest.mark.parametrize("trust_key", ["meshsim", ""])
+def test_verifying_nodes_keep_routing(mesh, trust_key):
+    # Without a trust key, e.g. after a NetworkChange cleared it, frames can not be verified and are accepted
+    network = mesh("--nodes", "3", "--topology", "line", "--loss", "0", "--rate", "6", "--verify", "--trust-key", trust_key)
+    network.generate_traffic()
+    network.sim.run(30000)
+    assert network.metrics.report()["delivery_ratio"] == 1
@@ -0,0 +1,43 @@
+import time
+from _thread import allocate_lock
+
+try:
+    _ticks_ms = time.ticks_ms
+    _ticks_us = time.ticks_us
+    _ticks_diff = time.ticks_diff
+except AttributeError: # CPython (host side tooling)
+    _ticks_ms = lambda: int(time.monotonic() * 1000)
+    _ticks_us = lambda: int(time.monotonic() * 1000000)
+    _ticks_diff = lambda new, old: new - old
+
+_lock = allocate_lock()
+_last_ticks = _ticks_ms()
+_elapsed_ms = 0
+
+
+def monotonic_ms():
+    """Milliseconds since boot that never wrap around
+
+    time.ticks_ms() wraps after roughly 12 days on the ESP32, which breaks ordering deadlines in heaps and dicts.
+    This accumulates tick differences into an ever increasing value instead. Must be called at least once per wrap
+    period (any router tick does).
+
+    :return: Monotonic time in milliseconds
+    :rtype: int
+    """
+    global _last_ticks, _elapsed_ms
+    with _lock:
+        now = _ticks_ms()
+        _elapsed_ms += _ticks_diff(now, _last_ticks)
+        _last_ticks = now
+        return _elapsed_ms
+
+
+def ticks_us():
+    """Wrapping microsecond tick counter for measuring short durations, see :func:`elapsed_us`"""
+    return _ticks_us()
+
+
+def elapsed_us(start):
+    """Microseconds since a value returned by :func:`ticks_us`, valid for durations up to a few minutes"""
+    return _ticks_diff(_ticks_us(), start)
@@ -0,0 +1,130 @@
+import struct
+from _thread import allocate_lock
+
+
+class DiagnosticsLog:
+    """Fixed-size ring buffer of periodic diagnostic samples in a single file
+
+    The file holds a header followed by `capacity` slots of equally sized packed samples. It is allocated in full when
+    created, so every sample is written in place and the file never grows; once all slots are used the oldest sample is
+    overwritten.
+
+        header: magic (4s) | sample size (H) | capacity (H) | samples written in total (I)
+        sample: see sample_format and sample_fields
+
+    Sample times are RTC seconds. They are only ordered as long as the RTC is not set backwards, so range queries
+    filter every sample instead of stopping at the first one out of range.
+    """
+
+    __magic = b"ZDL\x01"
+    __header_format = "!4sHHI"
+    __header_size = 12
+    __block_samples = 16 # Samples read from the file at once by query()
+
+    sample_format = "!IffBBBBBIBIBIBI"
+    sample_size = 36
+    sample_fields = ("time", "latitude", "longitude", "battery", "roles", "mesh_state", "neighbors", "retransmissions",
+                     "neighbor_1", "quality_1", "neighbor_2", "quality_2", "neighbor_3", "quality_3", "mem_free")
+
+    # Bits of the roles field
+    ROLE_SENSOR = 0x01
+    ROLE_ROUTER = 0x02
+    ROLE_GATEWAY = 0x04
+    FLAG_TAMPERED = 0x08
+    FLAG_MAINTENANCE = 0x10
+
+    def __init__(self, filename, capacity=1024):
+        """Constructor, reopens the log of a previous boot or creates a new one
+
+        :param str filename: File backing the ring buffer
+        :param int capacity: Samples kept, a log with another capacity is started over
+        :raises OSError: When the file can not be created
+        """
+        self._filename = filename
+        self._capacity = capacity
+        self._written = 0
+        self._lock = allocate_lock()
+        self._sample = bytearray(DiagnosticsLog.sample_size) # Reused by every append
+        self._open()
+
+    def _open(self):
+        try:
+            with open(self._filename, "rb") as f:
+                header = f.read(DiagnosticsLog.__header_size)
+            if len(header) == DiagnosticsLog.__header_size:
+                magic, size, capacity, written = struct.unpack(DiagnosticsLog.__header_format, header)
+                if magic == DiagnosticsLog.__magic and size == DiagnosticsLog.sample_size and capacity == self._capacity:
+                    self._written = written
+                    return
+        except OSError:
+            pass # Not created yet
+
+        block = bytes(DiagnosticsLog.sample_size * DiagnosticsLog.__block_samples)
+        with open(self._filename, "wb") as f:
+            f.write(struct.pack(DiagnosticsLog.__header_format, DiagnosticsLog.__magic, DiagnosticsLog.sample_size, self._capacity, 0))
+            remaining = self._capacity * DiagnosticsLog.sample_size
+            while remaining > 0:
+                f.write(block if remaining >= len(block) else block[:remaining])
+                remaining -= len(block)
+        self._written = 0
+
+    def __len__(self):
+        """Retrieve the amount of samples currently held"""
+        return min(self._written, self._capacity)
+
+    def append(self, sample):
+        """Store a sample, overwriting the oldest one when the log is full
+
+        :param sample: Values in the order of sample_fields
+        """
+        with self._lock:
+            struct.pack_into(DiagnosticsLog.sample_format, self._sample, 0, *sample)
+            with open(self._filename, "r+b") as f:
+                f.seek(DiagnosticsLog.__header_size + (self._written % self._capacity) * DiagnosticsLog.sample_size)
+                f.write(self._sample)
+                f.seek(0)
+                f.write(struct.pack(DiagnosticsLog.__header_format, DiagnosticsLog.__magic, DiagnosticsLog.sample_size, self._capacity, self._written + 1))
+            self._written += 1
+
+    def query(self, start=None, end=None, interval=None, limit=None):
+        """Iterate over the stored samples, oldest first
+
+        The file is read a few samples at a time, so iterating does not hold the log (or much memory) for long. Samples
+        appended while iterating are not returned; samples overwritten while iterating are skipped.
+
+        :param int start: Only samples taken at or after this RTC time, defaults to None
+        :param int end: Only samples taken at or before this RTC time, defaults to None
+        :param int interval: Downsample to the first sample of every interval of this many seconds, defaults to None
+        :param int limit: Samples returned at most, defaults to None
+        :return: Generator of sample tuples in the order of sample_fields
+        """
+        size = DiagnosticsLog.sample_size
+        block = bytearray(size * DiagnosticsLog.__block_samples)
+        with self._lock:
+            written = self._written
+        sequence = max(0, written - self._capacity)
+        bucket = None
+        returned = 0
+        while sequence < written:
+            with self._lock:
+                sequence = max(sequence, self._written - self._capacity) # Skip what got overwritten meanwhile
+                slot = sequence % self._capacity
+                count = min(DiagnosticsLog.__block_samples, self._capacity - slot, written - sequence)
+                if count <= 0:
+                    return
+                with open(self._filename, "rb") as f:
+                    f.seek(DiagnosticsLog.__header_size + slot * size)
+                    f.readinto(memoryview(block)[:count * size])
+            for index in range(count):
+                sample = struct.unpack_from(DiagnosticsLog.sample_format, block, index * size)
+                if (start is not None and sample[0] < start) or (end is not None and sample[0] > end):
+                    continue
+                if interval:
+                    if sample[0] // interval == bucket:
+                        continue
+                    bucket = sample[0] // interval
+                yield sample
+                returned += 1
+                if limit is not None and returned >= limit:
+                    return
+            sequence += count
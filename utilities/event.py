@@ -0,0 +1,55 @@
+import time
+from _thread import allocate_lock
+
+
+class Event:
+    """Auto-resetting wake-up event for threads
+
+    µpython's _thread module has no Condition; this builds a wakeable wait on top of a plain lock. The lock is held
+    while the event is clear, set() releases it and a waiting thread reacquires it (clearing the event again).
+    Locks can be released from any thread, so any thread can wake the waiter.
+    """
+
+    __poll_interval = 0.02 # Seconds, only used on ports whose lock.acquire() does not support timeouts
+
+    def __init__(self):
+        self._lock = allocate_lock()
+        self._lock.acquire()
+        self._timeout_supported = True
+
+    def set(self):
+        """Wake up the waiting thread; setting an already set event has no additional effect"""
+        try:
+            self._lock.release()
+        except RuntimeError: # Already set
+            pass
+
+    def is_set(self):
+        if self._lock.acquire(0):
+            self._lock.release()
+            return True
+        return False
+
+    def wait(self, timeout):
+        """Block until the event is set or the timeout expires, whichever comes first. Clears the event.
+
+        :param timeout: Maximal time to wait in seconds
+        :return: True when woken up by set(), False on timeout
+        :rtype: bool
+        """
+        if timeout <= 0:
+            return self._lock.acquire(0)
+
+        if self._timeout_supported:
+            try:
+                return self._lock.acquire(1, timeout)
+            except (TypeError, ValueError): # No timeout support on this port
+                self._timeout_supported = False
+
+        remaining = timeout
+        while remaining > 0:
+            if self._lock.acquire(0):
+                return True
+            time.sleep(Event.__poll_interval)
+            remaining -= Event.__poll_interval
+        return self._lock.acquire(0)
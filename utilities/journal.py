@@ -0,0 +1,208 @@
+import struct
+import sdhandler
+
+
+class Journal:
+    """Append-only journal of length prefixed records on the SD card
+
+    Records are appended to fixed-size segment files `<name>_<segment>.seg`, a new segment is started once the current
+    one is full. Every record is stored as length (H) | tag (B) | data; the tag is free for the user (e.g. a bitmask of
+    the consumers that still need the record).
+
+    Appends are buffered in RAM and written in blocks, so the SD card sees a few large writes instead of one per record.
+    Records still in the buffer are lost on a power failure; call :func:`flush` where that matters.
+
+    Every reader (consumer) keeps a checkpoint, the position after the last record it processed. Segments behind the
+    checkpoints of every registered reader are removed. When the journal grows beyond its maximum amount of segments,
+    the oldest segment is dropped and the readers still in it skip ahead. The segment range and checkpoints are kept in
+    `<name>.ckpt`.
+
+    :note: Not thread safe, callers serialize access
+    """
+
+    __record_header = "!HB"
+    __record_header_size = 3
+
+    def __init__(self, name, segment_size=32768, max_segments=32, block_size=512):
+        """Constructor, reopens the journal of a previous boot when there is one
+
+        :param str name: Journal name, used as file prefix in the device directory on the SD card
+        :param int segment_size: Bytes per segment file
+        :param int max_segments: Segments kept at most, the oldest one is dropped beyond this
+        :param int block_size: Buffered bytes that trigger a write to the SD card
+        :raises SdNotMounted: When the SD card is not mounted
+        """
+        self._name = name
+        self._segment_size = segment_size
+        self._max_segments = max_segments
+        self._block_size = block_size
+        self._buffer = bytearray()
+        self._first = 0 # Oldest segment kept
+        self._last = 0 # Segment appended to
+        self._last_size = 0 # Bytes of the last segment on the SD card
+        self._checkpoints = {} # reader => (segment, offset)
+        self.dropped = 0 # Records lost to the segment limit
+        self._load_meta()
+
+    def _segment_filename(self, segment):
+        return "{}_{:06d}.seg".format(self._name, segment)
+
+    def _load_meta(self):
+        try:
+            with sdhandler.FileHandler(self._name + ".ckpt", "r") as f:
+                lines = f.read().split("\n")
+            self._first, self._last = [int(value) for value in lines[0].split()]
+            for line in lines[1:]:
+                fields = line.split()
+                if len(fields) == 3:
+                    self._checkpoints[fields[0]] = (int(fields[1]), int(fields[2]))
+        except (OSError, ValueError, IndexError):
+            self._first, self._last = 0, 0 # Nothing usable, start over
+            self._checkpoints = {}
+            sdhandler.remove_file(self._segment_filename(0))
+            self._save_meta()
+        self._last_size = sdhandler.file_size(self._segment_filename(self._last))
+
+    def _save_meta(self):
+        with sdhandler.FileHandler(self._name + ".ckpt", "w") as f:
+            f.write("{} {}\n".format(self._first, self._last))
+            for reader, position in self._checkpoints.items():
+                f.write("{} {} {}\n".format(reader, position[0], position[1]))
+
+    def __len__(self):
+        """Retrieve the amount of segments in use"""
+        return self._last - self._first + 1
+
+    def end(self):
+        """Retrieve the position after the last appended record (including buffered ones)"""
+        return self._last, self._last_size + len(self._buffer)
+
+    def append(self, data, tag=0):
+        """Append a record, it reaches the SD card with the next block write
+
+        :param bytes data: Record of at most 65535 bytes
+        :param int tag: Record tag in range [0,255]
+        """
+        if self._last_size + len(self._buffer) + Journal.__record_header_size + len(data) > self._segment_size and self._last_size + len(self._buffer) > 0:
+            self._rotate()
+        self._buffer += struct.pack(Journal.__record_header, len(data), tag)
+        self._buffer += data
+        if len(self._buffer) >= self._block_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered records to the current segment"""
+        if not self._buffer:
+            return
+        with sdhandler.FileHandler(self._segment_filename(self._last), "ab") as f:
+            f.write(self._buffer)
+        self._last_size += len(self._buffer)
+        self._buffer = bytearray()
+
+    def _rotate(self):
+        self.flush()
+        self._last += 1
+        self._last_size = 0
+        sdhandler.remove_file(self._segment_filename(self._last)) # Leftover of a journal that was started over
+        while len(self) > self._max_segments:
+            self._drop_first()
+        self._save_meta()
+
+    def _drop_first(self):
+        try:
+            with sdhandler.FileHandler(self._segment_filename(self._first), "rb") as f:
+                self.dropped += len(self._scan(f.read(), 0, None, None)[0])
+        except OSError:
+            pass
+        sdhandler.remove_file(self._segment_filename(self._first))
+        self._first += 1
+        for reader, position in self._checkpoints.items():
+            if position[0] < self._first:
+                self._checkpoints[reader] = (self._first, 0)
+
+    @staticmethod
+    def _scan(data, offset, max_records, tag_mask):
+        """Decode records from a segment's bytes
+
+        :return: tuple (list of (tag, data), offset after the last scanned record)
+        """
+        records = []
+        while offset + Journal.__record_header_size <= len(data) and (max_records is None or len(records) < max_records):
+            length, tag = struct.unpack_from(Journal.__record_header, data, offset)
+            end = offset + Journal.__record_header_size + length
+            if end > len(data):
+                break # Torn write, the rest of the segment is unusable
+            if tag_mask is None or tag & tag_mask:
+                records.append((tag, bytes(data[offset + Journal.__record_header_size:end])))
+            offset = end
+        return records, offset
+
+    def add_reader(self, reader):
+        """Register a reader, from then on segments are only removed once it processed them
+
+        A new reader starts at the oldest record in the journal.
+        """
+        if reader not in self._checkpoints:
+            self._checkpoints[reader] = (self._first, 0)
+            self._save_meta()
+
+    def checkpoint(self, reader):
+        """Retrieve the position of a reader, the start of the journal when it has none"""
+        position = self._checkpoints.get(reader)
+        if position is None or position[0] < self._first:
+            return self._first, 0
+        return position
+
+    def pending(self, reader):
+        """Whether there are records after the checkpoint of a reader (records of any tag)"""
+        return self.checkpoint(reader) < self.end()
+
+    def read(self, reader, max_records, tag_mask=None):
+        """Read records after the checkpoint of a reader, the checkpoint itself is left as is
+
+        :param str reader: Reader name
+        :param int max_records: Records returned at most
+        :param int tag_mask: Only records whose tag shares a bit with the mask are returned, all of them when None
+        :return: tuple (list of (tag, data), position to pass to :func:`set_checkpoint` once they are processed)
+        """
+        self.flush()
+        segment, offset = self.checkpoint(reader)
+        records = []
+        while len(records) < max_records and segment <= self._last:
+            try:
+                with sdhandler.FileHandler(self._segment_filename(segment), "rb") as f:
+                    f.seek(offset)
+                    data = f.read()
+            except OSError:
+                data = b""
+            found, scanned = Journal._scan(data, 0, max_records - len(records), tag_mask)
+            records += found
+            offset += scanned
+            if scanned < len(data) and len(records) < max_records:
+                offset += len(data) - scanned # Skip a torn record
+            if len(records) >= max_records or segment == self._last:
+                break
+            segment, offset = segment + 1, 0
+        return records, (segment, offset)
+
+    def set_checkpoint(self, reader, position):
+        """Store the position up to which a reader processed the journal and remove the segments nobody needs anymore
+
+        :param str reader: Reader name
+        :param tuple position: Position as returned by :func:`read`
+        """
+        self._checkpoints[reader] = position
+        self._compact()
+        self._save_meta()
+
+    def remove_reader(self, reader):
+        """Forget a reader, so it no longer holds back the removal of segments"""
+        if self._checkpoints.pop(reader, None) is not None:
+            self._compact()
+            self._save_meta()
+
+    def _compact(self):
+        oldest = min([position[0] for position in self._checkpoints.values()] + [self._last])
+        while self._first < oldest:
+            sdhandler.remove_file(self._segment_filename(self._first))
+            self._first += 1
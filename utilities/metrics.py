@@ -0,0 +1,206 @@
+import gc
+
+# Metrics of this device, in registration order. Metrics are registered once (usually at import time) and live as long
+# as the firmware runs; see render() for the exposition format.
+_metrics = []
+_by_key = {} # (name, label text) => metric
+
+
+class MethodNotImplementedException(Exception):
+    pass
+
+
+class _Metric:
+    """Common part of every metric: name, help line and a constant set of labels
+
+    Labels are fixed when the metric is registered, a metric with other label values is a separate registration under
+    the same name. Updates never look anything up and only do small integer arithmetic, so they do not allocate (values
+    and sums have to stay below 2^30, beyond that MicroPython switches to heap allocated long integers).
+
+    :note: Updates are not locked; a lost increment under contention is accepted in exchange for a free hot path
+    """
+
+    kind = None
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = _format_labels(labels)
+
+    def samples(self):
+        """Retrieve the samples of this metric as a list of (name suffix, label text, value)"""
+        raise MethodNotImplementedException()
+
+
+class Counter(_Metric):
+    """Monotonically increasing count (e.g. received frames), Prometheus names these `<name>_total`"""
+
+    kind = "counter"
+
+    def __init__(self, name, help="", labels=None):
+        _Metric.__init__(self, name, help, labels)
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        return [("", self.labels, self.value)]
+
+
+class Gauge(_Metric):
+    """Value that goes up and down (e.g. queue depth)
+
+    A gauge given a function reports the return value of that function, evaluated when the metrics are rendered. Use
+    this for values that are expensive to keep up to date or that are owned by someone else (e.g. free memory).
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help="", labels=None, function=None):
+        _Metric.__init__(self, name, help, labels)
+        self.value = 0
+        self._function = function
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def samples(self):
+        return [("", self.labels, self._function() if self._function else self.value)]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed buckets (e.g. latencies)
+
+    Bucket counts are kept per bucket and made cumulative when rendered, so an observation increments a single slot.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, bounds, help="", labels=None):
+        """Constructor
+
+        :param str name: Metric name
+        :param tuple bounds: Ascending (integer) upper bounds of the buckets, the +Inf bucket is added implicitly
+        :param str help: Help line
+        :param dict labels: Constant labels, defaults to None
+        """
+        _Metric.__init__(self, name, help, labels)
+        self._bounds = tuple(bounds)
+        self._counts = [0] * (len(self._bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        bounds = self._bounds
+        index = 0
+        last = len(bounds)
+        while index < last and value > bounds[index]:
+            index += 1
+        self._counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        separator = "," if self.labels else ""
+        samples = []
+        cumulative = 0
+        for index, bound in enumerate(self._bounds):
+            cumulative += self._counts[index]
+            samples.append(("_bucket", '{}{}le="{}"'.format(self.labels, separator, bound), cumulative))
+        samples.append(("_bucket", '{}{}le="+Inf"'.format(self.labels, separator), cumulative + self._counts[-1]))
+        samples.append(("_sum", self.labels, self.sum))
+        samples.append(("_count", self.labels, self.count))
+        return samples
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return ",".join('{}="{}"'.format(key, labels[key]) for key in sorted(labels))
+
+
+def _register(metric):
+    key = (metric.name, metric.labels)
+    existing = _by_key.get(key)
+    if existing:
+        if existing.kind != metric.kind:
+            raise ValueError("Metric [{}] is already registered as a {}.".format(metric.name, existing.kind))
+        return existing
+    _by_key[key] = metric
+    _metrics.append(metric)
+    return metric
+
+
+def counter(name, help="", labels=None):
+    """Retrieve the counter registered under a name and labels, it is created on first use
+
+    :param str name: Metric name, ending in `_total` by convention
+    :param str help: Help line
+    :param dict labels: Constant labels, defaults to None
+    :raises ValueError: When a metric of another type is registered under the same name and labels
+    :rtype: Counter
+    """
+    return _register(Counter(name, help, labels))
+
+
+def gauge(name, help="", labels=None, function=None):
+    """Retrieve the gauge registered under a name and labels, it is created on first use
+
+    :param str name: Metric name
+    :param str help: Help line
+    :param dict labels: Constant labels, defaults to None
+    :param function: Function returning the current value, evaluated on render, defaults to None
+    :raises ValueError: When a metric of another type is registered under the same name and labels
+    :rtype: Gauge
+    """
+    return _register(Gauge(name, help, labels, function))
+
+
+def histogram(name, bounds, help="", labels=None):
+    """Retrieve the histogram registered under a name and labels, it is created on first use
+
+    :param str name: Metric name
+    :param tuple bounds: Ascending upper bounds of the buckets
+    :param str help: Help line
+    :param dict labels: Constant labels, defaults to None
+    :raises ValueError: When a metric of another type is registered under the same name and labels
+    :rtype: Histogram
+    """
+    return _register(Histogram(name, bounds, help, labels))
+
+
+def render():
+    """Render every registered metric in the Prometheus text exposition format (version 0.0.4)
+
+    :rtype: str
+    """
+    lines = []
+    names = []
+    for metric in _metrics:
+        if metric.name not in names:
+            names.append(metric.name)
+    for name in names: # Samples of a name have to be grouped, labelled registrations may be interleaved
+        family = [metric for metric in _metrics if metric.name == name]
+        lines.append("# HELP {} {}".format(name, family[0].help))
+        lines.append("# TYPE {} {}".format(name, family[0].kind))
+        for metric in family:
+            for suffix, labels, value in metric.samples():
+                if labels:
+                    lines.append("{}{}{{{}}} {}".format(name, suffix, labels, value))
+                else:
+                    lines.append("{}{} {}".format(name, suffix, value))
+    lines.append("")
+    return "\n".join(lines)
+
+
+# Memory is the first thing to run out on the device
+if hasattr(gc, "mem_free"):
+    gauge("gc_free_bytes", "Free heap memory", function=gc.mem_free)
+    gauge("gc_allocated_bytes", "Allocated heap memory", function=gc.mem_alloc)
@@ -0,0 +1,198 @@
+from _thread import allocate_lock
+
+
+class NeighborTable:
+    """Link quality per mesh neighbor, maintained incrementally from the mesh neighbor records
+
+    Every refresh folds the neighbor's RSSI and age (seconds since it was last heard) into exponentially weighted moving
+    averages. The ack probability is the chance a single transmission gets acknowledged by the neighbor, estimated
+    from every completed retransmission cache entry: acknowledged after n transmissions counts as one success in n
+    trials, not acknowledged as no success in every transmission whose acknowledgements had time to arrive. Successes
+    and trials are both moving averages, their ratio is the estimate. Neighbors that disappear from the mesh records are dropped.
+
+    The quality score weights the normalised RSSI, the ack probability and the freshness of the neighbor, see
+    :func:`quality`.
+
+    Neighbors are identified by their zombiegram source_id, which is not derived from the mesh MAC (the source_id comes
+    from machine.unique_id(), the WiFi MAC on a LoPy). The mapping is learned from acknowledgements, which neighbors
+    never forward: the address an acknowledgement was received from belongs to the neighbor that created it, see
+    :func:`learn_source_id`. Until then a neighbor is listed under its full mesh MAC.
+    """
+
+    __alpha = 0.3 # Weight of a new sample in the moving averages
+    __rssi_floor = -130 # dBm mapped to a quality of 0
+    __rssi_ceiling = -50 # dBm mapped to a quality of 1
+    __stale_age = 60 # Seconds without hearing a neighbor before it no longer counts as active
+    __initial_ack_probability = 0.5 # Until the first completed retransmission tells otherwise
+    __eui64_universal_bit = 1 << 57 # Flipped in the interface ID of a link-local address derived from a MAC
+
+    def __init__(self):
+        self._entries = {} # neighbor_id => [rssi, age, ack successes, ack trials, mac, rloc16]
+        self._source_ids = {} # mesh MAC => zombiegram source_id, learned from acknowledgements
+        self._ranking = None # Neighbor IDs best first, invalidated by every change
+        self._lock = allocate_lock() # Refreshed by the processor thread, acknowledgements arrive on the receive thread
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, neighbor_id):
+        return neighbor_id in self._entries
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._entries)) # Acknowledgements may re-key entries while the caller iterates
+
+    def update(self, records):
+        """Refresh the table from the mesh neighbor records
+
+        :param records: Records as returned by Loramesh.neighbors(), tuples (mac, role, rloc16, rssi, age); may be None
+        """
+        seen = set()
+        alpha = NeighborTable.__alpha
+        with self._lock:
+            for record in records or ():
+                neighbor_id = self._source_ids.get(record[0], record[0])
+                seen.add(neighbor_id)
+                entry = self._entries.get(neighbor_id)
+                if entry is None:
+                    self._entries[neighbor_id] = [record[3], record[4], NeighborTable.__initial_ack_probability, 1, record[0], record[2]]
+                else:
+                    entry[0] += alpha * (record[3] - entry[0])
+                    entry[1] += alpha * (record[4] - entry[1])
+                    entry[4] = record[0]
+                    entry[5] = record[2]
+            for neighbor_id in list(self._entries):
+                if neighbor_id not in seen:
+                    self._source_ids.pop(self._entries.pop(neighbor_id)[4], None) # Learned again once it is back
+            self._ranking = None
+
+    def learn_source_id(self, address, source_id):
+        """Map the neighbor an acknowledgement was received from onto the source_id of that acknowledgement
+
+        Only the RLOC address (prefix:0:ff:fe00:rloc16) and the link-local address derived from the mesh MAC can be
+        resolved to a neighbor, acknowledgements received from other addresses are ignored.
+
+        :param str address: IPv6 address the acknowledgement was received from
+        :param int source_id: source_id of the acknowledgement zombiegram
+        :return: Whether the address belongs to a known neighbor
+        :rtype: bool
+        """
+        rloc16, mac = NeighborTable._parse_address(address)
+        if rloc16 is None and mac is None:
+            return False
+        with self._lock:
+            for neighbor_id, entry in self._entries.items():
+                if entry[5] == rloc16 or entry[4] == mac:
+                    if neighbor_id != source_id:
+                        del self._entries[neighbor_id]
+                        self._entries[source_id] = entry
+                        self._source_ids[entry[4]] = source_id
+                        self._ranking = None
+                    return True
+        return False
+
+    @staticmethod
+    def _parse_address(address):
+        """Retrieve the tuple (rloc16, mac) a mesh IPv6 address was derived from, either or both may be None"""
+        try:
+            parts = address.split("%")[0].split("::")
+            head = [int(group, 16) for group in parts[0].split(":") if group]
+            tail = [int(group, 16) for group in parts[1].split(":") if group] if len(parts) > 1 else []
+            groups = head + [0] * (8 - len(head) - len(tail)) + tail
+        except (AttributeError, ValueError):
+            return None, None
+        if len(groups) != 8:
+            return None, None
+        if groups[4:7] == [0, 0xFF, 0xFE00]:
+            return groups[7], None
+        if groups[0] == 0xFE80:
+            interface_id = (groups[4] << 48) | (groups[5] << 32) | (groups[6] << 16) | groups[7]
+            return None, interface_id ^ NeighborTable.__eui64_universal_bit
+        return None, None
+
+    def record_acknowledgements(self, acked_ids, transmissions=1, source_id=None):
+        """Feed the outcome of a completed zombiegram into the ack probabilities
+
+        :param acked_ids: Source IDs of the devices that acknowledged the zombiegram, a dict source ID => transmissions
+                          until the ack arrived or any other container (then acks count as arrived after the first)
+        :param int transmissions: Amount of transmissions neighbors had the chance to acknowledge
+        :param int source_id: Originator of the zombiegram, left out since it never acknowledges its own zombiegrams
+        """
+        alpha = NeighborTable.__alpha
+        with self._lock:
+            for neighbor_id, entry in self._entries.items():
+                if neighbor_id == source_id:
+                    continue
+                if neighbor_id in acked_ids:
+                    successes, trials = 1, (acked_ids[neighbor_id] if isinstance(acked_ids, dict) else 1)
+                elif transmissions:
+                    successes, trials = 0, transmissions
+                else:
+                    continue # Its ack might still have been on its way
+                entry[2] += alpha * (successes - entry[2])
+                entry[3] += alpha * (trials - entry[3])
+            self._ranking = None
+
+    def ack_probability(self, neighbor_id=None):
+        """Retrieve the estimated chance a single transmission gets acknowledged by a neighbor
+
+        :param neighbor_id: Neighbor ID, None for the mean over all neighbors
+        :return: Probability, the initial estimate for unknown neighbors
+        :rtype: float
+        """
+        if neighbor_id is None:
+            with self._lock:
+                if not self._entries:
+                    return NeighborTable.__initial_ack_probability
+                return sum(entry[2] / entry[3] for entry in self._entries.values()) / len(self._entries)
+        with self._lock:
+            entry = self._entries.get(neighbor_id)
+            if entry is None:
+                return NeighborTable.__initial_ack_probability
+            return entry[2] / entry[3]
+
+    def quality(self, neighbor_id):
+        """Retrieve the link quality of a neighbor in range [0,1], 0 for unknown neighbors
+
+        Half of the score is the RSSI mapped linearly from [-130,-50] dBm onto [0,1], 40% is the ack probability and the
+        remaining 10% the freshness (1 when just heard, 0.5 once the neighbor reaches the stale age).
+        """
+        with self._lock:
+            entry = self._entries.get(neighbor_id)
+            return NeighborTable._quality(entry) if entry is not None else 0
+
+    @staticmethod
+    def _quality(entry):
+        rssi = (entry[0] - NeighborTable.__rssi_floor) / (NeighborTable.__rssi_ceiling - NeighborTable.__rssi_floor)
+        rssi = min(1, max(0, rssi))
+        freshness = 1 / (1 + max(0, entry[1]) / NeighborTable.__stale_age)
+        return 0.5 * rssi + 0.4 * (entry[2] / entry[3]) + 0.1 * freshness
+
+    def best(self, k=None):
+        """Retrieve the neighbor IDs with the best link quality, best first
+
+        :param int k: Amount of neighbors, all of them when None
+        :rtype: list
+        """
+        with self._lock:
+            if self._ranking is None:
+                self._ranking = sorted(self._entries, key=lambda neighbor_id: NeighborTable._quality(self._entries[neighbor_id]), reverse=True)
+            return self._ranking[:k] if k is not None else list(self._ranking)
+
+    def active_count(self):
+        """Retrieve the amount of neighbors heard from within the stale age"""
+        with self._lock:
+            return sum(1 for entry in self._entries.values() if entry[1] <= NeighborTable.__stale_age)
+
+    def get(self, neighbor_id):
+        """Retrieve a dict with the smoothed link statistics of a neighbor or None when it is unknown"""
+        with self._lock:
+            entry = self._entries.get(neighbor_id)
+            if entry is None:
+                return None
+            return {"id": neighbor_id, "mac": entry[4], "rloc16": entry[5], "rssi": entry[0], "age": entry[1],
+                    "ack_probability": entry[2] / entry[3], "quality": NeighborTable._quality(entry)}
+
+    def snapshot(self):
+        """Retrieve the statistics of every neighbor, best first"""
+        return [self.get(neighbor_id) for neighbor_id in self.best()]
@@ -0,0 +1,198 @@
+class ReplayWindow:
+    """Sliding anti-replay window over 8 bit sequence numbers (cf. IPsec anti-replay)
+
+    The window remembers the highest sequence number seen and a bitmap of which of the `size` numbers up to and
+    including it were seen. Sequence numbers wrap around at 256; a number up to 127 ahead of the highest one is
+    considered new, anything else is considered behind. Numbers that fall behind the window are considered new without
+    moving the window, so a late retransmission of an old frame does not make the recent ones look new again. They are
+    tracked in a second window of their own instead: sources pick a random first sequence number on every boot, which
+    lands behind the window of a previous boot about half of the time, and once three consecutive numbers of such
+    a restarted sequence were seen the window restarts from there.
+
+    Membership and insert are O(1). With a size of at most 30 the bitmap stays a small int on 32 bit µpython ports,
+    so updating the window does not allocate.
+    """
+
+    __seq_space = 256
+    __half_seq_space = 128
+    __resync_run = 3
+
+    def __init__(self, size=30):
+        """Constructor
+
+        :param int size: Amount of sequence numbers tracked, in range [1,128]
+        :raises ValueError: When the size is out of range
+        """
+        if not isinstance(size, int) or size <= 0 or size > ReplayWindow.__half_seq_space:
+            raise ValueError("Size has to be an integer in range [1,128]")
+        self._size = size
+        self._mask = (1 << size) - 1
+        self._highest = None
+        self._bitmap = 0
+        self._run_highest = None  # Window over the numbers behind the main window, see add
+        self._run_bitmap = 0
+        self._run_length = 0
+
+    def __contains__(self, seq_num):
+        if self._highest is None:
+            return False
+        behind = (self._highest - seq_num) % ReplayWindow.__seq_space
+        if behind >= ReplayWindow.__half_seq_space:  # Ahead of the window
+            return False
+        if behind < self._size:
+            return bool((self._bitmap >> behind) & 1)
+        if not self._run_length:
+            return False
+        behind = (self._run_highest - seq_num) % ReplayWindow.__seq_space
+        return behind < self._size and bool((self._run_bitmap >> behind) & 1)
+
+    def __repr__(self):
+        return "ReplayWindow(highest={}, bitmap={:b})".format(self._highest, self._bitmap)
+
+    def add(self, seq_num):
+        """Mark a sequence number as seen
+
+        :param int seq_num: Sequence number in range [0,255]
+        """
+        if self._highest is None:
+            self._highest = seq_num
+            self._bitmap = 1
+            return
+
+        ahead = (seq_num - self._highest) % ReplayWindow.__seq_space
+        if 0 < ahead < ReplayWindow.__half_seq_space:
+            if ahead >= self._size:
+                self._bitmap = 1
+            else:
+                self._bitmap = ((self._bitmap & (self._mask >> ahead)) << ahead) | 1
+            self._highest = seq_num
+            self._run_length = 0
+            return
+
+        behind = (self._highest - seq_num) % ReplayWindow.__seq_space
+        if behind < self._size:
+            self._bitmap |= 1 << behind
+            return
+
+        # Behind the window: a late retransmission or a restarted sequence, which only replaces the window once it
+        # progressed for a few numbers
+        ahead = (seq_num - self._run_highest) % ReplayWindow.__seq_space if self._run_length else 0
+        behind = (self._run_highest - seq_num) % ReplayWindow.__seq_space if self._run_length else 0
+        if 0 < ahead < self._size:
+            self._run_bitmap = ((self._run_bitmap & (self._mask >> ahead)) << ahead) | 1
+            self._run_highest = seq_num
+            self._run_length += 1
+        elif self._run_length and behind < self._size:
+            self._run_bitmap |= 1 << behind
+        else:
+            self._run_highest = seq_num
+            self._run_bitmap = 1
+            self._run_length = 1
+        if self._run_length >= ReplayWindow.__resync_run:
+            self._highest = self._run_highest
+            self._bitmap = self._run_bitmap
+            self._run_length = 0
+
+    append = add  # Drop-in for DropQueue
+
+    def get_state(self):
+        """Retrieve the window state as a tuple (highest seq_num or None, bitmap)"""
+        return self._highest, self._bitmap
+
+    def set_state(self, highest, bitmap):
+        """Restore a window state previously retrieved with :func:`get_state`"""
+        self._highest = highest
+        self._bitmap = bitmap & self._mask
+        self._run_length = 0
+
+
+class ReplayWindowTable:
+    """Replay windows for a bounded amount of sources
+
+    When more than `max_sources` sources are tracked, the least recently used one is evicted. This keeps the heap
+    usage fixed even when flooded with spoofed source IDs.
+    """
+
+    def __init__(self, max_sources=64, window_size=30):
+        """Constructor
+
+        :param int max_sources: Maximum amount of tracked sources
+        :param int window_size: Size of every source's replay window, see :class:`ReplayWindow`
+        :raises ValueError: When max_sources is not a positive integer
+        """
+        if not isinstance(max_sources, int) or max_sources <= 0:
+            raise ValueError("Max sources has to be an integer >0")
+        self._max_sources = max_sources
+        self._window_size = window_size
+        self._windows = {}  # source_id => [ReplayWindow, last use]
+        self._clock = 0
+
+    def __contains__(self, source_id):
+        return source_id in self._windows
+
+    def __len__(self):
+        return len(self._windows)
+
+    def __iter__(self):
+        return iter(self._windows)
+
+    def _touch(self, source_id, create):
+        self._clock += 1
+        entry = self._windows.get(source_id)
+        if entry is None:
+            if not create:
+                return None
+            if len(self._windows) >= self._max_sources:
+                self._evict()
+            entry = [ReplayWindow(self._window_size), self._clock]
+            self._windows[source_id] = entry
+        else:
+            entry[1] = self._clock
+        return entry[0]
+
+    def _evict(self):
+        oldest_source = None
+        oldest_use = None
+        for source_id, entry in self._windows.items():
+            if oldest_use is None or entry[1] < oldest_use:
+                oldest_source = source_id
+                oldest_use = entry[1]
+        self._windows.pop(oldest_source, None)
+
+    def is_replay(self, source_id, seq_num):
+        """Check whether a (source_id, seq_num) pair was seen before
+
+        :rtype: bool
+        """
+        window = self._touch(source_id, False)
+        return window is not None and seq_num in window
+
+    def add(self, source_id, seq_num):
+        """Mark a (source_id, seq_num) pair as seen, evicting the least recently used source if needed"""
+        self._touch(source_id, True).add(seq_num)
+
+    def get(self, source_id):
+        """Retrieve the replay window of a source or None when it is not tracked"""
+        entry = self._windows.get(source_id)
+        return entry[0] if entry else None
+
+    def get_state(self):
+        """Retrieve the state of every window as a list of (source_id, highest seq_num, bitmap), least recently used first
+
+        Windows that never saw a sequence number are left out.
+        """
+        entries = sorted(self._windows.items(), key=lambda item: item[1][1])
+        state = []
+        for source_id, entry in entries:
+            highest, bitmap = entry[0].get_state()
+            if highest is not None:
+                state.append((source_id, highest, bitmap))
+        return state
+
+    def set_state(self, state):
+        """Restore windows previously retrieved with :func:`get_state`, in addition to the ones already tracked
+
+        :param state: Iterable of (source_id, highest seq_num, bitmap), least recently used first
+        """
+        for source_id, highest, bitmap in state:
+            self._touch(source_id, True).set_state(highest, bitmap)
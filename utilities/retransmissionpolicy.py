@@ -0,0 +1,124 @@
+from volatileconfiguration import VolatileConfiguration as Config
+
+
+class AdaptiveRetransmissionPolicy:
+    """Retransmission thresholds and attempt budgets derived from the observed ack probability of every neighbor
+
+    Every neighbor that acknowledged a zombiegram holds a copy of it. Its own links are assumed to be as good as its link
+    to us, so with the ack probability p_i of that link (see NeighborTable.ack_probability()) it carries the zombiegram
+    further within its own (re)transmissions with r_i = 1 - (1 - p_i)^3. A zombiegram counts as delivered once the chance
+    that at least one acknowledging neighbor carries it further reaches the configured target of its priority:
+
+        1 - prod(1 - r_i for every acknowledging neighbor i) >= target
+
+    Good links complete after a single ack, lossy regions collect more acks before giving up on retransmitting. The
+    attempt budget is the amount of retransmissions after which the neighbors that did not acknowledge yet are expected
+    to lift the delivery probability to the target (each of them receives n transmissions with 1 - (1 - p)^n), so dense
+    neighborhoods stop flooding early and sparse ones keep trying longer.
+    """
+
+    __target_config_keys = ("lora_delivery_target_low", "lora_delivery_target_normal", "lora_delivery_target_high", "lora_delivery_target_urgent")
+    __default_targets = (0.7, 0.8, 0.9, 0.99) # low, normal, high and urgent respectively
+    __max_target = 0.999 # A target of 1 can never be reached
+    __min_ack_probability = 0.05 # No neighbor is considered completely hopeless
+    __max_ack_probability = 0.95 # Nor completely reliable
+    __relay_transmissions = 3 # Transmissions an acknowledging neighbor is assumed to spend on carrying a zombiegram further
+    __min_attempts = 1
+    __max_attempts = 6
+
+    def __init__(self, neighbors, config=Config):
+        """Constructor
+
+        :param neighbors: NeighborTable providing the ack probabilities
+        :param config: Configuration the targets are read from, defaults to the global VolatileConfiguration
+        """
+        self._neighbors = neighbors
+        self._config = config
+
+    def target(self, priority):
+        """Retrieve the configured target delivery probability of a priority, falls back to the default on bad input"""
+        default = AdaptiveRetransmissionPolicy.__default_targets[priority]
+        try:
+            target = float(self._config.get(AdaptiveRetransmissionPolicy.__target_config_keys[priority], default))
+        except (TypeError, ValueError):
+            target = default
+        return min(AdaptiveRetransmissionPolicy.__max_target, max(0.0, target))
+
+    def ack_probability(self, neighbor_id):
+        probability = self._neighbors.ack_probability(neighbor_id)
+        return min(AdaptiveRetransmissionPolicy.__max_ack_probability, max(AdaptiveRetransmissionPolicy.__min_ack_probability, probability))
+
+    def relay_probability(self, neighbor_id):
+        return 1 - (1 - self.ack_probability(neighbor_id)) ** AdaptiveRetransmissionPolicy.__relay_transmissions
+
+    def delivery_probability(self, acked_ids, own_message=True):
+        """Retrieve the probability that at least one holder of the zombiegram carries it further
+
+        :param acked_ids: Source IDs of the devices that acknowledged the zombiegram
+        :param bool own_message: Forwarded zombiegrams are already held by the neighbor they came from, which is
+                                 accounted for as an average neighbor
+        """
+        miss = 1.0
+        for neighbor_id in acked_ids:
+            miss *= 1 - self.relay_probability(neighbor_id)
+        if not own_message and len(self._neighbors):
+            miss *= 1 - self.relay_probability(None)
+        return 1 - miss
+
+    def is_delivered(self, zombiegram, acked_ids, own_message, neighbor_count):
+        """Whether a cached zombiegram reached its target and needs no further retransmissions
+
+        :param zombiegram: The cached zombiegram
+        :param acked_ids: Source IDs of the devices that acknowledged the zombiegram
+        :param bool own_message: Whether the zombiegram originates from this device
+        :param int neighbor_count: Current (active) neighbor count
+        :rtype: bool
+        """
+        if not own_message and neighbor_count <= 1:
+            return True # The only neighbor is the one we got it from
+        if zombiegram.source_id in self._neighbors:
+            neighbor_count -= 1 # The originator never acknowledges its own zombiegram
+        if len(acked_ids) >= neighbor_count:
+            return True # Every neighbor has it, retransmitting cannot improve anything
+        return self.delivery_probability(acked_ids, own_message) >= self.target(zombiegram.priority)
+
+    def max_attempts(self, zombiegram, acked_ids, own_message):
+        """Retrieve the amount of retransmissions a cached zombiegram is given
+
+        The smallest n for which the expected delivery probability after n more transmissions reaches the target,
+        clamped to [1, 6].
+
+        :param zombiegram: The cached zombiegram
+        :param acked_ids: Source IDs of the devices that acknowledged the zombiegram
+        :param bool own_message: Whether the zombiegram originates from this device
+        :rtype: int
+        """
+        target = self.target(zombiegram.priority)
+        held_miss = 1 - self.delivery_probability(acked_ids, own_message)
+        pending = [(self.ack_probability(neighbor_id), self.relay_probability(neighbor_id)) for neighbor_id in self._neighbors
+                   if neighbor_id not in acked_ids and neighbor_id != zombiegram.source_id]
+        for attempts in range(AdaptiveRetransmissionPolicy.__min_attempts, AdaptiveRetransmissionPolicy.__max_attempts):
+            miss = held_miss
+            for probability, relay_probability in pending:
+                miss *= 1 - relay_probability * (1 - (1 - probability) ** attempts)
+            if 1 - miss >= target:
+                return attempts
+        return AdaptiveRetransmissionPolicy.__max_attempts
+
+    def snapshot(self):
+        """Retrieve the current targets and attempt budgets (of own, not yet acknowledged zombiegrams) per priority plus
+        the ack probability of every neighbor"""
+        priorities = range(len(AdaptiveRetransmissionPolicy.__default_targets))
+        return {
+            "targets": [self.target(priority) for priority in priorities],
+            "attempts": [self.max_attempts(AdaptiveRetransmissionPolicy._Unsent(priority), (), True) for priority in priorities],
+            "neighbors": [[neighbor_id, self.ack_probability(neighbor_id)] for neighbor_id in self._neighbors.best()],
+        }
+
+    class _Unsent:
+        """Stands in for a zombiegram of this device that did not get any acknowledgement yet"""
+
+        source_id = None
+
+        def __init__(self, priority):
+            self.priority = priority
@@ -48,6 +48,37 @@ def mount_device():
         raise SdNotAvailable()
 
 
+def file_size(filename):
+    """Retrieve the size of a file in the device directory on the SD card
+
+    :param str filename: filename, can include subdirectory listings
+    :return: Size in bytes, 0 when the file does not exist
+    :rtype: int
+    :raises SdNotMounted: When the SD card is not mounted
+    """
+    global __mounted, __device_directory
+    if not __mounted:
+        raise SdNotMounted()
+    try:
+        return os.stat(__device_directory + filename)[6]
+    except OSError:
+        return 0
+
+def remove_file(filename):
+    """Remove a file from the device directory on the SD card, files that do not exist are ignored
+
+    :param str filename: filename, can include subdirectory listings
+    :raises SdNotMounted: When the SD card is not mounted
+    """
+    global __mounted, __device_directory
+    if not __mounted:
+        raise SdNotMounted()
+    try:
+        os.remove(__device_directory + filename)
+    except OSError:
+        pass
+
+
 class FileHandler:
     def __init__(self, filename, mode):
         """Wrapper for file handling on the SD card
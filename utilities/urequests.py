@@ -1,18 +1,55 @@
 import usocket
 import logging
+from _thread import allocate_lock
+from clock import monotonic_ms
+
+try:
+    from errno import ECONNRESET, EPIPE
+except ImportError: # Not every µpython port lists EPIPE, these are the lwIP numbers
+    ECONNRESET, EPIPE = 104, 32
+
+
+class ConnectionClosed(OSError): # The server closed the connection before sending a status line
+    pass
+
 
 class Response:
 
-    def __init__(self, f):
-        self.raw = f
+    def __init__(self, body, connection=None, session=None):
+        """HTTP response
+
+        :param body: Body reader, see :class:`BodyReader`
+        :param connection: Connection the response was received on; handed back to the session once the body is consumed
+        :param session: Session owning the connection
+        """
+        self.raw = body
         self.encoding = "utf-8"
+        self.status_code = None
+        self.reason = ""
+        self.headers = {} # Lowercase header name => value
         self._cached = None
+        self._connection = connection
+        self._session = session
 
     def close(self):
+        """Release the connection; a keep-alive connection goes back to the session pool when its body can be drained"""
         if self.raw:
-            self.raw.close()
+            self._cached = None
+            if self._connection is not None and self._session is not None and self.raw.drain(Session.max_drain_bytes):
+                self._session._release(self._connection)
+            elif self._connection is not None:
+                self._connection.close()
             self.raw = None
-        self._cached = None
+            self._connection = None
+
+    def _finish(self):
+        if self._connection is not None:
+            if self._session is not None and self.raw.complete:
+                self._session._release(self._connection)
+            else:
+                self._connection.close()
+            self._connection = None
+        self.raw = None
 
     @property
     def content(self):
@@ -20,8 +57,7 @@ class Response:
             try:
                 self._cached = self.raw.read()
             finally:
-                self.raw.close()
-                self.raw = None
+                self._finish()
         return self._cached
 
     @property
@@ -32,84 +68,372 @@ class Response:
         import ujson
         return ujson.loads(self.content)
 
+    def iter_content(self, chunk_size=256):
+        """Stream the response body without holding it in memory as a whole
 
-def request(method, url, data=None, json=None, headers={}, stream=None):
-    try:
-        proto, dummy, host, path = url.split("/", 3)
-    except ValueError:
-        proto, dummy, host = url.split("/", 2)
-        path = ""
-    if proto == "http:":
-        port = 80
-    elif proto == "https:":
-        import ussl
-        port = 443
-    else:
-        raise ValueError("Unsupported protocol: " + proto)
-
-    if ":" in host:
-        host, port = host.split(":", 1)
-        port = int(port)
-
-
-    # ai = usocket.getaddrinfo(host, port, 0, usocket.SOCK_STREAM)
-    # ai = ai[0]
-    # NOTE JHERBOTS: Manually craft getaddrinfo() return since this is an infinite blocking call and set a timeout on the socket to avoid blockage
-    ai = (usocket.AF_INET, usocket.SOCK_STREAM, 6, '', (host, port))
-
-    s = usocket.socket(ai[0], ai[1], ai[2])
-    s.settimeout(3.0)
-    try:
-        s.connect(ai[-1])
-        if proto == "https:":
-            s = ussl.wrap_socket(s, server_hostname=host)
-        s.write(b"%s /%s HTTP/1.0\r\n" % (method, path))
+        :param int chunk_size: Maximal size of the yielded chunks
+        """
+        if self._cached is not None:
+            yield self._cached
+            return
+        try:
+            while True:
+                chunk = self.raw.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            self._finish()
+
+
+class BodyReader:
+    """Reads a response body delimited by Content-Length, chunked transfer encoding or the connection closing"""
+
+    def __init__(self, connection, length=None, chunked=False):
+        self._connection = connection
+        self._remaining = length # Bytes left of the body or of the current chunk
+        self._chunked = chunked
+        self.complete = length == 0 and not chunked
+        self._until_close = length is None and not chunked
+
+    def _next_chunk(self):
+        line = self._connection.readline()
+        if not line:
+            raise OSError("Connection closed in chunked body")
+        size = int(line.split(b";", 1)[0].strip(), 16)
+        if size == 0:
+            while True: # Trailers
+                line = self._connection.readline()
+                if not line or line == b"\r\n":
+                    break
+            self.complete = True
+        self._remaining = size
+
+    def read(self, size=-1):
+        """Read up to size bytes of the body, everything that is left when size is negative"""
+        output = b""
+        while not self.complete and (size < 0 or len(output) < size):
+            if self._until_close:
+                data = self._connection.read(size - len(output) if size >= 0 else 4096)
+                if not data:
+                    self.complete = True
+                output += data
+                continue
+            if self._chunked and not self._remaining:
+                self._next_chunk()
+                continue
+            wanted = self._remaining if size < 0 else min(self._remaining, size - len(output))
+            data = self._connection.read(wanted)
+            if not data:
+                raise OSError("Connection closed in body")
+            output += data
+            self._remaining -= len(data)
+            if not self._remaining:
+                if self._chunked:
+                    self._connection.readline() # CRLF behind every chunk
+                else:
+                    self.complete = True
+        return output
+
+    def drain(self, limit):
+        """Discard the rest of the body so the connection can be reused
+
+        :param int limit: Maximal bytes to discard, bigger leftovers are not worth it
+        :return: True when the body was fully consumed
+        :rtype: bool
+        """
+        if self._until_close:
+            return False
+        try:
+            while not self.complete and limit > 0:
+                limit -= len(self.read(min(limit, 256)))
+        except OSError:
+            return False
+        return self.complete
+
+
+class Connection:
+    """A (possibly TLS wrapped) socket to a single host"""
+
+    def __init__(self, proto, host, port, timeout):
+        self.key = (proto, host, port)
+        self.last_used = monotonic_ms()
+        # NOTE JHERBOTS: Manually craft getaddrinfo() return since this is an infinite blocking call and set a timeout on the socket to avoid blockage
+        ai = (usocket.AF_INET, usocket.SOCK_STREAM, 6, '', (host, port))
+        s = usocket.socket(ai[0], ai[1], ai[2])
+        s.settimeout(timeout)
+        try:
+            s.connect(ai[-1])
+            if proto == "https:":
+                import ussl
+                s = ussl.wrap_socket(s, server_hostname=host)
+        except OSError:
+            s.close()
+            raise
+        self._socket = s
+
+    def settimeout(self, timeout):
+        try:
+            self._socket.settimeout(timeout)
+        except (AttributeError, OSError): # Not supported by every TLS socket
+            pass
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self._socket.write(data)
+
+    def readline(self):
+        return self._socket.readline()
+
+    def read(self, size):
+        return self._socket.read(size)
+
+    def close(self):
+        if self._socket:
+            try:
+                self._socket.close()
+            except OSError: # Peer already gone
+                pass
+            self._socket = None
+
+
+class Session:
+    """HTTP/1.1 client keeping connections alive between requests
+
+    Idle connections are pooled per (protocol, host, port) and evicted after idle_timeout seconds. Request bodies can be
+    bytes, str, a file-like object with read() or an iterable of chunks; the latter two are streamed with chunked
+    transfer encoding unless a Content-Length header is given. Responses with chunked bodies are supported and
+    redirects are followed.
+    """
+
+    max_drain_bytes = 1024 # Unread response bytes discarded on close() to keep a connection reusable
+    __max_redirects = 5
+    __stream_chunk_size = 256
+
+    def __init__(self, idle_timeout=30, max_idle_per_host=2, timeout=3.0):
+        """Constructor
+
+        :param int idle_timeout: Seconds after which an unused pooled connection is closed
+        :param int max_idle_per_host: Maximum amount of pooled connections per host
+        :param float timeout: Socket timeout in seconds
+        """
+        self._idle_timeout_ms = int(idle_timeout * 1000)
+        self._max_idle_per_host = max_idle_per_host
+        self._timeout = timeout
+        self._pool = {} # (proto, host, port) => [idle Connection]
+        self._lock = allocate_lock()
+
+    def close(self):
+        """Close every pooled connection"""
+        with self._lock:
+            for connections in self._pool.values():
+                for connection in connections:
+                    connection.close()
+            self._pool = {}
+
+    def _evict_idle(self, now):
+        for key in list(self._pool):
+            connections = self._pool[key]
+            for connection in connections[:]:
+                if now - connection.last_used > self._idle_timeout_ms:
+                    connection.close()
+                    connections.remove(connection)
+            if not connections:
+                del self._pool[key]
+
+    def _acquire(self, key):
+        with self._lock:
+            self._evict_idle(monotonic_ms())
+            connections = self._pool.get(key)
+            if connections:
+                return connections.pop()
+        return None
+
+    def _release(self, connection):
+        connection.last_used = monotonic_ms()
+        with self._lock:
+            connections = self._pool.setdefault(connection.key, [])
+            if len(connections) < self._max_idle_per_host:
+                connection.settimeout(self._timeout)
+                connections.append(connection)
+                return
+        connection.close()
+
+    @staticmethod
+    def _parse_url(url):
+        try:
+            proto, dummy, host, path = url.split("/", 3)
+        except ValueError:
+            proto, dummy, host = url.split("/", 2)
+            path = ""
+        if proto == "http:":
+            port = 80
+        elif proto == "https:":
+            port = 443
+        else:
+            raise ValueError("Unsupported protocol: " + proto)
+
+        if ":" in host:
+            host, port = host.split(":", 1)
+            port = int(port)
+        return proto, host, port, path
+
+    def _send(self, connection, method, host, path, data, headers):
+        connection.write("%s /%s HTTP/1.1\r\n" % (method, path))
         if not "Host" in headers:
-            s.write(b"Host: %s\r\n" % host)
+            connection.write("Host: %s\r\n" % host)
         # Iterate over keys to avoid tuple alloc
         for k in headers:
-            s.write(k)
-            s.write(b": ")
-            s.write(headers[k])
-            s.write(b"\r\n")
-        if json is not None:
-            assert data is None
-            import ujson
-            data = ujson.dumps(json)
-            s.write(b"Content-Type: application/json\r\n")
-        if data:
-            s.write(b"Content-Length: %d\r\n" % len(data))
-        s.write(b"\r\n")
-        if data:
-            s.write(data)
-
-        l = s.readline()
-        #print(l)
+            connection.write(k)
+            connection.write(b": ")
+            connection.write(headers[k])
+            connection.write(b"\r\n")
+
+        streamed = data is not None and not isinstance(data, (bytes, bytearray, str))
+        if streamed and not "Content-Length" in headers:
+            connection.write(b"Transfer-Encoding: chunked\r\n\r\n")
+            for chunk in Session._iterate_body(data):
+                if chunk:
+                    connection.write("%x\r\n" % len(chunk))
+                    connection.write(chunk)
+                    connection.write(b"\r\n")
+            connection.write(b"0\r\n\r\n")
+            return
+        if not streamed and data:
+            connection.write("Content-Length: %d\r\n" % len(data))
+        elif data is None and method in ("POST", "PUT", "PATCH"):
+            connection.write(b"Content-Length: 0\r\n")
+        connection.write(b"\r\n")
+        if streamed:
+            for chunk in Session._iterate_body(data):
+                connection.write(chunk)
+        elif data:
+            connection.write(data)
+
+    @staticmethod
+    def _iterate_body(data):
+        if hasattr(data, "read"):
+            while True:
+                chunk = data.read(Session.__stream_chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        else:
+            for chunk in data:
+                yield chunk
+
+    def _receive(self, connection, method):
+        l = connection.readline()
+        if not l:
+            raise ConnectionClosed("Connection closed before response")
         l = l.split(None, 2)
+        version = l[0]
         status = int(l[1])
         reason = ""
         if len(l) > 2:
             reason = l[2].rstrip()
+        response_headers = {}
         while True:
-            l = s.readline()
+            l = connection.readline()
             if not l or l == b"\r\n":
                 break
-            #print(l)
-            if l.startswith(b"Transfer-Encoding:"):
-                if b"chunked" in l:
-                    raise ValueError("Unsupported " + l)
-            elif l.startswith(b"Location:") and not 200 <= status <= 299:
-                raise NotImplementedError("Redirects not yet supported")
-    except OSError as e:
-        s.close()
-        logging.getLogger("urequests").warning("Request failed | Reason [{}]".format(str(e)))
-        raise
-
-    resp = Response(s)
-    resp.status_code = status
-    resp.reason = reason
-    return resp
+            name, _, value = l.partition(b":")
+            response_headers[str(name.strip(), "ascii").lower()] = str(value.strip(), "ascii")
+
+        connection_header = response_headers.get("connection", "").lower()
+        keep_alive = connection_header != "close" and (version != b"HTTP/1.0" or connection_header == "keep-alive")
+        if method == "HEAD" or status in (204, 304) or 100 <= status <= 199:
+            body = BodyReader(connection, 0)
+        elif "chunked" in response_headers.get("transfer-encoding", ""):
+            body = BodyReader(connection, chunked=True)
+        elif "content-length" in response_headers:
+            body = BodyReader(connection, int(response_headers["content-length"]))
+        else:
+            body = BodyReader(connection)
+            keep_alive = False
+
+        resp = Response(body, connection, self if keep_alive else None)
+        resp.status_code = status
+        resp.reason = reason
+        resp.headers = response_headers
+        return resp
 
+    def request(self, method, url, data=None, json=None, headers={}, stream=None, allow_redirects=True):
+        """Perform an HTTP request
+
+        :param str method: HTTP method
+        :param str url: http:// or https:// URL
+        :param data: Request body; bytes, str, a file-like object with read() or an iterable of bytes chunks
+        :param json: JSON serializable request body, mutually exclusive with data
+        :param dict headers: Additional request headers
+        :param stream: Unused, bodies are only read on access (see :func:`Response.iter_content`)
+        :param bool allow_redirects: Follow 301, 302, 303, 307 and 308 responses. Redirects that would have to send a
+                                     streamed body again are returned to the caller as is.
+        :return: Response, close it (or read its content) to hand the connection back to the pool
+        :rtype: Response
+        """
+        if json is not None:
+            assert data is None
+            import ujson
+            data = ujson.dumps(json)
+            headers = dict(headers)
+            headers["Content-Type"] = "application/json"
+        if isinstance(data, str):
+            data = data.encode()
+
+        for _ in range(Session.__max_redirects + 1):
+            resp = self._request_once(method, url, data, headers)
+            if not allow_redirects or resp.status_code not in (301, 302, 303, 307, 308) or "location" not in resp.headers:
+                return resp
+            drop_body = resp.status_code == 303 or (resp.status_code in (301, 302) and method == "POST")
+            if not drop_body and data is not None and not isinstance(data, (bytes, bytearray)):
+                return resp # A streamed body is consumed and can not be sent again, leave the redirect to the caller
+            location = resp.headers["location"]
+            resp.close()
+            if location.startswith("/"):
+                proto, host, port, path = Session._parse_url(url)
+                location = "{}//{}:{}{}".format(proto, host, port, location)
+            if drop_body:
+                method = "GET"
+                data = None
+            url = location
+        raise OSError("Too many redirects")
+
+    def _request_once(self, method, url, data, headers):
+        proto, host, port, path = Session._parse_url(url)
+        key = (proto, host, port)
+
+        connection = self._acquire(key)
+        replayable = data is None or isinstance(data, (bytes, bytearray))
+        while True:
+            reused = connection is not None
+            sent = False
+            try:
+                if not reused:
+                    connection = Connection(proto, host, port, self._timeout)
+                self._send(connection, method, host, path, data, headers)
+                sent = True
+                return self._receive(connection, method)
+            except OSError as e:
+                if connection is not None:
+                    connection.close()
+                # The server closed the idle connection meanwhile: the write is refused or no status line arrives. Any
+                # other failure, a timeout in particular, may come after the server accepted the request; retrying
+                # those would send it twice
+                stale = isinstance(e, ConnectionClosed) if sent else (e.args and e.args[0] in (ECONNRESET, EPIPE))
+                if reused and replayable and stale: # Retry on a new connection
+                    connection = None
+                    continue
+                logging.getLogger("urequests").warning("Request failed | Reason [{}]".format(str(e)))
+                raise
+
+
+_default_session = Session()
+
+
+def request(method, url, data=None, json=None, headers={}, stream=None):
+    return _default_session.request(method, url, data=data, json=json, headers=headers, stream=stream)
 
 def head(url, **kw):
     return request("HEAD", url, **kw)